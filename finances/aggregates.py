@@ -0,0 +1,281 @@
+"""
+Incremental maintenance of the monthly transaction summaries
+"""
+import datetime
+import itertools
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from .models import CENTS, ArchivedTransaction, BalanceCheckpoint, MonthlySummary, Transaction
+
+REBUILD_BATCH_SIZE = 5000
+
+
+def month_of(date):
+    """
+    Return the first day of the month of the date
+    """
+    return date.replace(day=1)
+
+
+def summary_key(user_id, category_id, transaction_type, month):
+    return {
+        "user_id": user_id,
+        "category_id": category_id,
+        "transaction_type": transaction_type,
+        "month": month,
+    }
+
+
+def apply_to_summaries(transactions, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) the transactions from the summaries.
+
+    Must run inside the database transaction that saves or deletes the
+    transactions, so the summaries never disagree with the ledger.
+    """
+    deltas = transaction_deltas(transactions, sign)
+    for key, (total, count) in deltas.items():
+        update_summary(summary_key(*key), total, count)
+    invalidate_checkpoints(deltas)
+
+
+def transaction_deltas(transactions, sign=1):
+    """
+    Return the summary deltas of transactions already in memory, keyed
+    by (user_id, category_id, transaction_type, month)
+    """
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for item in transactions:
+        key = (
+            item.user_id,
+            item.category_id,
+            item.transaction_type,
+            month_of(item.date_created),
+        )
+        deltas[key][0] += sign * item.amount
+        deltas[key][1] += sign
+    return deltas
+
+
+def update_summary(key, total, count):
+    """
+    Atomically shift the totals of a summary row, creating it if needed
+    """
+    changes = {"total": F("total") + total, "count": F("count") + count}
+    if MonthlySummary.objects.filter(**key).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            MonthlySummary.objects.create(**key, total=total, count=count)
+    except IntegrityError:
+        # Another request created the row first
+        MonthlySummary.objects.filter(**key).update(**changes)
+
+
+def grouped_deltas(queryset, sign=1):
+    """
+    Return the summary deltas of the transactions of a queryset, keyed
+    like apply_to_summaries, with one GROUP BY query.
+
+    Rows are grouped by day and rolled up to months here, truncating the
+    date in SQL calls a function on every row on SQLite.
+    """
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    rows = (
+        queryset
+        .values_list("user_id", "category_id", "transaction_type", "date_created")
+        .annotate(day_total=Sum("amount"), day_count=Count("id"))
+        .order_by()
+    )
+    for user_id, category_id, transaction_type, date_created, total, count in rows.iterator():
+        key = (user_id, category_id, transaction_type, month_of(date_created))
+        # SQLite sums decimals as floating point numbers
+        deltas[key][0] += sign * total.quantize(CENTS)
+        deltas[key][1] += sign * count
+    return deltas
+
+
+def balance_effect(deltas):
+    """
+    The change of the balances of the users described by the deltas
+    """
+    effects = defaultdict(Decimal)
+    for (user_id, _, transaction_type, _), (total, _) in deltas.items():
+        effects[user_id] += -total if transaction_type == "EX" else total
+    return effects
+
+
+def shift_summaries(deltas):
+    """
+    Apply many summary deltas with a read, a delete and a bulk insert,
+    instead of an UPDATE per summary row.
+
+    Must run inside a transaction. The rows are locked where the database
+    supports it, SQLite already holds the write lock of an IMMEDIATE
+    transaction.
+    """
+    if not deltas:
+        return
+    existing = {}
+    rows = MonthlySummary.objects.select_for_update().filter(
+        user_id__in={key[0] for key in deltas},
+        category_id__in={key[1] for key in deltas},
+        month__in={key[3] for key in deltas},
+    )
+    for summary in rows:
+        key = (summary.user_id, summary.category_id, summary.transaction_type, summary.month)
+        existing[key] = summary
+
+    changed, created = [], []
+    for key, (total, count) in deltas.items():
+        if key in existing:
+            summary = existing[key]
+            summary.total += total
+            summary.count += count
+            changed.append(summary)
+        else:
+            created.append(MonthlySummary(**summary_key(*key), total=total, count=count))
+    # Replacing the changed rows is much cheaper than the CASE per row of
+    # bulk_update, nothing references the summaries by id
+    for start in range(0, len(changed), REBUILD_BATCH_SIZE):
+        batch = changed[start:start + REBUILD_BATCH_SIZE]
+        MonthlySummary.objects.filter(pk__in=[summary.pk for summary in batch]).delete()
+    for summary in changed:
+        summary.pk = None
+    MonthlySummary.objects.bulk_create(changed + created, batch_size=REBUILD_BATCH_SIZE)
+    invalidate_checkpoints(deltas)
+
+
+def invalidate_checkpoints(deltas):
+    """
+    Delete the balance checkpoints that the deltas make wrong, they are
+    rebuilt when a historical balance needs them.
+
+    Checkpoints only exist up to the current month, so the usual
+    transactions of the current month cost no query. Moves between
+    categories do not change the balance and cost none either.
+    """
+    current = month_of(datetime.date.today())
+    effects = defaultdict(Decimal)
+    for (user_id, _, transaction_type, month), (total, _) in deltas.items():
+        if month < current:
+            effects[(user_id, month)] += -total if transaction_type == "EX" else total
+    earliest = {}
+    for (user_id, month), effect in effects.items():
+        if effect and (user_id not in earliest or month < earliest[user_id]):
+            earliest[user_id] = month
+    for user_id, month in earliest.items():
+        BalanceCheckpoint.objects.filter(user_id=user_id, month__gt=month).delete()
+
+
+def ledger_totals(users=None, model=Transaction):
+    """
+    Group the transactions like the summaries with a single query
+    """
+    queryset = model.objects.all()
+    if users is not None:
+        queryset = queryset.filter(user__in=users)
+    return (
+        queryset
+        .annotate(month=TruncMonth("date_created"))
+        .values("user_id", "category_id", "transaction_type", "month")
+        .annotate(total=Sum("amount"), count=Count("id"))
+        .order_by()
+    )
+
+
+def ledger_rows(users=None, chunk_size=REBUILD_BATCH_SIZE):
+    """
+    Yield the grouped totals of the ledger and of the archive, merged
+    where a month has rows in both tables
+    """
+    archived = {}
+    for row in ledger_totals(users, ArchivedTransaction).iterator(chunk_size=chunk_size):
+        archived[(row["user_id"], row["category_id"], row["transaction_type"], row["month"])] = row
+    for row in ledger_totals(users).iterator(chunk_size=chunk_size):
+        key = (row["user_id"], row["category_id"], row["transaction_type"], row["month"])
+        if key in archived:
+            other = archived.pop(key)
+            row["total"] += other["total"]
+            row["count"] += other["count"]
+        yield row
+    yield from archived.values()
+
+
+def rebuild_summaries(users=None, batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recompute the summaries from scratch and return the rows written
+    """
+    summaries = MonthlySummary.objects.all()
+    if users is not None:
+        summaries = summaries.filter(user__in=users)
+
+    checkpoints = BalanceCheckpoint.objects.all()
+    if users is not None:
+        checkpoints = checkpoints.filter(user__in=users)
+
+    written = 0
+    with transaction.atomic():
+        checkpoints.delete()
+        summaries.delete()
+        rows = (
+            MonthlySummary(**row)
+            for row in ledger_rows(users, chunk_size=batch_size)
+        )
+        while batch := list(itertools.islice(rows, batch_size)):
+            MonthlySummary.objects.bulk_create(batch)
+            written += len(batch)
+    return written
+
+
+def check_summaries(users=None):
+    """
+    Compare the summaries with a full GROUP BY over the ledger and the
+    archive.
+
+    Return a list of (key, expected, stored) tuples, where expected and
+    stored are (total, count) pairs and None means the row is missing.
+    """
+    expected = {}
+    for row in ledger_rows(users):
+        key = (row["user_id"], row["category_id"], row["transaction_type"], row["month"])
+        expected[key] = (row["total"].quantize(CENTS), row["count"])
+
+    summaries = MonthlySummary.objects.all()
+    if users is not None:
+        summaries = summaries.filter(user__in=users)
+    stored = {}
+    for row in summaries.values_list(
+            "user_id", "category_id", "transaction_type", "month", "total", "count"):
+        total, count = row[4:]
+        # Rows emptied by deletions are equivalent to missing rows
+        if count:
+            stored[row[:4]] = (total, count)
+
+    mismatches = []
+    for key in expected.keys() | stored.keys():
+        if expected.get(key) != stored.get(key):
+            mismatches.append((key, expected.get(key), stored.get(key)))
+    return mismatches
+
+
+REPORT_TOTALS = {
+    "incomes": Sum("total", filter=Q(transaction_type="IN"), default=0),
+    "expenses": Sum("total", filter=Q(transaction_type="EX"), default=0),
+    "count": Sum("count", default=0),
+}
+
+
+def report_totals(user):
+    """
+    Return the income and expense totals and the transaction count of
+    the user from the summaries
+    """
+    return MonthlySummary.objects.filter(user=user).aggregate(**REPORT_TOTALS)
+
+
+async def areport_totals(user):
+    return await MonthlySummary.objects.filter(user=user).aaggregate(**REPORT_TOTALS)
@@ -0,0 +1,188 @@
+"""
+Time series of incomes and expenses aggregated in SQL
+"""
+import datetime
+from decimal import Decimal
+from django.db.models import Sum
+from .archive import reaches_archive
+from .models import CENTS, ArchivedTransaction, Category, MonthlySummary, Transaction
+
+GRANULARITIES = ("day", "week", "month")
+GROUPINGS = {
+    "type": "transaction_type",
+    # Categories of the same title are still separate series
+    "category": "category_id",
+}
+DEFAULT_WINDOW = 3
+
+
+def period_axis(first, last, granularity):
+    """
+    Return every period start between first and last, both included
+    """
+    periods = []
+    current = first
+    while current <= last:
+        periods.append(current)
+        if granularity == "day":
+            current += datetime.timedelta(days=1)
+        elif granularity == "week":
+            current += datetime.timedelta(weeks=1)
+        elif current.month == 12:
+            current = current.replace(year=current.year + 1, month=1)
+        else:
+            current = current.replace(month=current.month + 1)
+    return periods
+
+
+def grouped_totals(user, granularity, group_by, date_from=None, date_to=None,
+                   model=Transaction):
+    """
+    Return (period, key, total) rows summed in SQL, ordered by period.
+
+    Monthly series read the monthly summaries instead of the ledger. Days
+    and weeks group the ledger by its date column, which the indexes
+    cover, and weeks are rolled up from days afterwards: truncating the
+    date in SQL would call a function on every row. model selects the
+    ledger or the archive.
+    """
+    if granularity == "month":
+        queryset = MonthlySummary.objects.filter(user=user, count__gt=0)
+        date_field, total_field = "month", "total"
+        # The summaries have a monthly resolution
+        if date_from is not None:
+            date_from = date_from.replace(day=1)
+    else:
+        queryset = model.objects.filter(user=user)
+        date_field, total_field = "date_created", "amount"
+
+    if date_from is not None:
+        queryset = queryset.filter(**{f"{date_field}__gte": date_from})
+    if date_to is not None:
+        queryset = queryset.filter(**{f"{date_field}__lte": date_to})
+
+    return (
+        queryset
+        .values_list(date_field, GROUPINGS[group_by])
+        .annotate(period_total=Sum(total_field))
+        .order_by(date_field)
+    )
+
+
+def series_labels(user, group_by, keys):
+    """
+    The label of every key of the series: the name of the transaction
+    type or the title of the category
+    """
+    if group_by == "type":
+        return dict(Transaction.TRANSACTION_TYPES)
+    return dict(Category.objects.filter(user=user, pk__in=keys).values_list("id", "title"))
+
+
+def moving_average(values, window):
+    """
+    Average of the last window values of every position, shorter at the
+    start of the series
+    """
+    averages = []
+    running = 0
+    for index, value in enumerate(values):
+        running += value
+        if index >= window:
+            running -= values[index - window]
+        averages.append(running / min(index + 1, window))
+    return averages
+
+
+def cumulative(values):
+    """
+    Running total of the values up to every position
+    """
+    result = []
+    running = 0
+    for value in values:
+        running += value
+        result.append(running)
+    return result
+
+
+def deltas(values):
+    """
+    Change of every period against the previous one
+    """
+    return [value - previous for previous, value in zip([0] + list(values), values)]
+
+
+def as_money(values):
+    """
+    Convert cents to rounded units for JSON
+    """
+    return [round(float(value) / 100, 2) for value in values]
+
+
+def totals_matrix(rows, keys, periods):
+    """
+    Place the totals in a keys x periods matrix of integer cents, so the
+    sums stay exact
+    """
+    key_positions = {key: index for index, key in enumerate(keys)}
+    period_positions = {period: index for index, period in enumerate(periods)}
+    matrix = [[0] * len(periods) for _ in keys]
+    for period, key, total in rows:
+        # SQLite sums decimals as floating point numbers, round them to
+        # cents before they are truncated to integers
+        cents = int(Decimal(total).quantize(CENTS) * 100)
+        matrix[key_positions[key]][period_positions[period]] += cents
+    return matrix
+
+
+def time_series(user, granularity="month", group_by="type", window=DEFAULT_WINDOW,
+                date_from=None, date_to=None):
+    """
+    Build the series of every group over a contiguous period axis. When
+    grouped by type, also add the net flow and the running balance over
+    the requested range.
+    """
+    result = {
+        "granularity": granularity,
+        "group_by": group_by,
+        "periods": [],
+        "series": {},
+        "net": {},
+    }
+    rows = list(grouped_totals(user, granularity, group_by, date_from, date_to))
+    if granularity != "month" and reaches_archive(user, date_from, date_to):
+        rows += grouped_totals(
+            user, granularity, group_by, date_from, date_to, model=ArchivedTransaction)
+        rows.sort(key=lambda row: row[0])
+    if not rows:
+        return result
+    if granularity == "week":
+        rows = [
+            (period - datetime.timedelta(days=period.weekday()), key, total)
+            for period, key, total in rows
+        ]
+
+    periods = period_axis(rows[0][0], rows[-1][0], granularity)
+    keys = sorted({key for _, key, _ in rows})
+    matrix = totals_matrix(rows, keys, periods)
+    labels = series_labels(user, group_by, keys)
+    result["periods"] = [period.isoformat() for period in periods]
+    for key, values in zip(keys, matrix):
+        result["series"][key] = {
+            "label": labels.get(key, key),
+            "totals": as_money(values),
+            "moving_average": as_money(moving_average(values, window)),
+            "delta": as_money(deltas(values)),
+        }
+
+    if group_by == "type":
+        empty = [0] * len(periods)
+        incomes = matrix[keys.index("IN")] if "IN" in keys else empty
+        expenses = matrix[keys.index("EX")] if "EX" in keys else empty
+        net = [income - expense for income, expense in zip(incomes, expenses)]
+        result["net"] = {
+            "totals": as_money(net),
+            "running_balance": as_money(cumulative(net)),
+        }
+    return result
@@ -0,0 +1,163 @@
+"""
+Compact JSON serialization of the read-only API, built from values()
+querysets without instantiating models
+"""
+import base64
+import binascii
+import datetime
+import json
+import zlib
+from decimal import Decimal
+from types import SimpleNamespace
+from django.db.models import F, Max
+from django.http import Http404, HttpResponse
+from .models import Category, Transaction
+from .pagination import KeysetPaginator
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+API_PAGE_SIZE = 100
+TRANSACTION_FIELDS = (
+    "id", "title", "description", "amount", "currency", "original_amount", "category_id")
+TRANSACTION_ALIASES = {
+    "date": F("date_created"),
+    "type": F("transaction_type"),
+}
+CATEGORY_FIELDS = ("id", "title", "description")
+
+
+def encode_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """
+    Encode the data as compact JSON bytes, with orjson when installed
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=encode_default)
+    return json.dumps(
+        data, separators=(",", ":"), ensure_ascii=False, default=encode_default).encode()
+
+
+def json_response(data):
+    """
+    The data as a compact JSON response
+    """
+    return HttpResponse(dumps(data), content_type="application/json")
+
+
+def data_etag(request, *args, **kwargs):
+    """
+    Weak ETag of the data version of the user and the query, read from
+    the user of the request without another query
+    """
+    user = request.user
+    query = zlib.crc32(request.META.get("QUERY_STRING", "").encode())
+    return f'W/"{user.pk}.{user.data_version}-{query:x}"'
+
+
+class ValuesKeysetPaginator(KeysetPaginator):
+    """
+    Keyset pagination of the transaction rows of transaction_rows
+    """
+    @staticmethod
+    def encode_cursor(row, reverse=False):
+        return KeysetPaginator.encode_cursor(
+            SimpleNamespace(date_created=row["date"], id=row["id"]), reverse)
+
+
+def encode_sync_cursor(version, last_id):
+    """
+    Build an opaque delta sync token from the data version of the user
+    and the last transaction id the client has
+    """
+    raw = json.dumps({"v": version, "i": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_sync_cursor(cursor):
+    """
+    Return the (version, last id) tuple of a token
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        return int(payload["v"]), int(payload["i"])
+    except (binascii.Error, ValueError, KeyError, TypeError) as error:
+        raise Http404("Invalid sync cursor") from error
+
+
+def transaction_rows(user, transaction_type=None):
+    """
+    The transactions of the user as dicts of the API fields
+    """
+    queryset = Transaction.objects.filter(user=user)
+    if transaction_type is not None:
+        queryset = queryset.filter(transaction_type=transaction_type)
+    return queryset.values(*TRANSACTION_FIELDS, **TRANSACTION_ALIASES)
+
+
+def transactions_page(user, cursor=None, transaction_type=None):
+    """
+    A page of the transactions of the user, newest first. The first page
+    also carries the cursor to start delta syncs from.
+    """
+    # The versions of the user were read before the rows, a change in
+    # between makes the next sync fetch it again or start over
+    page = ValuesKeysetPaginator(
+        transaction_rows(user, transaction_type), API_PAGE_SIZE).page(cursor)
+    data = {
+        "results": page.object_list,
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+    }
+    if not cursor:
+        last_id = Transaction.objects.filter(user=user).aggregate(last=Max("id"))["last"]
+        data["sync"] = encode_sync_cursor(user.data_version, last_id or 0)
+    return data
+
+
+def transactions_since(user, cursor, transaction_type=None):
+    """
+    The transactions added after the sync cursor, oldest first.
+
+    Only additions are sent: when transactions were changed or deleted
+    since the cursor was issued, the response asks the client to reset
+    and load the listing again.
+
+    Paging by id skips no addition: every writer locks the user row with
+    its balance UPDATE before inserting, so the transactions of a user
+    commit in the order of their ids.
+    """
+    since, last_id = decode_sync_cursor(cursor)
+    # A version ahead of the user was not issued from its row
+    if not user.rewrite_version <= since <= user.data_version:
+        return {"reset": True}
+    rows = list(
+        transaction_rows(user, transaction_type)
+        .filter(id__gt=last_id).order_by("id")[:API_PAGE_SIZE + 1]
+    )
+    has_more = len(rows) > API_PAGE_SIZE
+    rows = rows[:API_PAGE_SIZE]
+    if rows:
+        last_id = rows[-1]["id"]
+    return {
+        "results": rows,
+        "sync": encode_sync_cursor(user.data_version, last_id),
+        "has_more": has_more,
+    }
+
+
+def category_rows(user):
+    """
+    Every category of the user
+    """
+    return list(Category.objects.filter(user=user).order_by("id").values(*CATEGORY_FIELDS))
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class FinancesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'finances'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+        from .db import configure_sqlite
+        from .search import repair_search_index
+        connection_created.connect(configure_sqlite, dispatch_uid="configure_sqlite")
+        post_migrate.connect(repair_search_index, sender=self)
@@ -0,0 +1,77 @@
+"""
+Archival of old transactions.
+
+Old rows are moved out of the ledger into the archive table, so the hot
+table and its indexes only hold recent history. The monthly summaries
+and the balances keep counting the archived rows, so totals and reports
+do not change. Listings and series read the archive only when their
+date range reaches before the archive date of the user.
+"""
+from django.db import transaction
+from django.db.models import Q
+from .caching import forget_user, invalidate_on_commit
+from .models import ArchivedTransaction, CustomUser, Transaction
+
+ARCHIVE_BATCH_SIZE = 2000
+ARCHIVE_FIELDS = tuple(
+    field.attname for field in ArchivedTransaction._meta.concrete_fields)
+
+
+def reaches_archive(user, date_from=None, date_to=None):
+    """
+    Whether a date range asks for archived transactions of the user. An
+    open range only does when its other end is set.
+    """
+    archived_before = user.archived_before
+    if archived_before is None or (date_from is None and date_to is None):
+        return False
+    return date_from is None or date_from < archived_before
+
+
+def archive_batch(queryset, before, last_id, batch_size):
+    """
+    Move the next batch of transactions of the queryset with an id above
+    last_id. Return the moved rows as dicts.
+    """
+    with transaction.atomic():
+        rows = list(
+            queryset.filter(id__gt=last_id)
+            .order_by("id")
+            .values(*ARCHIVE_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return rows
+        ArchivedTransaction.objects.bulk_create(
+            ArchivedTransaction(**row) for row in rows)
+        Transaction.objects.filter(id__in=[row["id"] for row in rows]).delete()
+        # Set with the first moved rows, listings never miss any of them
+        user_ids = {row["user_id"] for row in rows}
+        CustomUser.objects.filter(id__in=user_ids).filter(
+            Q(archived_before__isnull=True) | Q(archived_before__lt=before)
+        ).update(archived_before=before)
+        for user_id in user_ids:
+            forget_user(user_id)
+            invalidate_on_commit(user_id, rewrite=True)
+    return rows
+
+
+def archive_transactions(before, users=None, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    """
+    Move the transactions dated before the date into the archive table,
+    batch by batch. Every batch commits on its own, an interrupted run
+    leaves each row in one of the tables and can be started again.
+
+    progress is called with the number of rows moved so far after every
+    batch. Return the number of rows moved.
+    """
+    queryset = Transaction.objects.filter(date_created__lt=before)
+    if users is not None:
+        queryset = queryset.filter(user__in=users)
+    moved = 0
+    last_id = 0
+    while rows := archive_batch(queryset, before, last_id, batch_size):
+        moved += len(rows)
+        last_id = rows[-1]["id"]
+        if progress is not None:
+            progress(moved)
+    return moved
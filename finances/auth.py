@@ -0,0 +1,15 @@
+"""
+Authentication backend with a cached per-request user load
+"""
+from django.contrib.auth.backends import ModelBackend
+from .caching import get_cached_user
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that serves the user of each request from the cache
+    instead of a query, see caching.get_cached_user. The cache must be
+    shared by every process, the finances.E001 check enforces it.
+    """
+    def get_user(self, user_id):
+        return get_cached_user(user_id, lambda: super(CachedModelBackend, self).get_user(user_id))
@@ -0,0 +1,123 @@
+"""
+Historical balances from monthly checkpoints, and reconciliation of
+the stored balances with the ledger
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+from .aggregates import month_of
+from .caching import forget_user, invalidate_on_commit
+from .models import (
+    CENTS, ArchivedTransaction, BalanceCheckpoint, CustomUser, MonthlySummary, Transaction,
+)
+
+SIGNED_TOTAL = Sum(Case(When(transaction_type="EX", then=-F("total")), default=F("total")))
+SIGNED_AMOUNT = Sum(Case(When(transaction_type="EX", then=-F("amount")), default=F("amount")))
+
+
+def next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def build_checkpoints(user):
+    """
+    Replace the checkpoints of the user with one per month, from the
+    first month of the summaries to the current month
+    """
+    current = month_of(datetime.date.today())
+    effects = dict(
+        MonthlySummary.objects.filter(user=user, month__lt=current)
+        .values_list("month")
+        .annotate(effect=SIGNED_TOTAL)
+        .order_by("month")
+    )
+    first = min(effects, default=current)
+    checkpoints = []
+    balance = Decimal(0)
+    month = first
+    while month <= current:
+        checkpoints.append(BalanceCheckpoint(user=user, month=month, balance=balance))
+        balance += Decimal(effects.get(month, 0)).quantize(CENTS)
+        month = next_month(month)
+    with transaction.atomic():
+        BalanceCheckpoint.objects.filter(user=user).delete()
+        BalanceCheckpoint.objects.bulk_create(checkpoints)
+    return checkpoints
+
+
+def balance_on(user, date):
+    """
+    Return the balance of the user at the end of the date: the last
+    checkpoint before it plus the transactions since, at most a month of
+    rows in the usual case
+    """
+    checkpoint = (
+        BalanceCheckpoint.objects.filter(user=user, month__lte=date)
+        .order_by("-month").first()
+    )
+    if checkpoint is None:
+        if BalanceCheckpoint.objects.filter(user=user).exists():
+            # The date is older than the first transaction
+            return Decimal("0.00")
+        build_checkpoints(user)
+        return balance_on(user, date)
+    since = {"user": user, "date_created__gte": checkpoint.month, "date_created__lte": date}
+    balance = checkpoint.balance + Transaction.objects.filter(**since).balance_effect()
+    if user.archived_before is not None and checkpoint.month < user.archived_before:
+        balance += ArchivedTransaction.objects.filter(**since).balance_effect()
+    return balance
+
+
+def ledger_balances(user_ids):
+    """
+    Return the balance of each user according to the ledger and the
+    archive, with one aggregate query per table
+    """
+    balances = {user_id: Decimal("0.00") for user_id in user_ids}
+    for model in (Transaction, ArchivedTransaction):
+        rows = (
+            model.objects.filter(user_id__in=user_ids)
+            .values_list("user_id")
+            .annotate(balance=SIGNED_AMOUNT)
+            .order_by()
+        )
+        for user_id, balance in rows:
+            # SQLite sums decimals as floating point numbers
+            balances[user_id] += Decimal(balance).quantize(CENTS)
+    return balances
+
+
+def reconcile_users(user_ids, repair=False):
+    """
+    Compare the stored balance of the users with the ledger. Return the
+    (user id, stored, expected) tuples of the users that drifted, and fix
+    them when repair is set.
+    """
+    drifts = []
+    with transaction.atomic():
+        users = CustomUser.objects.filter(id__in=user_ids)
+        if repair:
+            # Lock the users before reading the ledger, so that no
+            # transaction commits between the two reads
+            users = users.select_for_update()
+        stored_balances = list(users.values_list("id", "total_amount"))
+        expected = ledger_balances(user_ids)
+        for user_id, stored in stored_balances:
+            if stored != expected[user_id]:
+                drifts.append((user_id, stored, expected[user_id]))
+        if repair:
+            fixes = defaultdict(list)
+            for user_id, stored, balance in drifts:
+                fixes[balance - stored].append(user_id)
+            # Shift rather than overwrite, like every other balance change
+            for drift, fixed in fixes.items():
+                CustomUser.objects.filter(id__in=fixed).update(
+                    total_amount=F("total_amount") + drift)
+                for user_id in fixed:
+                    forget_user(user_id)
+                    invalidate_on_commit(user_id)
+    return drifts
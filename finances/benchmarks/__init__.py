@@ -0,0 +1,3 @@
+"""
+Synthetic data and timing helpers for the finances benchmarks
+"""
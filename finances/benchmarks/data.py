@@ -0,0 +1,129 @@
+"""
+Synthetic data generator for benchmarks and load tests
+"""
+import datetime
+import itertools
+import random
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from finances.models import Category, CustomUser, ExchangeRate, Transaction
+
+DEFAULT_BATCH_SIZE = 10000
+# Words of the generated titles and descriptions, so text searches match
+# a realistic share of the ledger
+WORDS = (
+    "rent", "salary", "coffee", "groceries", "market", "train", "taxi", "fuel",
+    "insurance", "pharmacy", "dentist", "gym", "cinema", "books", "restaurant",
+    "pizza", "bakery", "electricity", "water", "internet", "phone", "hotel",
+    "flight", "gift", "charity", "tuition", "laptop", "furniture", "garden",
+    "plumber", "repair", "parking", "toll", "subscription", "music", "streaming",
+    "clothes", "shoes", "haircut", "vet", "bonus", "refund", "interest",
+    "dividend", "freelance", "invoice", "transfer", "savings", "loan", "tax",
+)
+
+
+def create_user(username, categories=10):
+    """
+    Create a user with a set of categories
+    """
+    user = CustomUser.objects.create_user(username, password="benchmark")
+    Category.objects.bulk_create(
+        Category(title=f"Category {number}", user=user)
+        for number in range(categories)
+    )
+    return user
+
+
+def create_users(prefix, count, categories=10, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Bulk create count users sharing one password hash, each with a set
+    of categories, and return them
+    """
+    password = make_password("benchmark")
+    users = CustomUser.objects.bulk_create(
+        (CustomUser(username=f"{prefix}-{number}", password=password) for number in range(count)),
+        batch_size=batch_size,
+    )
+    Category.objects.bulk_create(
+        (
+            Category(title=f"Category {number}", user=user)
+            for user in users
+            for number in range(categories)
+        ),
+        batch_size=batch_size,
+    )
+    return users
+
+
+def generate_transactions(user, size, days=365 * 3, seed=0):
+    """
+    Yield unsaved transactions spread over the last days for the user
+    """
+    rng = random.Random(seed)
+    categories = list(Category.objects.filter(user=user).values_list("id", flat=True))
+    today = datetime.date.today()
+    for number in range(size):
+        yield Transaction(
+            title=f"{rng.choice(WORDS).capitalize()} {number}",
+            description=" ".join(rng.choices(WORDS, k=3)),
+            date_created=today - datetime.timedelta(days=rng.randrange(days)),
+            transaction_type=rng.choice(("EX", "IN")),
+            amount=Decimal(rng.randrange(100, 100000)) / 100,
+            category_id=rng.choice(categories),
+            user=user,
+        )
+
+
+def generate_rates(currencies, days=365 * 3, seed=0):
+    """
+    Yield unsaved daily rates of the currencies over the last days,
+    drifting randomly around 1
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    for currency in currencies:
+        rate = 1.0
+        for day in range(days, -1, -1):
+            rate *= 1 + rng.uniform(-0.005, 0.005)
+            yield ExchangeRate(
+                date=today - datetime.timedelta(days=day),
+                currency=currency,
+                rate=Decimal(f"{rate:.6f}"),
+            )
+
+
+def populate(user, size, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+    """
+    Bulk insert size synthetic transactions for the user
+    """
+    transactions = generate_transactions(user, size, **kwargs)
+    # bulk_create materializes its input, so feed it one batch at a time
+    while batch := list(itertools.islice(transactions, batch_size)):
+        Transaction.objects.bulk_create(batch)
+
+
+def replicate(user, size):
+    """
+    Grow the ledger of the user to size rows by copying its existing rows
+    with INSERT ... SELECT, doubling it at most on each statement.
+
+    Much faster than populate for millions of rows, at the cost of
+    repeating the generated values.
+    """
+    table = connection.ops.quote_name(Transaction._meta.db_table)
+    columns = ", ".join(
+        connection.ops.quote_name(field.column)
+        for field in Transaction._meta.concrete_fields
+        if not field.primary_key
+    )
+    current = Transaction.objects.filter(user=user).count()
+    with connection.cursor() as cursor:
+        while 0 < current < size:
+            missing = min(current, size - current)
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) "
+                f"SELECT {columns} FROM {table} WHERE user_id = %s LIMIT %s",
+                [user.pk, missing],
+            )
+            current += missing
@@ -0,0 +1,108 @@
+"""
+Multi-threaded load driver for the create and delete flows, sending the
+requests through the Django test client
+"""
+import itertools
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from finances.models import Category, Transaction
+from .loadtest import LoadResult
+from .views import PASSWORD
+
+TITLE_PREFIX = "Load"
+
+
+def create_jobs(users, requests):
+    """
+    One transaction to create per request, spread over the users
+    """
+    categories = dict(
+        Category.objects.filter(user__in=users).order_by("user_id", "-id")
+        .values_list("user_id", "id")
+    )
+    for number, user in zip(range(requests), itertools.cycle(users)):
+        yield user, "post", reverse("create_transaction"), {
+            "title": f"{TITLE_PREFIX} {number}",
+            "description": "",
+            "transaction_type": "IN" if number % 3 else "EX",
+            "amount": f"{number % 500}.25",
+            "category": categories[user.pk],
+        }
+
+
+def delete_jobs(users, requests):
+    """
+    Delete the transactions left by the create flow
+    """
+    by_user = {user.pk: user for user in users}
+    rows = (
+        Transaction.objects.filter(user__in=users, title__startswith=TITLE_PREFIX)
+        .values_list("user_id", "id")[:requests]
+    )
+    for user_id, pk in rows:
+        yield by_user[user_id], "post", reverse("delete_transaction", args=[pk]), {}
+
+
+def login_jobs(users, requests):
+    """
+    Log the users in again and again with their password
+    """
+    for _, user in zip(range(requests), itertools.cycle(users)):
+        yield user, "post", reverse("login"), {"username": user.username, "password": PASSWORD}
+
+
+FLOWS = {
+    "create": create_jobs,
+    "delete": delete_jobs,
+    "login": login_jobs,
+}
+
+
+def run_flow(flow, users, requests, concurrency):
+    """
+    Send the requests of the flow from concurrency threads, each with its
+    own clients and database connection, and return a LoadResult
+    """
+    jobs = queue.SimpleQueue()
+    for job in FLOWS[flow](users, requests):
+        jobs.put(job)
+
+    def worker():
+        clients = {}
+        latencies = []
+        try:
+            while True:
+                try:
+                    user, method, path, data = jobs.get_nowait()
+                except queue.Empty:
+                    return latencies
+                if user.pk not in clients:
+                    clients[user.pk] = Client(raise_request_exception=False)
+                    clients[user.pk].force_login(user)
+                start = time.perf_counter()
+                response = getattr(clients[user.pk], method)(path, data)
+                elapsed = (time.perf_counter() - start) * 1000
+                latencies.append(elapsed if response.status_code < 400 else None)
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = [executor.submit(worker) for _ in range(concurrency)]
+        latencies = [latency for future in futures for latency in future.result()]
+    elapsed = time.perf_counter() - start
+
+    timings = sorted(latency for latency in latencies if latency is not None)
+    if not timings:
+        return LoadResult(0, len(latencies), elapsed, 0.0, 0.0)
+    return LoadResult(
+        requests=len(timings),
+        errors=len(latencies) - len(timings),
+        elapsed=elapsed,
+        p50=timings[len(timings) // 2],
+        p99=timings[max(0, int(len(timings) * 0.99) - 1)],
+    )
@@ -0,0 +1,126 @@
+"""
+Closed-loop HTTP load generator to compare the WSGI and ASGI servers
+"""
+import importlib.util
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+# Servers tried in order for each interface, the first installed one wins
+SERVERS = {
+    "wsgi": [
+        ("gunicorn", [
+            sys.executable, "-m", "gunicorn", "financialcontrol.wsgi:application",
+            "--bind", "{host}:{port}", "--workers", "{workers}", "--threads", "{threads}",
+        ]),
+        ("django", [
+            sys.executable, "manage.py", "runserver", "--noreload", "{host}:{port}",
+        ]),
+    ],
+    "asgi": [
+        ("uvicorn", [
+            sys.executable, "-m", "uvicorn", "financialcontrol.asgi:application",
+            "--host", "{host}", "--port", "{port}", "--workers", "{workers}",
+            "--no-access-log",
+        ]),
+        ("daphne", [
+            sys.executable, "-m", "daphne", "-b", "{host}", "-p", "{port}",
+            "financialcontrol.asgi:application",
+        ]),
+    ],
+}
+
+
+@dataclass
+class LoadResult:
+    """
+    Throughput and latency of a load run, latencies in milliseconds
+    """
+    requests: int
+    errors: int
+    elapsed: float
+    p50: float
+    p99: float
+
+    @property
+    def requests_per_second(self):
+        return self.requests / self.elapsed
+
+
+def server_command(interface, host, port, workers=1, threads=8):
+    """
+    Return the name and the command line of the first installed server
+    of the interface, or (None, None)
+    """
+    for name, command in SERVERS[interface]:
+        if name == "django" or importlib.util.find_spec(name) is not None:
+            values = {"host": host, "port": port, "workers": workers, "threads": threads}
+            return name, [part.format(**values) for part in command]
+    return None, None
+
+
+def start_server(command, url, timeout=30):
+    """
+    Start the server and wait until it answers the url
+    """
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{command[0]} exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return process
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"The server did not answer {url} in {timeout}s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def fetch(url, cookie):
+    """
+    Return the latency of a GET in milliseconds, None on errors
+    """
+    request = urllib.request.Request(url, headers={"Cookie": cookie})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+    except (urllib.error.URLError, ConnectionError):
+        return None
+    return (time.perf_counter() - start) * 1000
+
+
+def run_load(url, cookie, requests, concurrency):
+    """
+    Send requests GETs to the url from concurrency threads, each one
+    waiting for its response before sending the next
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(lambda _: fetch(url, cookie), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    timings = sorted(latency for latency in latencies if latency is not None)
+    if not timings:
+        return LoadResult(requests, requests, elapsed, 0.0, 0.0)
+    return LoadResult(
+        requests=len(timings),
+        errors=requests - len(timings),
+        elapsed=elapsed,
+        p50=timings[len(timings) // 2],
+        p99=timings[max(0, int(len(timings) * 0.99) - 1)],
+    )
@@ -0,0 +1,52 @@
+"""
+JSON results of the benchmark suite and their comparison between runs
+"""
+import datetime
+import platform
+import django
+from django.db import connection
+
+DEFAULT_THRESHOLD = 0.25
+
+
+def metadata(**options):
+    """
+    Describe the environment of a run, so results of different machines
+    or databases are not compared by mistake
+    """
+    return {
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "machine": platform.machine(),
+        "options": options,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Return the regressions of current against baseline as messages: views
+    slower by more than threshold or running more queries, and flows
+    with a lower throughput by more than threshold
+    """
+    regressions = []
+    for name, result in current.get("views", {}).items():
+        before = baseline.get("views", {}).get(name)
+        if before is None:
+            continue
+        if result["p50_ms"] > before["p50_ms"] * (1 + threshold):
+            regressions.append(
+                f"{name}: p50 {before['p50_ms']:.2f} ms -> {result['p50_ms']:.2f} ms")
+        if result["queries"] > before["queries"]:
+            regressions.append(
+                f"{name}: queries {before['queries']} -> {result['queries']}")
+    for flow, result in current.get("load", {}).items():
+        before = baseline.get("load", {}).get(flow)
+        if before is None:
+            continue
+        if result["requests_per_second"] < before["requests_per_second"] * (1 - threshold):
+            regressions.append(
+                f"{flow} flow: {before['requests_per_second']:.1f} req/s -> "
+                f"{result['requests_per_second']:.1f} req/s")
+    return regressions
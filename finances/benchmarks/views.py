@@ -0,0 +1,275 @@
+"""
+Microbenchmarks of every view of finances/urls.py: latency, query count
+and peak memory of the requests sent through the Django test client
+"""
+import datetime
+import itertools
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from decimal import Decimal
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from finances.aggregates import apply_to_summaries
+from finances.jobs import run_job
+from finances.models import Budget, Category, CategoryRule, Job, Transaction
+
+PASSWORD = "benchmark"
+
+
+@dataclass
+class Call:
+    """
+    A request of a scenario. Anonymous calls use a client without a
+    session.
+    """
+    method: str
+    path: str
+    data: dict = field(default_factory=dict)
+    anonymous: bool = False
+
+
+class Fixture:
+    """
+    The benchmarked user with a logged in client, and counters to build
+    unique values across iterations
+    """
+    def __init__(self, user):
+        self.user = user
+        self.category = Category.objects.filter(user=user).first()
+        self.client = Client()
+        self.anonymous = Client()
+        self.sequence = itertools.count()
+
+    def login(self):
+        self.client.force_login(self.user)
+
+    def transaction(self, category=None):
+        """
+        Create a transaction like the views do, so deleting it keeps the
+        summaries and the balance right
+        """
+        item = Transaction.objects.create(
+            title=f"Benchmark {next(self.sequence)}", transaction_type="EX",
+            amount=Decimal("1.00"), category=category or self.category, user=self.user)
+        apply_to_summaries([item])
+        self.user.apply_balance_change(item.signed_amount)
+        return item
+
+
+def transaction_data(fixture):
+    return {
+        "title": f"Benchmark {next(fixture.sequence)}",
+        "description": "",
+        "transaction_type": "EX",
+        "amount": "12.50",
+        "category": fixture.category.id,
+    }
+
+
+def import_file(fixture):
+    today = datetime.date.today().isoformat()
+    rows = "".join(
+        f"Imported {number},,EX,{number}.10,Imported,{today}\n" for number in range(100))
+    content = f"title,description,transaction_type,amount,category,date\n{rows}"
+    return SimpleUploadedFile("statement.csv", content.encode(), content_type="text/csv")
+
+
+def logout(fixture):
+    # Every iteration needs a session to end
+    fixture.login()
+    return Call("get", reverse("logout"))
+
+
+def delete_category(fixture):
+    category = Category.objects.create(title="Benchmark", user=fixture.user)
+    fixture.transaction(category)
+    return Call("post", reverse("delete_category", args=[category.id]))
+
+
+def delete_budget(fixture):
+    budget, _ = Budget.objects.get_or_create(
+        user=fixture.user, category=fixture.category, defaults={"amount": Decimal("500.00")})
+    return Call("post", reverse("delete_budget", args=[budget.id]))
+
+
+def delete_rule(fixture):
+    rule = CategoryRule.objects.create(
+        user=fixture.user, category=fixture.category, kind="K",
+        pattern=f"benchmark {next(fixture.sequence)}")
+    return Call("post", reverse("delete_rule", args=[rule.id]))
+
+
+def bulk_delete(fixture):
+    ids = [fixture.transaction().id for _ in range(10)]
+    return Call("post", reverse("bulk_transactions"), {"action": "delete", "ids": ids})
+
+
+def sync_cursor(fixture):
+    # A delta sync with one new transaction to send
+    cursor = fixture.client.get(reverse("api_transactions")).json()["sync"]
+    fixture.transaction()
+    return cursor
+
+
+def statement_job(fixture):
+    # A statement that a worker already generated
+    month = datetime.date.today().replace(day=1)
+    job = Job.objects.create(
+        user=fixture.user, kind="statement", worker="benchmark",
+        payload={"month": month.isoformat(), "format": "csv"})
+    return run_job(job)
+
+
+# Named by method and URL name, every URL name needs at least one
+# scenario. Each one builds its call before the request is measured.
+SCENARIOS = {
+    "GET home": lambda fixture: Call("get", reverse("home")),
+    "GET create_transaction": lambda fixture: Call("get", reverse("create_transaction")),
+    "POST create_transaction": lambda fixture: Call(
+        "post", reverse("create_transaction"), transaction_data(fixture)),
+    "GET import_transactions": lambda fixture: Call("get", reverse("import_transactions")),
+    "POST import_transactions": lambda fixture: Call(
+        "post", reverse("import_transactions"),
+        {"file": import_file(fixture), "file_format": "csv"}),
+    "GET create_category": lambda fixture: Call("get", reverse("create_category")),
+    "POST create_category": lambda fixture: Call(
+        "post", reverse("create_category"),
+        {"title": f"Benchmark {next(fixture.sequence)}", "description": ""}),
+    "GET delete_transaction": lambda fixture: Call(
+        "get", reverse("delete_transaction", args=[fixture.transaction().id])),
+    "POST delete_transaction": lambda fixture: Call(
+        "post", reverse("delete_transaction", args=[fixture.transaction().id])),
+    "POST bulk_transactions": bulk_delete,
+    "GET delete_category": lambda fixture: Call(
+        "get", reverse("delete_category", args=[fixture.category.id])),
+    "POST delete_category": delete_category,
+    "GET expenses": lambda fixture: Call("get", reverse("expenses")),
+    "GET incomes": lambda fixture: Call("get", reverse("incomes")),
+    "GET expenses search": lambda fixture: Call("get", reverse("expenses"), {"q": "rent"}),
+    "GET export_transactions": lambda fixture: Call("get", reverse("export_transactions")),
+    "GET analytics": lambda fixture: Call("get", reverse("analytics")),
+    "GET balance": lambda fixture: Call(
+        "get", reverse("balance"),
+        {"date": (datetime.date.today() - datetime.timedelta(days=200)).isoformat()}),
+    "GET report": lambda fixture: Call("get", reverse("report")),
+    "GET budgets": lambda fixture: Call("get", reverse("budgets")),
+    "POST budgets": lambda fixture: Call(
+        "post", reverse("budgets"), {"category": fixture.category.id, "amount": "500.00"}),
+    "POST delete_budget": delete_budget,
+    "GET rules": lambda fixture: Call("get", reverse("rules")),
+    "POST rules": lambda fixture: Call(
+        "post", reverse("rules"),
+        {"kind": "K", "pattern": f"benchmark {next(fixture.sequence)}", "priority": "100",
+         "category": fixture.category.id}),
+    "POST delete_rule": delete_rule,
+    "GET statements": lambda fixture: Call("get", reverse("statements")),
+    "POST statements": lambda fixture: Call(
+        "post", reverse("statements"),
+        {"month": f"{datetime.date.today():%Y-%m}", "format": "pdf"}),
+    "GET statement_status": lambda fixture: Call(
+        "get", reverse("statement_status", args=[statement_job(fixture).pk])),
+    "GET statement_download": lambda fixture: Call(
+        "get", reverse("statement_download", args=[statement_job(fixture).pk])),
+    "GET api_transactions": lambda fixture: Call("get", reverse("api_transactions")),
+    "GET api_transactions since": lambda fixture: Call(
+        "get", reverse("api_transactions"), {"since": sync_cursor(fixture)}),
+    "GET api_categories": lambda fixture: Call("get", reverse("api_categories")),
+    "GET api_balance": lambda fixture: Call("get", reverse("api_balance")),
+    "GET async_create_transaction": lambda fixture: Call(
+        "get", reverse("async_create_transaction")),
+    "POST async_create_transaction": lambda fixture: Call(
+        "post", reverse("async_create_transaction"), transaction_data(fixture)),
+    "GET async_expenses": lambda fixture: Call("get", reverse("async_expenses")),
+    "GET async_incomes": lambda fixture: Call("get", reverse("async_incomes")),
+    "GET async_report": lambda fixture: Call("get", reverse("async_report")),
+    "GET login": lambda fixture: Call("get", reverse("login"), anonymous=True),
+    "POST login": lambda fixture: Call(
+        "post", reverse("login"),
+        {"username": fixture.user.username, "password": PASSWORD}, anonymous=True),
+    "GET logout": logout,
+    "GET register": lambda fixture: Call("get", reverse("register"), anonymous=True),
+    "POST register": lambda fixture: Call(
+        "post", reverse("register"),
+        {
+            "username": f"benchmark-register-{next(fixture.sequence)}",
+            "password1": "Benchmark-password-1",
+            "password2": "Benchmark-password-1",
+        },
+        anonymous=True),
+}
+
+
+def send(fixture, call):
+    """
+    Send the call and consume the whole body, streamed or not
+    """
+    client = fixture.anonymous if call.anonymous else fixture.client
+    response = getattr(client, call.method)(call.path, call.data)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def percentile(timings, fraction):
+    """
+    Nearest-rank percentile of sorted timings
+    """
+    return timings[max(0, int(round(len(timings) * fraction)) - 1)]
+
+
+def measure(fixture, scenario, repeat):
+    """
+    Time repeat requests of the scenario, then trace the memory of one
+    more, since tracemalloc slows the requests down
+    """
+    timings = []
+    queries = []
+    statuses = set()
+    for _ in range(repeat):
+        call = scenario(fixture)
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = send(fixture, call)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(captured))
+        statuses.add(response.status_code)
+
+    call = scenario(fixture)
+    tracemalloc.start()
+    try:
+        send(fixture, call)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "queries": max(queries),
+        "peak_kb": round(peak / 1024, 1),
+        "status": sorted(statuses),
+    }
+
+
+def run_views(user, repeat, names=None):
+    """
+    Measure every scenario, or the named ones, for the user
+    """
+    fixture = Fixture(user)
+    results = {}
+    for name, scenario in SCENARIOS.items():
+        if names and name not in names:
+            continue
+        fixture.login()
+        # One request to warm the caches of the process and the templates
+        send(fixture, scenario(fixture))
+        results[name] = measure(fixture, scenario, repeat)
+    return results
@@ -0,0 +1,52 @@
+"""
+Monthly budgets evaluated against the expense summaries
+"""
+import datetime
+from decimal import Decimal
+from django.db.models import DecimalField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from .aggregates import month_of
+from .models import Budget, MonthlySummary
+
+MONEY = DecimalField(max_digits=100, decimal_places=2)
+
+
+def budget_statuses(user, month=None):
+    """
+    The budgets of the user annotated with what was spent in their
+    category in the month, the current one by default.
+
+    The spend comes from the monthly summaries, which every write keeps
+    up to date, so this is a single query however large the ledger is.
+    """
+    month = month_of(month or datetime.date.today())
+    spent = MonthlySummary.objects.filter(
+        user=OuterRef("user"),
+        category=OuterRef("category"),
+        transaction_type="EX",
+        month=month,
+    ).values("total")[:1]
+    return (
+        Budget.objects.filter(user=user)
+        .select_related("category")
+        .annotate(month_spend=Coalesce(
+            Subquery(spent, output_field=MONEY), Value(Decimal(0)), output_field=MONEY))
+        .order_by("category__title")
+    )
+
+
+def exceeded_budget(transaction):
+    """
+    Return the budget of the category of a saved expense when the spend
+    of its month is now over it, else None. One lookup by unique keys.
+    """
+    if transaction.transaction_type != "EX":
+        return None
+    budget = (
+        budget_statuses(transaction.user_id, transaction.date_created)
+        .filter(category_id=transaction.category_id)
+        .first()
+    )
+    if budget is not None and budget.is_over:
+        return budget
+    return None
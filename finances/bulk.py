@@ -0,0 +1,82 @@
+"""
+Set-based changes of many transactions at once
+"""
+from django.db import transaction
+from .aggregates import balance_effect, grouped_deltas, invalidate_checkpoints, shift_summaries
+from .caching import invalidate_on_commit
+from .models import ArchivedTransaction, Transaction
+
+
+def merged_deltas(querysets, sign=1):
+    """
+    The summary deltas of the transactions of every queryset, the ledger
+    and the archive are summarized alike
+    """
+    deltas = grouped_deltas(querysets[0], sign)
+    for queryset in querysets[1:]:
+        for key, (total, count) in grouped_deltas(queryset, sign).items():
+            deltas[key][0] += total
+            deltas[key][1] += count
+    return deltas
+
+
+def delete_transactions(user, queryset, archived=None):
+    """
+    Delete the transactions of the user in the queryset and revert their
+    effect on the summaries and the balance. archived is an optional
+    queryset of archived transactions deleted with them. Return the
+    number deleted.
+    """
+    querysets = [queryset.filter(user=user)]
+    if archived is not None:
+        querysets.append(archived.filter(user=user))
+    with transaction.atomic():
+        # One aggregate query per table gives the summary and balance deltas
+        deltas = merged_deltas(querysets, sign=-1)
+        if not deltas:
+            return 0
+        shift_summaries(deltas)
+        deleted = sum(queryset.delete()[0] for queryset in querysets)
+        user.apply_balance_change(balance_effect(deltas)[user.pk], rewrite=True)
+    return deleted
+
+
+def move_transactions(user, queryset, category, archived=None):
+    """
+    Move the transactions of the user in the queryset to the category,
+    the balance does not change. archived is an optional queryset of
+    archived transactions moved with them. Return the number moved.
+    """
+    querysets = [queryset.filter(user=user).exclude(category=category)]
+    if archived is not None:
+        querysets.append(archived.filter(user=user).exclude(category=category))
+    with transaction.atomic():
+        deltas = merged_deltas(querysets, sign=-1)
+        if not deltas:
+            return 0
+        for (user_id, _, transaction_type, month), (total, count) in list(deltas.items()):
+            target = deltas[(user_id, category.pk, transaction_type, month)]
+            target[0] -= total
+            target[1] -= count
+        shift_summaries(deltas)
+        moved = sum(queryset.update(category=category) for queryset in querysets)
+        invalidate_on_commit(user.pk, rewrite=True)
+    return moved
+
+
+def delete_category(user, category):
+    """
+    Delete a category of the user with its transactions and summaries,
+    reverting the transactions from the balance
+    """
+    querysets = [Transaction.objects.filter(user=user, category=category)]
+    if user.archived_before is not None:
+        querysets.append(ArchivedTransaction.objects.filter(user=user, category=category))
+    with transaction.atomic():
+        deltas = merged_deltas(querysets, sign=-1)
+        # The transactions and summaries are removed by the cascade
+        category.delete()
+        invalidate_checkpoints(deltas)
+        if deltas:
+            user.apply_balance_change(balance_effect(deltas)[user.pk])
+    # post_delete of the category invalidates the cached reports
@@ -0,0 +1,230 @@
+"""
+Per-user cache of report data, keyed on the data version of the user row
+"""
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+KEY_PREFIX = "finances"
+# How many stored keys each process remembers to detect evictions
+TRACKED_KEYS = 10000
+
+
+class CacheStats:
+    """
+    Hit, miss, eviction and invalidation counters of this process
+    """
+    def __init__(self):
+        self.stored = OrderedDict()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stored.clear()
+
+    def remember(self, key):
+        self.stored[key] = True
+        if len(self.stored) > TRACKED_KEYS:
+            self.stored.popitem(last=False)
+
+    def as_dict(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[settings.REPORT_CACHE_ALIAS]
+
+
+def version_key(user_id):
+    return f"{KEY_PREFIX}:version:{user_id}"
+
+
+def get_version(user):
+    """
+    Return the data version of the user row. A loaded user carries it, a
+    user id costs one query. None when the user does not exist.
+
+    Every process reads the same row, so a change committed by one of
+    them reaches the entries of all of them.
+    """
+    if hasattr(user, "data_version"):
+        return user.data_version
+    return (
+        get_user_model().objects.filter(pk=user)
+        .values_list("data_version", flat=True).first()
+    )
+
+
+async def aget_version(user):
+    """
+    Async version of get_version
+    """
+    if hasattr(user, "data_version"):
+        return user.data_version
+    return await (
+        get_user_model().objects.filter(pk=user)
+        .values_list("data_version", flat=True).afirst()
+    )
+
+
+def get_counter(user_id):
+    """
+    Return the version counter of the user kept in the cache, only seen by
+    every process when the cache is shared
+    """
+    cache = get_cache()
+    version = cache.get(version_key(user_id))
+    if version is None:
+        # Start from a version that was never used, in case the counter
+        # was evicted while entries of an older version are still cached
+        cache.add(version_key(user_id), time.time_ns(), timeout=None)
+        version = cache.get(version_key(user_id))
+    return version
+
+
+def bump_version(user_id):
+    """
+    Invalidate the cached user row of the user
+    """
+    cache = get_cache()
+    stats.invalidations += 1
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        # The counter was evicted, the next get_counter starts over
+        pass
+
+
+def invalidate_on_commit(user_id, rewrite=False, **changes):
+    """
+    Count the change in the data version of the user row, which keys
+    every cached entry of the user, the ETags and the delta syncs of the
+    API. The new version is committed with the data, so a concurrent
+    request can not cache the old data under it. rewrite is set by
+    changes that update or delete existing transactions instead of only
+    adding new ones. changes are other fields of the user row written by
+    the same UPDATE.
+
+    The counter of the cached user row is bumped once the transaction
+    commits.
+    """
+    changes["data_version"] = F("data_version") + 1
+    if rewrite:
+        changes["rewrite_version"] = F("data_version") + 1
+    get_user_model().objects.filter(pk=user_id).update(**changes)
+    transaction.on_commit(lambda: bump_version(user_id))
+
+
+def is_shared():
+    """
+    Whether every process reads the same cache, so the invalidations of
+    one process reach the others
+    """
+    backend = settings.CACHES[settings.REPORT_CACHE_ALIAS]["BACKEND"]
+    return backend not in settings.LOCAL_CACHE_BACKENDS
+
+
+def get_cached_user(user_id, load):
+    """
+    Return the user loaded by load, cached under the counter of the user.
+    Every change of the data bumps the counter, changes of the row itself
+    call forget_user.
+
+    Only a shared cache keeps users: a cache of each process would never
+    see the changes made by the other processes.
+    """
+    if not is_shared():
+        return load()
+    cache = get_cache()
+    key = entry_key(user_id, "user", get_counter(user_id))
+    user = cache.get(key)
+    if user is None:
+        user = load()
+        if user is not None:
+            cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+    return user
+
+
+def forget_user(user_id):
+    """
+    Drop the cached user row, without invalidating the cached reports
+    """
+    version = get_cache().get(version_key(user_id))
+    if version is not None:
+        get_cache().delete(entry_key(user_id, "user", version))
+
+
+def entry_key(user_id, name, version):
+    return f"{KEY_PREFIX}:{name}:{user_id}:{version}"
+
+
+def record_miss(key):
+    stats.misses += 1
+    if key in stats.stored:
+        stats.evictions += 1
+        del stats.stored[key]
+
+
+def get_or_compute(user, name, compute):
+    """
+    Return the cached value for the user, computing and storing it on a
+    miss. user is the user of the request, or a user id whose data
+    version is read with one query.
+    """
+    if not settings.REPORT_CACHE_ENABLED:
+        return compute()
+    version = get_version(user)
+    if version is None:
+        return compute()
+
+    cache = get_cache()
+    key = entry_key(getattr(user, "pk", user), name, version)
+    value = cache.get(key)
+    if value is not None:
+        stats.hits += 1
+        return value
+
+    record_miss(key)
+    value = compute()
+    cache.set(key, value, settings.REPORT_CACHE_TIMEOUT)
+    stats.remember(key)
+    return value
+
+
+async def aget_or_compute(user, name, compute):
+    """
+    Async version of get_or_compute, compute returns an awaitable
+    """
+    if not settings.REPORT_CACHE_ENABLED:
+        return await compute()
+    version = await aget_version(user)
+    if version is None:
+        return await compute()
+
+    cache = get_cache()
+    key = entry_key(getattr(user, "pk", user), name, version)
+    value = await cache.aget(key)
+    if value is not None:
+        stats.hits += 1
+        return value
+
+    record_miss(key)
+    value = await compute()
+    await cache.aset(key, value, settings.REPORT_CACHE_TIMEOUT)
+    stats.remember(key)
+    return value
@@ -0,0 +1,26 @@
+"""
+System checks of the finances settings
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from .caching import is_shared
+
+CACHED_BACKEND = "finances.auth.CachedModelBackend"
+
+
+@register(Tags.caches)
+def check_cached_user_backend(app_configs, **kwargs):
+    """
+    CachedModelBackend needs a cache shared by every process
+    """
+    if CACHED_BACKEND not in settings.AUTHENTICATION_BACKENDS or is_shared():
+        return []
+    return [Error(
+        f"{CACHED_BACKEND} needs a cache shared by every process.",
+        hint=(
+            f"The {settings.REPORT_CACHE_ALIAS} cache is kept by each process, so users "
+            "changed by another process would be served as they were. Set CACHE_BACKEND "
+            "to a shared backend or use django.contrib.auth.backends.ModelBackend."
+        ),
+        id="finances.E001",
+    )]
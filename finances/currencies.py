@@ -0,0 +1,286 @@
+"""
+Exchange rates and the conversion of transactions to the currency of
+their user
+"""
+import bisect
+import csv
+import datetime
+import functools
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Max, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Round
+from .aggregates import rebuild_summaries
+from .balances import ledger_balances
+from .caching import invalidate_on_commit
+from .models import (
+    CENTS, ArchivedTransaction, Budget, CustomUser, ExchangeRate, RecurringTransaction,
+    Transaction
+)
+
+DEFAULT_BATCH_SIZE = 5000
+RATE_CACHE_SIZE = 4096
+# Rates are only published on working days, the batch conversion reads
+# this much history before its first date to cover weekends and holidays
+RATE_LOOKBACK = datetime.timedelta(days=7)
+RATE = DecimalField(max_digits=20, decimal_places=8)
+# The date of the latest rate of each currency seen by this process. Files
+# add rates after it, so the lookups of the days up to it are settled and
+# kept, while the later days are read again to see the rates loaded by
+# any process.
+latest_dates = {}
+
+
+class MissingExchangeRate(Exception):
+    """
+    No rate of the currency was loaded on or before the date
+    """
+    def __init__(self, currency, date):
+        super().__init__(f"No exchange rate for {currency} on {date}.")
+        self.currency = currency
+        self.date = date
+
+
+def parse_rates(lines):
+    """
+    Yield the exchange rates of a CSV file in the layout of the ECB
+    reference rates history: a Date column, then one column per currency.
+    Missing values (N/A or empty) are skipped.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if not header:
+        return
+    currencies = [name.strip().upper() for name in header[1:]]
+    for row in reader:
+        if not row or not row[0].strip():
+            continue
+        date = datetime.date.fromisoformat(row[0].strip())
+        for currency, value in zip(currencies, row[1:]):
+            try:
+                rate = Decimal(value.strip())
+            except InvalidOperation:
+                continue
+            if currency and rate > 0:
+                yield ExchangeRate(date=date, currency=currency, rate=rate)
+
+
+def load_rates(lines, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert or update the rates of the file and return how many were
+    read. Transactions already converted keep their amounts.
+    """
+    rates = parse_rates(lines)
+    loaded = 0
+    with transaction.atomic():
+        while batch := [rate for _, rate in zip(range(batch_size), rates)]:
+            ExchangeRate.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=["currency", "date"],
+                update_fields=["rate"],
+            )
+            loaded += len(batch)
+    # Files that change settled days, such as corrections of the history,
+    # only reach the other processes when they restart
+    clear_rate_cache()
+    return loaded
+
+
+def clear_rate_cache():
+    """
+    Forget the rates looked up by this process
+    """
+    settled_rate.cache_clear()
+    latest_dates.clear()
+
+
+def latest_rate(currency, date):
+    """
+    The (date, rate) of the latest rate of the currency on or before the
+    date
+    """
+    found = (
+        ExchangeRate.objects.filter(currency=currency, date__lte=date)
+        .order_by("-date").values_list("date", "rate").first()
+    )
+    if found is None:
+        raise MissingExchangeRate(currency, date)
+    return found
+
+
+@functools.lru_cache(maxsize=RATE_CACHE_SIZE)
+def settled_rate(currency, date):
+    """
+    The rate of a day on or before the latest rate of the currency,
+    which no new rate can change
+    """
+    return latest_rate(currency, date)[1]
+
+
+def rate_on(currency, date):
+    """
+    The latest rate of the currency on or before the date
+    """
+    if currency == settings.EXCHANGE_RATE_PIVOT:
+        return Decimal(1)
+    if currency not in latest_dates:
+        latest = ExchangeRate.objects.filter(currency=currency).aggregate(latest=Max("date"))
+        if latest["latest"] is not None:
+            latest_dates[currency] = latest["latest"]
+    if currency in latest_dates and date <= latest_dates[currency]:
+        return settled_rate(currency, date)
+    rate_date, rate = latest_rate(currency, date)
+    if currency not in latest_dates or rate_date > latest_dates[currency]:
+        latest_dates[currency] = rate_date
+    return rate
+
+
+def convert(amount, currency, target, date):
+    """
+    Convert the amount at the rates of the date, rounded to cents
+    """
+    if currency == target:
+        return amount
+    rate = rate_on(target, date) / rate_on(currency, date)
+    return (amount * rate).quantize(CENTS)
+
+
+def convert_transactions(transactions, target):
+    """
+    Convert the unsaved transactions in another currency to the target
+    currency in place, keeping what was entered in original_amount.
+
+    The rates of the whole batch are read with one query and looked up
+    in memory. Return the transactions without a rate, left unchanged.
+    """
+    foreign = [item for item in transactions if item.currency and item.currency != target]
+    if not foreign:
+        return []
+
+    currencies = {item.currency for item in foreign} | {target}
+    dates = [item.date_created for item in foreign]
+    history = defaultdict(lambda: ([], []))
+    rows = (
+        ExchangeRate.objects
+        .filter(currency__in=currencies, date__gte=min(dates) - RATE_LOOKBACK,
+                date__lte=max(dates))
+        .order_by("currency", "date")
+        .values_list("currency", "date", "rate")
+    )
+    for currency, date, rate in rows:
+        history[currency][0].append(date)
+        history[currency][1].append(rate)
+
+    def lookup(currency, date):
+        if currency in history:
+            days, rates = history[currency]
+            index = bisect.bisect_right(days, date)
+            if index:
+                return rates[index - 1]
+        # The pivot, or a rate older than the window
+        return rate_on(currency, date)
+
+    missing = []
+    for item in foreign:
+        try:
+            rate = lookup(target, item.date_created) / lookup(item.currency, item.date_created)
+        except MissingExchangeRate:
+            missing.append(item)
+            continue
+        item.original_amount = item.amount
+        item.amount = (item.amount * rate).quantize(CENTS)
+    return missing
+
+
+def rate_subquery(currency=None):
+    """
+    The latest rate of the currency on or before the date of the outer
+    transaction, of the currency of the transaction when None
+    """
+    if currency is not None:
+        if currency == settings.EXCHANGE_RATE_PIVOT:
+            return Value(Decimal(1), output_field=RATE)
+        return Subquery(
+            ExchangeRate.objects
+            .filter(currency=currency, date__lte=OuterRef("date_created"))
+            .order_by("-date").values("rate")[:1],
+            output_field=RATE,
+        )
+    return Case(
+        When(currency=settings.EXCHANGE_RATE_PIVOT, then=Value(Decimal(1), output_field=RATE)),
+        default=Subquery(
+            ExchangeRate.objects
+            .filter(currency=OuterRef("currency"), date__lte=OuterRef("date_created"))
+            .order_by("-date").values("rate")[:1],
+            output_field=RATE,
+        ),
+        output_field=RATE,
+    )
+
+
+def converted_amount(target):
+    """
+    SQL expression of the original amount of a transaction in the target
+    currency, converted with the rates of its date
+    """
+    return Round(
+        F("original_amount") * rate_subquery(target) / rate_subquery(),
+        2,
+        output_field=Transaction._meta.get_field("amount"),
+    )
+
+
+@transaction.atomic
+def change_base_currency(user, currency):
+    """
+    Move the ledger, balance, budgets and recurring transactions of the
+    user to another currency.
+
+    The ledger, and the archive when the user has one, are converted by
+    a single UPDATE joining the rates of each transaction date, then the
+    summaries and the balance are rebuilt. Budgets and recurring
+    transactions are converted at the rates of today.
+    Raise MissingExchangeRate, changing nothing, when a rate is missing.
+    """
+    user = CustomUser.objects.select_for_update().get(pk=user.pk)
+    previous = user.currency
+    if currency == previous:
+        return user
+    ledgers = [Transaction.objects.filter(user=user)]
+    if user.archived_before is not None:
+        ledgers.append(ArchivedTransaction.objects.filter(user=user))
+    for ledger in ledgers:
+        # Transactions in the previous currency become foreign ones
+        ledger.filter(currency="").update(currency=previous, original_amount=F("amount"))
+
+        foreign = ledger.exclude(currency=currency)
+        unconverted = (
+            foreign
+            .annotate(source=rate_subquery(), target=rate_subquery(currency))
+            .filter(Q(source__isnull=True) | Q(target__isnull=True))
+            .values_list("currency", "date_created", "source")
+            .first()
+        )
+        if unconverted is not None:
+            source, date, source_rate = unconverted
+            raise MissingExchangeRate(currency if source_rate is not None else source, date)
+        foreign.update(amount=converted_amount(currency))
+        ledger.filter(currency=currency).update(
+            amount=F("original_amount"), currency="", original_amount=None)
+
+    today = datetime.date.today()
+    for model in (Budget, RecurringTransaction):
+        rows = list(model.objects.filter(user=user))
+        for row in rows:
+            row.amount = convert(row.amount, previous, currency, today)
+        model.objects.bulk_update(rows, ["amount"])
+
+    user.currency = currency
+    user.total_amount = ledger_balances([user.pk])[user.pk]
+    user.save(update_fields=["currency", "total_amount"])
+    rebuild_summaries([user])
+    invalidate_on_commit(user.pk, rewrite=True)
+    return user
@@ -0,0 +1,85 @@
+"""
+Streaming export of the ledger of a user
+"""
+import csv
+import heapq
+import json
+from operator import itemgetter
+from .models import ArchivedTransaction, Transaction
+
+EXPORT_CHUNK_SIZE = 2000
+# Same header as the CSV import, so exports can be imported back
+EXPORT_COLUMNS = ("title", "description", "transaction_type", "amount", "category", "date")
+EXPORT_FIELDS = (
+    "title",
+    "description",
+    "transaction_type",
+    "amount",
+    "category__title",
+    "date_created",
+)
+
+
+class Echo:
+    """
+    File-like object that returns what is written instead of storing it
+    """
+    def write(self, value):
+        return value
+
+
+def export_rows(user, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the transactions of the user as tuples, oldest first, fetching
+    them from the database chunk by chunk. Archived transactions are
+    merged in by date.
+    """
+    models = [Transaction]
+    if user.archived_before is not None:
+        models.insert(0, ArchivedTransaction)
+    streams = [
+        model.objects
+        .filter(user=user)
+        .order_by("date_created", "id")
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size=chunk_size)
+        for model in models
+    ]
+    if len(streams) == 1:
+        return streams[0]
+    return heapq.merge(*streams, key=itemgetter(EXPORT_FIELDS.index("date_created")))
+
+
+def stream_csv(rows):
+    """
+    Yield the rows encoded as CSV lines, header first
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for title, description, transaction_type, amount, category, date_created in rows:
+        yield writer.writerow((
+            title, description, transaction_type, amount, category,
+            date_created.isoformat(),
+        ))
+
+
+def stream_ndjson(rows):
+    """
+    Yield the rows encoded as one JSON object per line
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    for title, description, transaction_type, amount, category, date_created in rows:
+        yield encoder.encode({
+            "title": title,
+            "description": description,
+            "transaction_type": transaction_type,
+            "amount": str(amount),
+            "category": category,
+            "date": date_created.isoformat(),
+        }) + "\n"
+
+
+EXPORT_FORMATS = {
+    "csv": (stream_csv, "text/csv"),
+    "ndjson": (stream_ndjson, "application/x-ndjson"),
+}
@@ -0,0 +1,143 @@
+"""
+Filters and search of the transaction listings
+"""
+from django.db import connections
+from django.db.models import Q
+from django.utils.http import urlencode
+from .archive import reaches_archive
+from .caching import aget_or_compute, get_or_compute
+from .forms import TransactionFilterForm
+from .models import ArchivedTransaction, Category, Transaction
+from .search import TRANSACTION_TABLE, search_filter
+
+
+def filter_transactions(queryset, categories=(), q=None, category=None, date_from=None,
+                        date_to=None, amount_min=None, amount_max=None):
+    """
+    Narrow a transaction queryset with the given filters. categories are
+    the (id, title) pairs of the user, the search text also matches
+    their titles.
+    """
+    if date_from is not None:
+        queryset = queryset.filter(date_created__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(date_created__lte=date_to)
+    if category is not None:
+        queryset = queryset.filter(category_id=category)
+    if amount_min is not None:
+        queryset = queryset.filter(amount__gte=amount_min)
+    if amount_max is not None:
+        queryset = queryset.filter(amount__lte=amount_max)
+    if q:
+        # The search index only covers the ledger, the archive is scanned
+        indexed = queryset.model._meta.db_table == TRANSACTION_TABLE
+        condition = search_filter(q, connections[queryset.db], indexed)
+        # Match the few categories here, an OR with a subquery would stop
+        # SQLite from reading the matches of the index first
+        text = q.strip().lower()
+        matching = [pk for pk, title in categories if text in title.lower()]
+        if matching:
+            condition |= Q(category_id__in=matching)
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def category_choices(user):
+    return list(Category.objects.filter(user=user).values_list("id", "title"))
+
+
+async def acategory_choices(user):
+    return [
+        choice async for choice in
+        Category.objects.filter(user=user).values_list("id", "title")
+    ]
+
+
+class TransactionFilterMixin:
+    """
+    Filter the queryset of a listing with the query string. Filtered
+    pages are not cached, every search would get its own entry.
+
+    The listing shows the transactions of transaction_type, every type
+    when None. Date ranges that reach before the archive date of the user
+    also list the archived transactions.
+    """
+    filter_categories = None
+    transaction_type = None
+
+    def listing_queryset(self, model=Transaction):
+        queryset = model.objects.filter(user=self.request.user)
+        if self.transaction_type is not None:
+            queryset = queryset.filter(transaction_type=self.transaction_type)
+        return queryset.for_listing()
+
+    def get_queryset(self):
+        return self.filter_queryset(self.listing_queryset())
+
+    def get_archived_queryset(self):
+        form = self.get_filter_form()
+        filters = form.active_filters()
+        if not reaches_archive(
+                self.request.user, filters.get("date_from"), filters.get("date_to")):
+            return None
+        return filter_transactions(
+            self.listing_queryset(ArchivedTransaction), self.get_filter_categories(), **filters)
+
+    def get_filter_form(self):
+        if not hasattr(self, "filter_form"):
+            self.filter_form = TransactionFilterForm(self.request.GET)
+        return self.filter_form
+
+    def get_filter_categories(self):
+        if self.filter_categories is None:
+            user = self.request.user
+            self.filter_categories = get_or_compute(
+                user, "categories", lambda: category_choices(user))
+        return self.filter_categories
+
+    async def aget_filter_categories(self):
+        if self.filter_categories is None:
+            user = self.request.user
+            self.filter_categories = await aget_or_compute(
+                user, "categories", lambda: acategory_choices(user))
+        return self.filter_categories
+
+    def filter_queryset(self, queryset):
+        form = self.get_filter_form()
+        if form.is_bound and not form.is_valid():
+            return queryset.none()
+        filters = form.active_filters()
+        if not filters:
+            return queryset
+        return filter_transactions(queryset, self.get_filter_categories(), **filters)
+
+    def get_cache_name(self):
+        form = self.get_filter_form()
+        # An invalid query shows no transactions, never under the name of
+        # the unfiltered page
+        if form.is_bound and not form.is_valid() or form.active_filters():
+            return None
+        return super().get_cache_name()
+
+    def get_filter_context(self):
+        form = self.get_filter_form()
+        return {
+            "filter_form": form,
+            # Carried by the pagination links
+            "filter_query": urlencode({
+                name: value for name, value in self.request.GET.items()
+                if name in form.fields and value
+            }),
+            "filter_categories": self.get_filter_categories(),
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.get_filter_context())
+        return context
+
+    async def aget_context_data(self, **kwargs):
+        await self.aget_filter_categories()
+        context = await super().aget_context_data(**kwargs)
+        context.update(self.get_filter_context())
+        return context
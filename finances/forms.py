@@ -1,7 +1,11 @@
+import datetime
+import re
 from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
-from .models import Category, CustomUser, Transaction
+from .currencies import MissingExchangeRate, convert
+from .models import Budget, Category, CategoryRule, CustomUser, Transaction
+from .rules import check_expression, get_matcher
 
 class CustomUserForm(UserCreationForm):
     """
@@ -28,8 +32,69 @@ class CategoryForm(forms.ModelForm):
 
 class TransactionForm(forms.ModelForm):
     """
-    Define the transaction form
+    Define the transaction form, without a category the rules of the
+    user choose it
     """
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        if user is not None and 'category' in self.fields:
+            # Only the categories of the user can be chosen
+            self.fields['category'].queryset = Category.objects.filter(user=user)
+            self.fields['category'].required = False
+
+    def clean_currency(self):
+        return self.cleaned_data['currency'].strip().upper()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.user is None:
+            return cleaned_data
+        self.clean_amount_currency(cleaned_data)
+        if 'category' in self.fields:
+            self.clean_category_by_rules(cleaned_data)
+        return cleaned_data
+
+    def clean_amount_currency(self, cleaned_data):
+        currency = cleaned_data.get('currency')
+        amount = cleaned_data.get('amount')
+        if not currency:
+            return
+        if currency == self.user.currency:
+            cleaned_data['currency'] = ''
+        elif amount is not None:
+            # Stored in the currency of the user, what was entered is kept
+            # apart since original_amount is not a field of the form
+            try:
+                cleaned_data['amount'] = convert(
+                    amount, currency, self.user.currency, datetime.date.today())
+            except MissingExchangeRate as error:
+                self.add_error('currency', str(error))
+            else:
+                self.instance.original_amount = amount
+
+    def clean_category_by_rules(self, cleaned_data):
+        if cleaned_data.get('category') is not None or 'category' in self.errors:
+            return
+        category_id = get_matcher(self.user).match(
+            cleaned_data.get('title') or '',
+            cleaned_data.get('amount'),
+            cleaned_data.get('transaction_type') or '',
+        )
+        if category_id is None:
+            self.add_error('category', "Select a category, no rule matches this transaction.")
+        else:
+            # Left out of cleaned_data so the instance keeps the rule's choice
+            self.instance.category_id = category_id
+            cleaned_data.pop('category', None)
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        # The category field already fetched the category, skip the second
+        # existence query of the model validation
+        exclude.add('category')
+        return exclude
+
     class Meta:
         """
         Properties
@@ -40,5 +105,201 @@ class TransactionForm(forms.ModelForm):
             'description', 
             'transaction_type', 
             'amount',
+            'currency',
+            'category'
+        ]
+
+
+class BudgetForm(forms.ModelForm):
+    """
+    Define the monthly budget form
+    """
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if user is not None:
+            self.fields['category'].queryset = Category.objects.filter(user=user)
+
+    def validate_unique(self):
+        # An existing budget of the category is replaced by the view
+        pass
+
+    class Meta:
+        """
+        Properties
+        """
+        model = Budget
+        fields = ['category', 'amount']
+
+
+class TransactionRowForm(TransactionForm):
+    """
+    Validate an imported row with the rules of the transaction form,
+    the category is resolved by the importer
+    """
+    date_created = forms.DateField(required=False)
+
+    class Meta(TransactionForm.Meta):
+        """
+        Properties
+        """
+        fields = [
+            'title',
+            'description',
+            'transaction_type',
+            'amount',
+            'currency',
+        ]
+
+
+class RuleForm(forms.ModelForm):
+    """
+    Define the categorization rule form
+    """
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if user is not None:
+            self.fields['category'].queryset = Category.objects.filter(user=user)
+
+    def clean_pattern(self):
+        return self.cleaned_data['pattern'].strip()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        kind = cleaned_data.get('kind')
+        pattern = cleaned_data.get('pattern')
+        amount_min = cleaned_data.get('amount_min')
+        amount_max = cleaned_data.get('amount_max')
+        if kind in ('K', 'R') and not pattern and 'pattern' not in self.errors:
+            self.add_error('pattern', "Enter the text to look for in the title.")
+        if kind == 'R' and pattern:
+            try:
+                check_expression(pattern)
+            except re.error as error:
+                self.add_error('pattern', f"Enter a valid regular expression: {error}.")
+        if kind == 'A':
+            cleaned_data['pattern'] = ''
+            if amount_min is None and amount_max is None:
+                self.add_error('amount_min', "Enter a minimum or a maximum amount.")
+        if amount_min is not None and amount_max is not None and amount_min > amount_max:
+            self.add_error('amount_max', "The maximum is lower than the minimum.")
+        return cleaned_data
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        exclude.add('category')
+        return exclude
+
+    class Meta:
+        """
+        Properties
+        """
+        model = CategoryRule
+        fields = [
+            'kind',
+            'pattern',
+            'amount_min',
+            'amount_max',
+            'transaction_type',
+            'priority',
             'category'
         ]
+
+
+class ImportForm(forms.Form):
+    """
+    Define the transactions import form
+    """
+    FILE_FORMATS = [
+        ("csv", "CSV"),
+        ("ofx", "OFX")
+    ]
+
+    file = forms.FileField()
+    file_format = forms.ChoiceField(choices=FILE_FORMATS)
+
+
+class TransactionFilterForm(forms.Form):
+    """
+    Define the filters of the transaction listings
+    """
+    q = forms.CharField(required=False, max_length=100)
+    category = forms.IntegerField(required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    amount_min = forms.DecimalField(required=False, max_digits=100, decimal_places=2)
+    amount_max = forms.DecimalField(required=False, max_digits=100, decimal_places=2)
+
+    def active_filters(self):
+        """
+        Return the valid filters that have a value
+        """
+        if not self.is_valid():
+            return {}
+        return {
+            name: value for name, value in self.cleaned_data.items()
+            if value not in (None, "")
+        }
+
+
+class IdListField(forms.Field):
+    """
+    A list of integer ids sent as repeated parameters
+    """
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        if not value:
+            return []
+        try:
+            return [int(item) for item in value]
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Enter a list of ids.", code="invalid")
+
+
+class BulkActionForm(TransactionFilterForm):
+    """
+    Define the bulk transaction actions form, the transactions are the
+    given ids or every transaction matching the filters
+    """
+    ACTIONS = [
+        ("delete", "Delete"),
+        ("move", "Move to category")
+    ]
+
+    action = forms.ChoiceField(choices=ACTIONS)
+    ids = IdListField(required=False)
+    select_all = forms.BooleanField(required=False)
+    target_category = forms.IntegerField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get("select_all") and not cleaned_data.get("ids"):
+            raise forms.ValidationError("Select at least one transaction.")
+        if cleaned_data.get("action") == "move" and cleaned_data.get("target_category") is None:
+            self.add_error("target_category", "Choose the category to move to.")
+        return cleaned_data
+
+    def active_filters(self):
+        filters = super().active_filters()
+        for name in ("action", "ids", "select_all", "target_category"):
+            filters.pop(name, None)
+        return filters
+
+
+class StatementForm(forms.Form):
+    """
+    Define the monthly statement request form
+    """
+    FORMATS = [
+        ("pdf", "PDF"),
+        ("csv", "CSV")
+    ]
+
+    month = forms.DateField(input_formats=["%Y-%m", "%Y-%m-%d"])
+    format = forms.ChoiceField(choices=FORMATS)
+
+    def clean_month(self):
+        month = self.cleaned_data["month"].replace(day=1)
+        if month > datetime.date.today():
+            raise forms.ValidationError("The month has not started yet.")
+        return month
@@ -0,0 +1,286 @@
+"""
+Streaming import of bank statements in CSV and OFX formats
+"""
+import csv
+import datetime
+import re
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .aggregates import apply_to_summaries
+from .currencies import MissingExchangeRate, convert_transactions
+from .forms import TransactionRowForm
+from .models import Category, Transaction
+from .rules import get_matcher
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+OFX_CATEGORY = "Imported"
+CATEGORY_TITLE_LENGTH = Category._meta.get_field("title").max_length
+ROW_FIELDS = TransactionRowForm.base_fields
+MODEL_EXCLUDED_FIELDS = ["id", "category", "user", "date_created"]
+
+TRANSACTION_TYPE_ALIASES = {
+    "ex": "EX",
+    "expense": "EX",
+    "debit": "EX",
+    "in": "IN",
+    "income": "IN",
+    "credit": "IN",
+}
+
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.DOTALL | re.IGNORECASE)
+OFX_TAG = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+def normalize_row(row):
+    """
+    Map the transaction type aliases and signed amounts of bank exports
+    to the values expected by the transaction form
+    """
+    transaction_type = (row.get("transaction_type") or "").strip().lower()
+    amount = (row.get("amount") or "").strip()
+    if not transaction_type:
+        # Bank exports use the sign of the amount instead of a type
+        try:
+            transaction_type = "ex" if Decimal(amount) < 0 else "in"
+        except InvalidOperation:
+            pass
+    if amount.startswith("-"):
+        amount = amount[1:]
+    row["transaction_type"] = TRANSACTION_TYPE_ALIASES.get(
+        transaction_type, transaction_type)
+    row["amount"] = amount
+    return row
+
+
+def parse_csv(lines):
+    """
+    Yield (line number, row) pairs from CSV lines with a header of
+    title, description, transaction_type, amount, category and date, and
+    optionally currency. Rows without a category are categorized by the
+    rules of the user.
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        row["date_created"] = row.pop("date", None)
+        yield reader.line_num, normalize_row(row)
+
+
+def parse_ofx(lines):
+    """
+    Yield (transaction number, row) pairs from the STMTTRN blocks of an
+    OFX statement, reading only one block at a time
+    """
+    buffer = ""
+    number = 0
+    for line in lines:
+        buffer += line
+        if "</STMTTRN>" not in buffer.upper():
+            continue
+        end = 0
+        for match in OFX_TRANSACTION.finditer(buffer):
+            end = match.end()
+            tags = {
+                name.upper(): value.strip()
+                for name, value in OFX_TAG.findall(match.group(1))
+            }
+            number += 1
+            posted = tags.get("DTPOSTED", "")[:8]
+            yield number, normalize_row({
+                "title": tags.get("NAME") or tags.get("PAYEE") or tags.get("FITID", ""),
+                "description": tags.get("MEMO", ""),
+                "transaction_type": "",
+                "amount": tags.get("TRNAMT", ""),
+                # Statements have no categories, the rules of the user
+                # choose one before the fallback
+                "category": "",
+                "default_category": OFX_CATEGORY,
+                "date_created": f"{posted[:4]}-{posted[4:6]}-{posted[6:]}" if posted else "",
+            })
+        buffer = buffer[end:]
+
+
+PARSERS = {
+    "csv": parse_csv,
+    "ofx": parse_ofx,
+}
+
+
+class ImportResult:
+    """
+    Summary of an import run
+    """
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        if not self.elapsed:
+            return 0
+        return (self.created + self.failed) / self.elapsed
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, errors))
+
+
+class TransactionImporter:
+    """
+    Validate parsed rows and insert them in batches for a user.
+
+    Categories are looked up by title in an in-memory map and the ones
+    that do not exist yet are created with each batch. Rows without a
+    category take the one of the first rule of the user that matches.
+    """
+    def __init__(self, user, batch_size=DEFAULT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self._matcher = None
+        self.categories = {}
+        for category_id, title in (
+                Category.objects.filter(user=user)
+                .order_by("-id").values_list("id", "title")):
+            self.categories[self.category_key(title)] = category_id
+
+    @staticmethod
+    def category_key(title):
+        return title.strip().casefold()
+
+    @property
+    def matcher(self):
+        # Loaded by the first row without a category
+        if self._matcher is None:
+            self._matcher = get_matcher(self.user)
+        return self._matcher
+
+    def run(self, rows):
+        """
+        Import the (line number, row) pairs and return an ImportResult
+        """
+        result = ImportResult()
+        start = time.perf_counter()
+        pending = []
+        for line, row in rows:
+            item = self.build(row)
+            if isinstance(item, Transaction):
+                item.line = line
+                pending.append(item)
+            else:
+                result.add_error(line, item)
+            if len(pending) >= self.batch_size:
+                result.created += self.flush(self.convert(pending, result))
+                pending = []
+        if pending:
+            result.created += self.flush(self.convert(pending, result))
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def build(self, row):
+        """
+        Return an unsaved transaction, or the validation errors of the row.
+
+        Applies the field and model rules of TransactionRowForm without
+        building a form per row, which would deep copy all of its fields.
+        """
+        errors = []
+        cleaned = {}
+        for name, field in ROW_FIELDS.items():
+            try:
+                cleaned[name] = field.clean(row.get(name))
+            except ValidationError as error:
+                errors.extend(f"{name}: {message}" for message in error.messages)
+
+        category = (row.get("category") or "").strip()
+        category_id = None
+        if not category and not errors:
+            # Rows in another currency are matched on the amount as written,
+            # they are converted later with the rest of the batch
+            category_id = self.matcher.match(
+                cleaned["title"], cleaned["amount"], cleaned["transaction_type"])
+        if not category and category_id is None:
+            category = (row.get("default_category") or "").strip()
+        if not category and category_id is None:
+            errors.append("category: This field is required.")
+        elif len(category) > CATEGORY_TITLE_LENGTH:
+            errors.append(
+                f"category: Ensure this value has at most {CATEGORY_TITLE_LENGTH} characters.")
+        if errors:
+            return errors
+
+        date_created = cleaned.pop("date_created") or datetime.date.today()
+        cleaned["currency"] = cleaned["currency"].strip().upper()
+        if cleaned["currency"] == self.user.currency:
+            cleaned["currency"] = ""
+        item = Transaction(**cleaned, date_created=date_created, user=self.user)
+        try:
+            item.clean_fields(exclude=MODEL_EXCLUDED_FIELDS)
+        except ValidationError as error:
+            return [
+                f"{name}: {message}"
+                for name, messages in error.message_dict.items()
+                for message in messages
+            ]
+        if category_id is not None:
+            item.category_id = category_id
+            item.category_title = None
+        else:
+            # Resolved to an id when the batch is written
+            item.category_title = category
+        return item
+
+    def convert(self, batch, result):
+        """
+        Convert the transactions in another currency to the currency of
+        the user, with one rate query per batch, and report the ones
+        without a rate
+        """
+        missing = convert_transactions(batch, self.user.currency)
+        if not missing:
+            return batch
+        for item in missing:
+            error = MissingExchangeRate(item.currency, item.date_created)
+            result.add_error(item.line, [f"currency: {error}"])
+        missing = set(map(id, missing))
+        return [item for item in batch if id(item) not in missing]
+
+    @transaction.atomic
+    def flush(self, batch):
+        """
+        Write a batch with its new categories, summaries and balance change
+        """
+        if not batch:
+            return 0
+        # Rows categorized by the rules already have their category
+        titled = [item for item in batch if item.category_title is not None]
+        missing = {}
+        for item in titled:
+            key = self.category_key(item.category_title)
+            if key not in self.categories and key not in missing:
+                missing[key] = Category(title=item.category_title, user=self.user)
+        if missing:
+            Category.objects.bulk_create(missing.values())
+            for key, category in missing.items():
+                self.categories[key] = category.id
+
+        for item in titled:
+            item.category_id = self.categories[self.category_key(item.category_title)]
+        # The balance change invalidates, and locks the user row before
+        # the ids of the batch are taken, see save_transaction
+        self.user.apply_balance_change(sum(item.signed_amount for item in batch))
+        Transaction.objects.bulk_create(batch)
+        apply_to_summaries(batch)
+        return len(batch)
+
+
+def import_transactions(user, lines, file_format, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Parse the lines in the given format and import them for the user
+    """
+    rows = PARSERS[file_format](lines)
+    return TransactionImporter(user, batch_size).run(rows)
@@ -0,0 +1,130 @@
+"""
+Local job queue stored in the database, no broker needed.
+
+Views enqueue jobs and poll their status, the processes of manage.py
+run_workers claim and run them. A job is claimed by switching it from
+queued to running with a conditional UPDATE, so two workers never run
+the same job. Where the database supports it the oldest queued job is
+read with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers do not
+wait for each other's rows.
+"""
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Functions that run each kind of job. They take the job and return the
+# (file name, content type, content) of the result.
+HANDLERS = {
+    "statement": "finances.statements.run_statement_job",
+}
+
+
+def enqueue(user, kind, **payload):
+    """
+    Queue a job for the user, or return the identical job that is still
+    queued or running
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind}")
+    with transaction.atomic():
+        pending = Job.objects.filter(
+            user=user, kind=kind, payload=payload, status__in=("Q", "R")
+        ).defer("result").first()
+        if pending is not None:
+            return pending
+        return Job.objects.create(user=user, kind=kind, payload=payload)
+
+
+def worker_name(number=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{number}"
+
+
+def claim_job(worker):
+    """
+    Mark the oldest queued job as running for the worker and return it,
+    None when the queue is empty
+    """
+    while True:
+        with transaction.atomic():
+            queued = Job.objects.filter(status="Q").order_by("id")
+            if connection.features.has_select_for_update_skip_locked:
+                queued = queued.select_for_update(skip_locked=True)
+            job = queued.defer("result").first()
+            if job is None:
+                return None
+            # Another worker may have read the same row where rows are
+            # not locked
+            claimed = Job.objects.filter(pk=job.pk, status="Q").update(
+                status="R", worker=worker, started_at=timezone.now(),
+                attempts=F("attempts") + 1)
+        if claimed:
+            job.status, job.worker, job.attempts = "R", worker, job.attempts + 1
+            return job
+
+
+def requeue_stale(timeout=None):
+    """
+    Queue again the jobs whose worker died while running them, and fail
+    the ones that used all their attempts. Return the number requeued.
+    """
+    timeout = settings.JOB_TIMEOUT if timeout is None else timeout
+    stale = Job.objects.filter(
+        status="R", started_at__lt=timezone.now() - timedelta(seconds=timeout))
+    stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status="F", error="The worker stopped while running the job",
+        finished_at=timezone.now())
+    return stale.filter(attempts__lt=settings.JOB_MAX_ATTEMPTS).update(status="Q")
+
+
+def run_job(job):
+    """
+    Run a claimed job and store its result or its error. A job requeued
+    meanwhile as stale belongs to its new worker and is left alone.
+    """
+    try:
+        name, content_type, content = import_string(HANDLERS[job.kind])(job)
+    except Exception as error:
+        # Any error of the handler fails the job, the worker goes on
+        logger.exception("Job %s failed", job.pk)
+        Job.objects.filter(pk=job.pk, worker=job.worker).update(
+            status="F", error=f"{type(error).__name__}: {error}", finished_at=timezone.now())
+        job.status = "F"
+        return job
+    Job.objects.filter(pk=job.pk, worker=job.worker).update(
+        status="D", result=content, result_name=name, result_type=content_type,
+        finished_at=timezone.now())
+    job.status = "D"
+    return job
+
+
+def work(worker, burst=False, max_jobs=None, poll_interval=None):
+    """
+    Run jobs until max_jobs were run, or until the queue is empty when
+    burst is set. Return the number of jobs run.
+    """
+    poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    done = 0
+    last_check = 0
+    while max_jobs is None or done < max_jobs:
+        if time.monotonic() - last_check > poll_interval:
+            requeue_stale()
+            last_check = time.monotonic()
+        job = claim_job(worker)
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        done += 1
+    return done
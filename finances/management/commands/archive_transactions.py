@@ -0,0 +1,38 @@
+"""
+Move old transactions into the archive table
+"""
+import datetime
+import time
+from django.core.management.base import BaseCommand, CommandError
+from finances.archive import ARCHIVE_BATCH_SIZE, archive_transactions
+
+
+class Command(BaseCommand):
+    """
+    Move the transactions dated before a day out of the ledger, batch by
+    batch, leaving the summaries and the balances as they are
+    """
+    help = "Archive the transactions dated before the given day"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", required=True,
+                            help="First day that stays in the ledger, YYYY-MM-DD")
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="Only archive the given user id (repeatable)")
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            before = datetime.date.fromisoformat(options["before"])
+        except ValueError as error:
+            raise CommandError(f"{options['before']} is not a YYYY-MM-DD date") from error
+        if before > datetime.date.today():
+            raise CommandError("Only past transactions can be archived")
+
+        start = time.perf_counter()
+        moved = archive_transactions(
+            before, options["users"], options["batch_size"],
+            progress=lambda moved: self.stdout.write(f"{moved} transactions archived"))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} transactions dated before {before} in {elapsed:.2f}s"))
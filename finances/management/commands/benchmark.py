@@ -0,0 +1,125 @@
+"""
+Run the benchmark suite of the finances app
+"""
+import dataclasses
+import json
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from finances.aggregates import rebuild_summaries
+from finances.benchmarks.data import create_users, populate
+from finances.benchmarks.driver import FLOWS, run_flow
+from finances.benchmarks.results import DEFAULT_THRESHOLD, compare, metadata
+from finances.benchmarks.views import SCENARIOS, run_views
+from finances.models import CustomUser
+
+USERNAME_PREFIX = "benchmark-suite"
+
+
+class Command(BaseCommand):
+    """
+    Measure every view on a synthetic ledger, then load the create,
+    delete and login flows from several threads, and emit the results as
+    JSON.
+
+    The view requests run inside a transaction that is rolled back. The
+    load threads use their own connections, so the synthetic users are
+    committed and deleted at the end.
+    """
+    help = "Benchmark every view and the create, delete and login flows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000,
+                            help="Transactions of the benchmarked user")
+        parser.add_argument("--users", type=int, default=4,
+                            help="Users shared by the load threads")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--scenario", action="append", dest="scenarios",
+                            choices=SCENARIOS, help="Only run the given scenario (repeatable)")
+        parser.add_argument("--cold", action="store_true",
+                            help="Disable the report cache")
+        parser.add_argument("--requests", type=int, default=500,
+                            help="Requests of each load flow, 0 skips them")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--output", type=Path, help="Write the JSON results to this file")
+        parser.add_argument("--compare", type=Path,
+                            help="Fail on regressions against the results of a previous run")
+        parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help="Tolerated relative slowdown, 0.25 by default")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            baseline = json.loads(options["compare"].read_text())
+
+        # The test clients send their requests to testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            results = self.run_suite(options)
+
+        if options["output"]:
+            options["output"].write_text(json.dumps(results, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(baseline, results, options["threshold"])
+            for message in regressions:
+                self.stderr.write(message)
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions against {options['compare']}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
+
+    def run_suite(self, options):
+        CustomUser.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        start = time.perf_counter()
+        users = create_users(USERNAME_PREFIX, options["users"])
+        try:
+            populate(users[0], options["rows"])
+            rebuild_summaries(users)
+            self.stdout.write(
+                f"Generated {options['rows']} transactions in {time.perf_counter() - start:.1f}s")
+            return {
+                "meta": metadata(**{
+                    name: options[name]
+                    for name in ("rows", "users", "repeat", "cold", "requests", "concurrency")
+                }),
+                "views": self.run_views(users[0], options),
+                "load": self.run_load(users, options),
+            }
+        finally:
+            CustomUser.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def run_views(self, user, options):
+        with transaction.atomic(), override_settings(REPORT_CACHE_ENABLED=not options["cold"]):
+            results = run_views(user, options["repeat"], options["scenarios"])
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Views"))
+        self.stdout.write(
+            f"{'scenario':<32}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'peak KB':>10}  status")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<32}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                f"{result['queries']:>9}{result['peak_kb']:>10.1f}  {result['status']}")
+        return results
+
+    def run_load(self, users, options):
+        results = {}
+        if not options["requests"]:
+            return results
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Load"))
+        self.stdout.write(f"{'flow':<12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        # Creates first, the delete flow removes what they left
+        for flow in FLOWS:
+            result = run_flow(flow, users, options["requests"], options["concurrency"])
+            results[flow] = {
+                **dataclasses.asdict(result),
+                "requests_per_second": result.requests_per_second,
+            }
+            self.stdout.write(
+                f"{flow:<12}{result.requests_per_second:>10.1f}{result.p50:>10.1f}"
+                f"{result.p99:>10.1f}{result.errors:>8}")
+        return results
@@ -0,0 +1,48 @@
+"""
+Time the analytics series on a large synthetic ledger
+"""
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from finances.aggregates import rebuild_summaries
+from finances.analytics import GRANULARITIES, GROUPINGS, time_series
+from finances.benchmarks.data import create_user, populate, replicate
+
+
+class Command(BaseCommand):
+    """
+    Build every granularity and grouping of the analytics series for a
+    synthetic user, inside a transaction that is rolled back
+    """
+    help = "Benchmark the analytics time series"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            start = time.perf_counter()
+            user = create_user("benchmark-analytics", categories=20)
+            populate(user, min(options["rows"], 50_000))
+            replicate(user, options["rows"])
+            rebuild_summaries([user])
+            self.stdout.write(
+                f"Generated {options['rows']} transactions in "
+                f"{time.perf_counter() - start:.1f}s")
+
+            for granularity in GRANULARITIES:
+                for group_by in GROUPINGS:
+                    timings = []
+                    for _ in range(options["repeat"]):
+                        start = time.perf_counter()
+                        data = time_series(user, granularity, group_by)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    self.stdout.write(
+                        f"{granularity:>5} by {group_by:<8} "
+                        f"{len(data['periods']):>5} periods "
+                        f"median {statistics.median(timings):.1f} ms"
+                    )
+
+            transaction.set_rollback(True)
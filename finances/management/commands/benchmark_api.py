@@ -0,0 +1,78 @@
+"""
+Compare the bytes and latency of a refresh through the report page and
+through the JSON API
+"""
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from finances import caching
+from finances.aggregates import rebuild_summaries
+from finances.benchmarks.data import create_user, generate_transactions, populate
+from finances.models import Transaction
+
+
+class Command(BaseCommand):
+    """
+    Refresh the ledger of a synthetic user by loading the report page,
+    the first API page, an unchanged conditional poll and a delta sync
+    with a few new transactions, inside a transaction that is rolled back
+    """
+    help = "Benchmark the bytes and latency per refresh of the JSON API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000)
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--new", type=int, default=10,
+                            help="Transactions added before each delta sync")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = create_user("benchmark-api")
+            populate(user, options["rows"])
+            rebuild_summaries([user])
+            client = Client(HTTP_HOST="localhost")
+            client.force_login(user)
+            url = reverse("api_transactions")
+
+            self.run_requests("report page", options["requests"],
+                              lambda: client.get(reverse("report")))
+            self.run_requests("api first page", options["requests"], lambda: client.get(url))
+
+            first = client.get(url)
+            self.run_requests("api unchanged poll", options["requests"], lambda: client.get(
+                url, HTTP_IF_NONE_MATCH=first["ETag"]))
+
+            sync = [first.json()["sync"]]
+            new = generate_transactions(user, options["requests"] * options["new"], days=1, seed=1)
+
+            def delta():
+                Transaction.objects.bulk_create(next(new) for _ in range(options["new"]))
+                caching.invalidate_on_commit(user.pk)
+                response = client.get(url, {"since": sync[0]})
+                sync[0] = response.json()["sync"]
+                return response
+            self.run_requests(f"api delta of {options['new']}", options["requests"], delta)
+
+            transaction.set_rollback(True)
+
+    def run_requests(self, label, requests, send):
+        timings = []
+        sizes = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = send()
+                timings.append((time.perf_counter() - start) * 1000)
+                sizes.append(len(response.content))
+        timings.sort()
+        self.stdout.write(
+            f"{label:<20} status {response.status_code}, "
+            f"{statistics.mean(sizes):10.0f} bytes, "
+            f"mean {statistics.mean(timings):7.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:7.2f} ms, "
+            f"{len(queries) / requests:.1f} queries"
+        )
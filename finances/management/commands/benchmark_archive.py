@@ -0,0 +1,135 @@
+"""
+Measure the hot table queries before and after archiving old transactions
+"""
+import datetime
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from finances.aggregates import check_summaries, rebuild_summaries, report_totals
+from finances.archive import archive_transactions
+from finances.balances import ledger_balances
+from finances.benchmarks.data import create_user, populate
+from finances.filters import filter_transactions
+from finances.models import ArchivedTransaction, Category, CustomUser, Transaction
+from finances.pagination import KeysetPaginator
+
+YEARS = 10
+
+
+class Command(BaseCommand):
+    """
+    Build ten years of history for a few users, time the queries of the
+    listings and reports, archive everything but the last years and time
+    them again, then check that the totals did not change.
+
+    Everything runs inside a transaction that is rolled back at the end,
+    so the database is left untouched.
+    """
+    help = "Benchmark the hot table queries before and after archiving"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--keep-years", type=int, default=1,
+                            help="Years of history left in the ledger")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = self.seed(options["rows"], options["users"])
+            user = users[-1]
+            totals = report_totals(user)
+            self.report("Before archiving", user, options["repeat"])
+
+            before = datetime.date.today().replace(day=1)
+            before = before.replace(year=before.year - options["keep_years"])
+            start = time.perf_counter()
+            moved = archive_transactions(before, users)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"\nArchived {moved} transactions dated before {before} in {elapsed:.1f}s"))
+            self.run_sql(["ANALYZE"])
+            user = CustomUser.objects.get(pk=user.pk)
+            self.report("After archiving", user, options["repeat"])
+            self.time_archived_listing(user, before, options["repeat"])
+
+            balances = ledger_balances([item.pk for item in users])
+            stored = dict(CustomUser.objects.filter(
+                pk__in=balances).values_list("id", "total_amount"))
+            self.stdout.write(self.style.MIGRATE_HEADING("\nConsistency"))
+            self.stdout.write(f"report totals unchanged: {report_totals(user) == totals}")
+            self.stdout.write(f"balances match the ledger: {balances == stored}")
+            self.stdout.write(f"summary mismatches: {len(check_summaries(users))}")
+
+            transaction.set_rollback(True)
+
+    def seed(self, rows, users):
+        self.stdout.write(f"Generating {rows} transactions over {YEARS} years "
+                          f"for {users} users...")
+        start = time.perf_counter()
+        created = []
+        for number in range(users):
+            user = create_user(f"benchmark-archive-{number}")
+            populate(user, rows // users, days=365 * YEARS, seed=number)
+            created.append(user)
+        rebuild_summaries(created)
+        # The stored balances match the generated ledger
+        for user_id, balance in ledger_balances([user.pk for user in created]).items():
+            CustomUser.objects.filter(pk=user_id).update(total_amount=balance)
+        self.run_sql(["ANALYZE"])
+        self.stdout.write(f"Generated in {time.perf_counter() - start:.1f}s")
+        return created
+
+    def run_sql(self, statements):
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(str(statement))
+
+    def queries(self, user):
+        category = Category.objects.filter(user=user).first()
+        user_transactions = Transaction.objects.filter(user=user)
+        this_year = datetime.date.today().replace(month=1, day=1)
+        return {
+            "report page": lambda: list(
+                user_transactions.for_listing().order_by("-date_created", "-id")[:26]),
+            "category count": lambda: user_transactions.filter(category=category).count(),
+            "search page": lambda: list(
+                filter_transactions(user_transactions, q="coffee")
+                .order_by("-date_created", "-id")[:26]),
+            "this year balance": lambda: user_transactions.filter(
+                date_created__gte=this_year).balance_effect(),
+        }
+
+    def report(self, label, user, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{label}"))
+        self.stdout.write(
+            f"ledger {Transaction.objects.count()} rows, "
+            f"archive {ArchivedTransaction.objects.count()} rows")
+        for name, query in self.queries(user).items():
+            self.time(name, query, repeat)
+
+    def time_archived_listing(self, user, before, repeat):
+        """
+        A listing whose date range reaches into the archive reads both
+        tables
+        """
+        date_from = before.replace(year=before.year - 1)
+        paginator = KeysetPaginator(
+            Transaction.objects.filter(user=user, date_created__gte=date_from).for_listing(),
+            25,
+            ArchivedTransaction.objects.filter(
+                user=user, date_created__gte=date_from).for_listing(),
+        )
+        self.time("archived range page", lambda: paginator.page(), repeat)
+
+    def time(self, name, query, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(self.style.SUCCESS(
+            f"{name}: median {statistics.median(timings):.2f} ms, "
+            f"max {max(timings):.2f} ms"
+        ))
@@ -0,0 +1,104 @@
+"""
+Measure the login throughput and the per-request cost of loading the
+session and the user
+"""
+import itertools
+import statistics
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from finances import caching
+from finances.benchmarks.data import create_users
+from finances.benchmarks.driver import run_flow
+from finances.models import CustomUser
+
+USERNAME_PREFIX = "benchmark-auth"
+SESSION_STORES = ("db", "cached_db", "cache", "signed_cookies")
+BACKENDS = {
+    "model": "django.contrib.auth.backends.ModelBackend",
+    "cached": "finances.auth.CachedModelBackend",
+}
+
+
+class Command(BaseCommand):
+    """
+    Send a storm of logins from several threads, counting the password
+    checks, then time an authenticated request with every session store
+    and user backend.
+
+    The login threads use their own connections, so the synthetic users
+    are committed and deleted at the end.
+    """
+    help = "Benchmark the logins and the per-request authentication overhead"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--logins", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--requests", type=int, default=500,
+                            help="Requests of each overhead measurement")
+
+    def handle(self, *args, **options):
+        CustomUser.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        users = create_users(USERNAME_PREFIX, options["users"], categories=1)
+        try:
+            # The test clients send their requests to testserver
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                self.login_storm(users, options)
+                self.overhead(users[0], options["requests"])
+        finally:
+            CustomUser.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def login_storm(self, users, options):
+        checks = itertools.count()
+        check_password = CustomUser.check_password
+
+        def counted(user, raw_password):
+            next(checks)
+            return check_password(user, raw_password)
+
+        CustomUser.check_password = counted
+        try:
+            result = run_flow("login", users, options["logins"], options["concurrency"])
+        finally:
+            CustomUser.check_password = check_password
+        self.stdout.write(self.style.MIGRATE_HEADING("Login storm"))
+        self.stdout.write(
+            f"{result.requests_per_second:.1f} logins/s, p50 {result.p50:.1f} ms, "
+            f"p99 {result.p99:.1f} ms, {result.errors} errors, "
+            f"{next(checks) / max(result.requests, 1):.2f} password checks per login"
+        )
+
+    def overhead(self, user, requests):
+        self.stdout.write(self.style.MIGRATE_HEADING("Per-request overhead"))
+        if not caching.is_shared():
+            self.stdout.write(
+                "The cache is kept by each process, so the cached backend loads "
+                "the user from the database too. Set CACHE_BACKEND to compare.")
+        self.stdout.write(f"{'session store':<16}{'user':<8}{'mean ms':>10}{'p95 ms':>10}{'queries':>9}")
+        url = reverse("api_balance")
+        for store, (backend_name, backend) in itertools.product(SESSION_STORES, BACKENDS.items()):
+            caching.get_cache().clear()
+            with override_settings(
+                    SESSION_ENGINE=f"django.contrib.sessions.backends.{store}",
+                    AUTHENTICATION_BACKENDS=[backend]), transaction.atomic():
+                client = Client()
+                client.force_login(user)
+                client.get(url)
+                timings = []
+                with CaptureQueriesContext(connection) as queries:
+                    for _ in range(requests):
+                        start = time.perf_counter()
+                        client.get(url)
+                        timings.append((time.perf_counter() - start) * 1000)
+                transaction.set_rollback(True)
+            timings.sort()
+            self.stdout.write(
+                f"{store:<16}{backend_name:<8}{statistics.mean(timings):>10.3f}"
+                f"{timings[int(len(timings) * 0.95) - 1]:>10.3f}"
+                f"{len(queries) / requests:>9.1f}"
+            )
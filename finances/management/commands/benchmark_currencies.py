@@ -0,0 +1,102 @@
+"""
+Measure the currency conversion of the write path and the report of a
+mixed-currency ledger
+"""
+import itertools
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from finances import currencies
+from finances.aggregates import rebuild_summaries
+from finances.benchmarks.data import create_user, generate_rates, generate_transactions
+from finances.models import ExchangeRate, Transaction
+
+FOREIGN_CURRENCIES = ("USD", "GBP", "JPY", "MXN")
+
+
+class Command(BaseCommand):
+    """
+    Build a ledger with a share of transactions in other currencies,
+    converting them per row through the cached rate lookups and in
+    batches, then load its report and move it to another base currency,
+    inside a transaction that is rolled back
+    """
+    help = "Benchmark the conversion and reports of mixed-currency ledgers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000)
+        parser.add_argument("--foreign", type=float, default=0.3,
+                            help="Share of the transactions in another currency")
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--batch-size", type=int, default=currencies.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Replaced by synthetic rates until the rollback
+            ExchangeRate.objects.all().delete()
+            ExchangeRate.objects.bulk_create(
+                generate_rates(FOREIGN_CURRENCIES), batch_size=options["batch_size"])
+            currencies.clear_rate_cache()
+            user = create_user("benchmark-currencies")
+            transactions = list(generate_transactions(user, options["rows"]))
+            rng = random.Random(0)
+            for item in transactions:
+                if rng.random() < options["foreign"]:
+                    item.currency = rng.choice(
+                        [code for code in FOREIGN_CURRENCIES if code != user.currency])
+            foreign = sum(1 for item in transactions if item.currency)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{len(transactions)} transactions, {foreign} in other currencies"))
+
+            self.time("per row, cold cache", lambda: self.convert_rows(transactions, user))
+            self.time("per row, warm cache", lambda: self.convert_rows(transactions, user))
+            self.stdout.write(f"rate cache {currencies.settled_rate.cache_info()}")
+            self.time("batched", lambda: self.convert_batches(
+                transactions, user, options["batch_size"]))
+
+            Transaction.objects.bulk_create(transactions, batch_size=options["batch_size"])
+            rebuild_summaries([user])
+            self.run_requests(user, options["requests"])
+            self.time("change base currency",
+                      lambda: currencies.change_base_currency(user, "EUR"))
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def convert_rows(transactions, user):
+        for item in transactions:
+            if item.currency:
+                currencies.convert(item.amount, item.currency, user.currency, item.date_created)
+
+    @staticmethod
+    def convert_batches(transactions, user, batch_size):
+        items = iter(transactions)
+        while batch := list(itertools.islice(items, batch_size)):
+            currencies.convert_transactions(batch, user.currency)
+
+    def time(self, label, function):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            function()
+            elapsed = (time.perf_counter() - start) * 1000
+        self.stdout.write(f"{label:<22} {elapsed:10.2f} ms, {len(queries)} queries")
+
+    def run_requests(self, user, requests):
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        timings = []
+        with override_settings(REPORT_CACHE_ENABLED=False):
+            for _ in range(requests):
+                start = time.perf_counter()
+                client.get(reverse("report"))
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"{'report':<22} mean {statistics.mean(timings):.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms"
+        )
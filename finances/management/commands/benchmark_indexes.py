@@ -0,0 +1,90 @@
+"""
+Compare the transaction access paths with and without the composite indexes
+"""
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from finances.benchmarks.data import create_user, populate
+from finances.models import Category, Transaction
+
+
+class Command(BaseCommand):
+    """
+    Print EXPLAIN plans and timings of the hot transaction queries before
+    and after creating the composite indexes on a synthetic dataset.
+
+    Everything runs inside a transaction that is rolled back at the end,
+    so the database is left untouched.
+    """
+    help = "Benchmark the composite indexes of the Transaction model"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options["rows"], options["users"])
+            editor = connection.SchemaEditorClass(connection)
+            indexes = Transaction._meta.indexes
+
+            self.run_sql(
+                f"DROP INDEX {connection.ops.quote_name(index.name)}"
+                for index in indexes
+            )
+            self.report("Before", user, options["repeat"])
+
+            self.run_sql(index.create_sql(Transaction, editor) for index in indexes)
+            self.report("After", user, options["repeat"])
+
+            transaction.set_rollback(True)
+
+    def seed(self, rows, users):
+        """
+        Spread the rows over several users and return the one to query
+        """
+        self.stdout.write(f"Generating {rows} transactions for {users} users...")
+        start = time.perf_counter()
+        per_user = rows // users
+        for number in range(users):
+            user = create_user(f"benchmark-indexes-{number}")
+            populate(user, per_user, seed=number)
+        self.run_sql(["ANALYZE"])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Generated in {elapsed:.1f}s")
+        return user
+
+    def run_sql(self, statements):
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(str(statement))
+
+    def queries(self, user):
+        category = Category.objects.filter(user=user).first()
+        user_transactions = Transaction.objects.filter(user=user)
+        return {
+            "expenses page": user_transactions.filter(transaction_type="EX")
+                .order_by("-date_created", "-id")[:26],
+            "report page": user_transactions.order_by("-date_created", "-id")[:26],
+            "category count": user_transactions.filter(category=category),
+        }
+
+    def report(self, label, user, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{label} the composite indexes"))
+        for name, queryset in self.queries(user).items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                # Clone the queryset so its result cache is never reused
+                if name.endswith("count"):
+                    queryset.all().count()
+                else:
+                    list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: median {statistics.median(timings):.2f} ms, "
+                f"max {max(timings):.2f} ms"
+            ))
+            self.stdout.write(queryset.explain())
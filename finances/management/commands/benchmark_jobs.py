@@ -0,0 +1,105 @@
+"""
+Measure the throughput of the job queue with a varying number of workers
+"""
+import datetime
+import itertools
+import statistics
+import time
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+from finances.aggregates import rebuild_summaries
+from finances.benchmarks.data import create_users, populate
+from finances.models import CustomUser, Job
+from finances.statements import STATEMENT_FORMATS, build_statement
+
+PREFIX = "benchmark-jobs"
+
+
+class Command(BaseCommand):
+    """
+    Queue the same batch of statement jobs once per worker count and
+    drain it with run_workers --burst, after timing a statement built
+    inline and the request that only queues it.
+
+    The synthetic users are committed, since the workers run in other
+    processes, and deleted at the end.
+    """
+    help = "Benchmark the statement jobs with a varying number of workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--rows", type=int, default=5000,
+                            help="Transactions per user, over the last year")
+        parser.add_argument("--jobs", type=int, default=200)
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+
+    def handle(self, *args, **options):
+        CustomUser.objects.filter(username__startswith=PREFIX).delete()
+        users = create_users(PREFIX, options["users"])
+        try:
+            for number, user in enumerate(users):
+                populate(user, options["rows"], days=365, seed=number)
+            rebuild_summaries(users)
+            self.stdout.write(
+                f"{options['users']} users with {options['rows']} transactions each")
+            self.time_inline(users[0])
+            self.time_request(users[0])
+
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"\n{'workers':>8}{'jobs':>8}{'seconds':>10}{'jobs/s':>10}{'failed':>8}"))
+            for workers in options["workers"]:
+                self.run_queue(users, options["jobs"], workers)
+        finally:
+            CustomUser.objects.filter(username__startswith=PREFIX).delete()
+
+    @staticmethod
+    def months():
+        month = datetime.date.today().replace(day=1)
+        months = []
+        for _ in range(12):
+            month = (month - datetime.timedelta(days=1)).replace(day=1)
+            months.append(month)
+        return months
+
+    def time_inline(self, user):
+        for name, (render, _) in STATEMENT_FORMATS.items():
+            timings = []
+            for month in self.months():
+                start = time.perf_counter()
+                render(build_statement(user, month))
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(
+                f"inline {name} statement: mean {statistics.mean(timings):.2f} ms")
+
+    def time_request(self, user):
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        timings = []
+        for month in self.months():
+            start = time.perf_counter()
+            client.post(reverse("statements"), {"month": f"{month:%Y-%m}", "format": "pdf"})
+            timings.append((time.perf_counter() - start) * 1000)
+        Job.objects.filter(user=user).delete()
+        self.stdout.write(f"queueing request: mean {statistics.mean(timings):.2f} ms")
+
+    def run_queue(self, users, count, workers):
+        Job.objects.filter(user__in=users).delete()
+        payloads = itertools.cycle(
+            {"month": month.isoformat(), "format": name}
+            for month in self.months() for name in STATEMENT_FORMATS
+        )
+        Job.objects.bulk_create(
+            Job(user=user, kind="statement", payload=payload)
+            for user, payload in zip(itertools.islice(itertools.cycle(users), count), payloads)
+        )
+        start = time.perf_counter()
+        call_command("run_workers", workers=workers, burst=True, stdout=StringIO())
+        elapsed = time.perf_counter() - start
+        jobs = Job.objects.filter(user__in=users)
+        done = jobs.filter(status="D").count()
+        failed = jobs.filter(status="F").count()
+        self.stdout.write(
+            f"{workers:>8}{done:>8}{elapsed:>10.2f}{done / elapsed:>10.1f}{failed:>8}")
@@ -0,0 +1,57 @@
+"""
+Compare repeated report loads with the report cache on and off
+"""
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from finances import caching
+from finances.benchmarks.data import create_user, populate
+
+
+class Command(BaseCommand):
+    """
+    Load the report of a synthetic user repeatedly with the cache
+    disabled and enabled, inside a transaction that is rolled back
+    """
+    help = "Benchmark the per-user report cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000)
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = create_user("benchmark-report-cache")
+            populate(user, options["rows"])
+            client = Client(HTTP_HOST="localhost")
+            client.force_login(user)
+
+            for enabled in (False, True):
+                caching.get_cache().clear()
+                caching.stats.reset()
+                with override_settings(REPORT_CACHE_ENABLED=enabled):
+                    self.run_requests(client, enabled, options["requests"])
+
+            transaction.set_rollback(True)
+
+    def run_requests(self, client, enabled, requests):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(requests):
+                start = time.perf_counter()
+                client.get(reverse("report"))
+                timings.append((time.perf_counter() - start) * 1000)
+
+        label = "enabled" if enabled else "disabled"
+        timings.sort()
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Cache {label}"))
+        self.stdout.write(
+            f"mean {statistics.mean(timings):.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, "
+            f"{len(queries) / requests:.1f} queries per request"
+        )
+        self.stdout.write(f"stats {caching.stats.as_dict()}")
@@ -0,0 +1,130 @@
+"""
+Measure the categorization of titles with the compiled rules against
+trying the rules one by one
+"""
+import random
+import re
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from finances.aggregates import check_summaries, rebuild_summaries
+from finances.benchmarks.data import WORDS, create_user, populate
+from finances.models import Category, CategoryRule
+from finances.rules import get_matcher, load_rules, recategorize, rule_expression
+
+
+class Command(BaseCommand):
+    """
+    Create a user with keyword, expression and amount rules, categorize
+    generated titles with a loop over the rules and with the compiled
+    matcher, then time manage.py recategorize over a generated ledger.
+
+    Everything runs inside a transaction that is rolled back at the end,
+    so the database is left untouched.
+    """
+    help = "Benchmark the compiled categorization rules"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--titles", type=int, default=100_000)
+        parser.add_argument("--rules", type=int, default=200)
+        parser.add_argument("--rows", type=int, default=100_000,
+                            help="Transactions recategorized by the batch command")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = create_user("benchmark-rules", categories=20)
+            self.seed_rules(user, options["rules"])
+            titles = self.titles(options["titles"], options["rules"])
+
+            start = time.perf_counter()
+            matcher = get_matcher(user.pk)
+            self.stdout.write(
+                f"{options['rules']} rules loaded and compiled in "
+                f"{(time.perf_counter() - start) * 1000:.2f} ms")
+            naive = self.time("rule by rule", lambda: self.match_each(user, titles), len(titles))
+            compiled = self.time("compiled matcher", lambda: [
+                matcher.match(title, amount, transaction_type)
+                for title, amount, transaction_type in titles
+            ], len(titles))
+            self.stdout.write(f"same categories: {naive == compiled}")
+
+            populate(user, options["rows"], days=365)
+            rebuild_summaries([user])
+            start = time.perf_counter()
+            moved = recategorize([user])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(
+                f"recategorize: {options['rows']} transactions read, {moved} moved "
+                f"in {elapsed:.2f}s"))
+            self.stdout.write(f"summary mismatches: {len(check_summaries([user]))}")
+
+            transaction.set_rollback(True)
+
+    def seed_rules(self, user, count):
+        categories = list(Category.objects.filter(user=user))
+        rng = random.Random(0)
+        rules = []
+        for number in range(count):
+            kind = "RKKKKKKKKA"[number % 10]
+            rule = CategoryRule(
+                user=user, category=rng.choice(categories), kind=kind, priority=number)
+            if kind == "K":
+                rule.pattern = f"{rng.choice(WORDS)} {number}"
+            elif kind == "R":
+                rule.pattern = rf"^(?:{rng.choice(WORDS)}|{rng.choice(WORDS)}) {number}\d*$"
+            else:
+                rule.amount_min = Decimal(number * 5)
+                rule.amount_max = Decimal(number * 5 + 2)
+            if number % 7 == 0:
+                rule.transaction_type = "EX"
+            rules.append(rule)
+        CategoryRule.objects.bulk_create(rules)
+
+    @staticmethod
+    def titles(count, rules):
+        rng = random.Random(1)
+        return [
+            (
+                f"{rng.choice(WORDS).capitalize()} {rng.randrange(rules * 4)}",
+                Decimal(rng.randrange(100, 100000)) / 100,
+                rng.choice(("EX", "IN")),
+            )
+            for _ in range(count)
+        ]
+
+    @staticmethod
+    def match_each(user, titles):
+        """
+        Try every rule in priority order with its own expression
+        """
+        rules = [
+            (re.compile(rule_expression(rule.kind, rule.pattern), re.IGNORECASE)
+             if rule.kind != "A" else None, rule)
+            for rule in load_rules(user.pk)
+        ]
+        categories = []
+        for title, amount, transaction_type in titles:
+            category_id = None
+            for regex, rule in rules:
+                if rule.transaction_type and rule.transaction_type != transaction_type:
+                    continue
+                if rule.amount_min is not None and amount < rule.amount_min:
+                    continue
+                if rule.amount_max is not None and amount > rule.amount_max:
+                    continue
+                if regex is None or regex.search(title):
+                    category_id = rule.category_id
+                    break
+            categories.append(category_id)
+        return categories
+
+    def time(self, name, categorize, count):
+        start = time.perf_counter()
+        categories = categorize()
+        elapsed = time.perf_counter() - start
+        matched = sum(category is not None for category in categories)
+        self.stdout.write(self.style.SUCCESS(
+            f"{name}: {elapsed * 1000 / count * 1000:.2f} ms per 1000 titles, "
+            f"{matched} of {count} categorized"))
+        return categories
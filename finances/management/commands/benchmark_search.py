@@ -0,0 +1,76 @@
+"""
+Compare the full-text search with icontains scans on a large ledger
+"""
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from finances.benchmarks.data import create_user, populate, replicate
+from finances.filters import category_choices, filter_transactions
+from finances.models import Transaction
+from finances.pagination import KeysetPaginator
+from finances.search import scan_filter, search_filter, search_terms
+
+SEARCHES = ("coffee", "hotel flight", "tax", "pharm", "nothing")
+
+
+class Command(BaseCommand):
+    """
+    Time the first page of searches and filters for a synthetic user,
+    inside a transaction that is rolled back
+    """
+    help = "Benchmark full-text search against icontains scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            start = time.perf_counter()
+            user = create_user("benchmark-search")
+            populate(user, min(options["rows"], 50_000))
+            replicate(user, options["rows"])
+            self.stdout.write(
+                f"Generated and indexed {options['rows']} transactions in "
+                f"{time.perf_counter() - start:.1f}s")
+
+            listing = Transaction.objects.filter(user=user).for_listing()
+            for text in SEARCHES:
+                fts = self.time_page(
+                    listing.filter(search_filter(text, connection)), options["repeat"])
+                scan = self.time_page(
+                    listing.filter(scan_filter(search_terms(text))), options["repeat"])
+                self.stdout.write(
+                    f"{text!r:<16} fts {fts:>8.1f} ms   icontains {scan:>8.1f} ms")
+
+            categories = category_choices(user)
+            category = categories[0][0]
+            filters = {
+                "search": {"q": "hotel flight"},
+                "rare search": {"q": "nothing"},
+                "date range": {"date_from": listing.first().date_created.replace(day=1)},
+                "category": {"category": category},
+                "amount range": {"amount_min": 100, "amount_max": 120},
+                "all filters": {
+                    "q": "coffee", "category": category, "amount_min": 100, "amount_max": 500,
+                },
+            }
+            for name, values in filters.items():
+                timing = self.time_page(
+                    filter_transactions(listing, categories, **values), options["repeat"])
+                self.stdout.write(f"{name:<16} {timing:>8.1f} ms")
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def time_page(queryset, repeat):
+        """
+        Median time of the first listing page of the queryset
+        """
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            KeysetPaginator(queryset.all(), 25).page()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,114 @@
+"""
+Compare the rendering of the transaction cards before and after the
+transaction_cards tag
+"""
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template import engines
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from finances import caching
+from finances.benchmarks.data import create_user, populate
+from finances.models import Transaction
+
+# The card loop of the listings before the tag, with a reversed URL and
+# a CSRF token per row
+LEGACY_CARDS = """
+{% for transaction in transactions %}
+    <div class="card m-4">
+        <div class="card-header d-flex justify-content-between align-items-center">
+            <div class="w-100">
+                <div class="d-flex align-items-center">
+                    <input class="form-check-input me-2" type="checkbox" name="ids" value="{{ transaction.id }}" form="bulk-form">
+                    <h3 class="fs-2">{{ transaction.title }}</h3>
+                    <span class="px-2">
+                        {% if transaction.transaction_type == "EX" %}
+                            <i class="bi bi-dash-circle-fill text-danger"></i>
+                        {% else %}
+                            <i class="bi bi-plus-circle-fill text-success"></i>
+                        {% endif %}
+                    </span>
+                </div>
+                <div>
+                    <span class="fst-italic">{{ transaction.date_created }}</span>
+                </div>
+            </div>
+            <form action="{% url 'delete_transaction' transaction.id %}" action="post">
+                {% csrf_token %}
+                <button class="btn btn-danger">Eliminar</button>
+            </form>
+        </div>
+        <div class="card-body">
+            <p class="fst-italic fw-normal fs-4">{{ transaction.description }}</p>
+            <p class="fs-5 m-0">
+                <span class="fw-semibold">Transaction: </span> {{ transaction.transaction_type }}
+            </p>
+            <p class="fs-5 m-0">
+                <span class="fw-semibold">Category: </span> {{ transaction.category }}
+            </p>
+            {% if transaction.transaction_type == "EX" %}
+                <span class="fw-bolder fs-1 text-danger text-nowrap"> - $ {{ transaction.amount }} </span>
+            {% else %}
+                <span class="fw-bolder fs-1 text-success text-nowrap"> + $ {{ transaction.amount }} </span>
+            {% endif %}
+        </div>
+    </div>
+{% endfor %}
+"""
+
+CARDS = "{% load transactions %}{% transaction_cards transactions %}"
+
+
+class Command(BaseCommand):
+    """
+    Render the cards of a synthetic user with the legacy loop, and with
+    the tag on a cold and on a warm fragment cache, inside a transaction
+    that is rolled back
+    """
+    help = "Benchmark the rendering of the transaction cards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = create_user("benchmark-templates")
+            populate(user, options["rows"])
+            transactions = list(Transaction.objects.filter(user=user).for_listing())
+            request = RequestFactory().get("/report/")
+            request.user = user
+
+            engine = engines["django"]
+            legacy = engine.from_string(LEGACY_CARDS)
+            cards = engine.from_string(CARDS)
+            context = {"transactions": transactions}
+
+            with override_settings(REPORT_CACHE_ENABLED=False):
+                self.report("legacy loop", options["repeat"],
+                            lambda: legacy.render(context, request))
+                self.report("tag, no cache", options["repeat"],
+                            lambda: cards.render(context, request))
+
+            with override_settings(REPORT_CACHE_ENABLED=True):
+                def cold():
+                    caching.get_cache().clear()
+                    return cards.render(context, request)
+                self.report("tag, cold cache", options["repeat"], cold)
+                self.report("tag, warm cache", options["repeat"],
+                            lambda: cards.render(context, request))
+
+            transaction.set_rollback(True)
+
+    def report(self, label, repeat, render):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            render()
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f"{label:<16} mean {statistics.mean(timings):8.2f} ms, "
+            f"best {min(timings):8.2f} ms"
+        )
@@ -0,0 +1,110 @@
+"""
+Compare concurrent writer throughput with the default and the tuned
+SQLite profiles
+"""
+import copy
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.test.utils import override_settings
+from finances.models import Category, CustomUser, Transaction
+
+
+
+class Command(BaseCommand):
+    """
+    Run writer threads against a fresh SQLite file per profile. Every
+    write reads the balance, inserts a transaction and updates the
+    balance in one database transaction, like the delete and create
+    views do.
+    """
+    help = "Benchmark concurrent SQLite writers with and without WAL tuning"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8)
+        parser.add_argument("--writes", type=int, default=200, help="Writes per writer")
+
+    def handle(self, *args, **options):
+        default = connections["default"].settings_dict
+        if default["ENGINE"] != "django.db.backends.sqlite3":
+            self.stderr.write("The default database is not SQLite, nothing to compare")
+            return
+
+        with tempfile.TemporaryDirectory() as directory:
+            for profile, (options_dict, pragmas) in self.profiles(default).items():
+                alias = f"benchmark_{profile}"
+                settings_dict = copy.deepcopy(default)
+                settings_dict["NAME"] = Path(directory) / f"{profile}.sqlite3"
+                settings_dict["OPTIONS"] = options_dict
+                connections.settings[alias] = settings_dict
+                try:
+                    with override_settings(SQLITE_PRAGMAS=pragmas):
+                        self.run_profile(profile, alias, options)
+                finally:
+                    connections[alias].close()
+                    del connections.settings[alias]
+
+    @staticmethod
+    def profiles(default):
+        """
+        The OPTIONS and PRAGMAs of each profile, baseline is what Django
+        does without configuration
+        """
+        return {
+            "baseline": ({}, {}),
+            "tuned": (default.get("OPTIONS", {}), settings.SQLITE_PRAGMAS),
+        }
+
+    def run_profile(self, profile, alias, options):
+        call_command("migrate", database=alias, verbosity=0)
+        user = CustomUser.objects.db_manager(alias).create_user(f"writer-{profile}")
+        category = Category.objects.using(alias).create(title="Food", user=user)
+
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self.writer, args=(alias, user.pk, category.pk, options["writes"], errors))
+            for _ in range(options["writers"])
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        written = Transaction.objects.using(alias).count()
+        self.stdout.write(
+            f"{profile:<10} {written / elapsed:>9.1f} writes/s "
+            f"{written:>6} committed {sum(errors):>6} failed with locked database"
+        )
+
+    @staticmethod
+    def writer(alias, user_id, category_id, writes, errors):
+        failed = 0
+        users = CustomUser.objects.using(alias).filter(pk=user_id)
+        try:
+            for number in range(writes):
+                try:
+                    with transaction.atomic(using=alias):
+                        users.values_list("total_amount", flat=True).get()
+                        Transaction.objects.using(alias).create(
+                            title=f"Write {number}",
+                            transaction_type="EX",
+                            amount=Decimal("1.00"),
+                            category_id=category_id,
+                            user_id=user_id,
+                        )
+                        users.update(total_amount=F("total_amount") - 1)
+                except OperationalError:
+                    failed += 1
+        finally:
+            connections[alias].close()
+            errors.append(failed)
@@ -0,0 +1,26 @@
+"""
+Verify the monthly summaries against the transactions
+"""
+from django.core.management.base import BaseCommand, CommandError
+from finances.aggregates import check_summaries
+
+
+class Command(BaseCommand):
+    """
+    Compare every summary row with a full GROUP BY over the ledger
+    """
+    help = "Check the monthly transaction summaries for drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="Only check the given user id (repeatable)")
+
+    def handle(self, *args, **options):
+        mismatches = check_summaries(options["users"])
+        for key, expected, stored in mismatches:
+            self.stdout.write(f"{key}: expected {expected}, stored {stored}")
+        if mismatches:
+            raise CommandError(
+                f"{len(mismatches)} summaries are out of date, "
+                "run rebuild_aggregates to fix them")
+        self.stdout.write(self.style.SUCCESS("Summaries are consistent"))
@@ -0,0 +1,43 @@
+"""
+Import a bank statement file for a user
+"""
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from finances.importers import DEFAULT_BATCH_SIZE, PARSERS, import_transactions
+from finances.models import CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Stream a CSV or OFX file into the ledger of a user in batches
+    """
+    help = "Import the transactions of a CSV or OFX file for a user"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--format", choices=PARSERS, dest="file_format",
+                            help="Defaults to the extension of the file")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(username=options["username"])
+        except CustomUser.DoesNotExist as error:
+            raise CommandError(f"User {options['username']} does not exist") from error
+
+        path = options["path"]
+        file_format = options["file_format"] or path.suffix.lstrip(".").lower()
+        if file_format not in PARSERS:
+            raise CommandError(f"Unknown format {file_format}, use --format")
+
+        with path.open(encoding="utf-8-sig", newline="") as lines:
+            result = import_transactions(
+                user, lines, file_format, options["batch_size"])
+
+        for line, errors in result.errors:
+            self.stderr.write(f"Line {line}: {', '.join(errors)}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} transactions, rejected {result.failed} "
+            f"in {result.elapsed:.2f}s ({result.rows_per_second:.0f} rows/s)"
+        ))
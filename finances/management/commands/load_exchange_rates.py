@@ -0,0 +1,24 @@
+"""
+Load a file of daily exchange rates
+"""
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from finances.currencies import DEFAULT_BATCH_SIZE, load_rates
+
+
+class Command(BaseCommand):
+    """
+    Insert or update the rates of a CSV file in the layout of the ECB
+    reference rates history (eurofxref-hist.csv), so conversions work
+    offline
+    """
+    help = "Load the daily exchange rates of a CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        with options["path"].open(encoding="utf-8-sig", newline="") as lines:
+            loaded = load_rates(lines, options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Loaded {loaded} exchange rates"))
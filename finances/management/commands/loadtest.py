@@ -0,0 +1,81 @@
+"""
+Compare requests/sec and p99 latency of the views under WSGI and ASGI
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+from finances.aggregates import rebuild_summaries
+from finances.benchmarks.data import create_user, populate
+from finances.benchmarks.loadtest import run_load, server_command, start_server, stop_server
+from finances.models import CustomUser
+
+USERNAME = "loadtest"
+VIEWS = ("report", "expenses", "incomes")
+
+
+class Command(BaseCommand):
+    """
+    Start a local WSGI server and a local ASGI server in turn and load
+    the sync and async variants of the listing views. The synthetic user
+    is committed, since the servers run in other processes, and deleted
+    at the end.
+
+    gunicorn is used for WSGI when installed, else runserver. uvicorn or
+    daphne must be installed for the ASGI run.
+    """
+    help = "Load test the report views under WSGI and ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50_000)
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+
+    def handle(self, *args, **options):
+        CustomUser.objects.filter(username=USERNAME).delete()
+        user = create_user(USERNAME)
+        try:
+            populate(user, options["rows"])
+            rebuild_summaries([user])
+            client = Client()
+            client.force_login(user)
+            session = client.cookies[settings.SESSION_COOKIE_NAME].value
+            cookie = f"{settings.SESSION_COOKIE_NAME}={session}"
+
+            self.stdout.write(
+                f"{'server':<18}{'view':<26}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+            for interface in ("wsgi", "asgi"):
+                self.run_interface(interface, cookie, options)
+        finally:
+            user.delete()
+
+    def run_interface(self, interface, cookie, options):
+        base_url = f"http://{options['host']}:{options['port']}"
+        name, command = server_command(
+            interface, options["host"], options["port"],
+            options["workers"], options["concurrency"])
+        if command is None:
+            self.stderr.write(f"No {interface.upper()} server installed, skipping")
+            return
+
+        # Async views only pay off without the thread hop of WSGI
+        paths = [reverse(view) for view in VIEWS]
+        if interface == "asgi":
+            paths += [reverse(f"async_{view}") for view in VIEWS]
+
+        process = start_server(command, base_url + reverse("login"))
+        try:
+            for path in paths:
+                url = base_url + path
+                run_load(url, cookie, options["concurrency"], options["concurrency"])
+                result = run_load(url, cookie, options["requests"], options["concurrency"])
+                self.stdout.write(
+                    f"{interface + '/' + name:<18}{path:<26}"
+                    f"{result.requests_per_second:>10.1f}{result.p50:>10.1f}"
+                    f"{result.p99:>10.1f}{result.errors:>8}"
+                )
+        finally:
+            stop_server(process)
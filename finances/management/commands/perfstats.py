@@ -0,0 +1,71 @@
+"""
+Dump the request performance histograms of every process
+"""
+import json
+import shutil
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from finances.middleware import METRICS
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    index = max(0, min(len(values) - 1, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+class Command(BaseCommand):
+    """
+    Merge the samples saved by PerformanceMiddleware and print the
+    p50/p95/p99 of each metric per view
+    """
+    help = "Show per-view request timings recorded by the performance middleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+        parser.add_argument("--reset", action="store_true", help="Delete the recorded samples")
+
+    def handle(self, *args, **options):
+        directory = settings.PERFORMANCE_STATS_DIR
+        if options["reset"]:
+            shutil.rmtree(directory, ignore_errors=True)
+            self.stdout.write(self.style.SUCCESS("Samples deleted"))
+            return
+
+        samples = defaultdict(lambda: defaultdict(list))
+        for path in sorted(directory.glob("*.json")) if directory.exists() else []:
+            for view_name, metrics in json.loads(path.read_text()).items():
+                for metric, values in metrics.items():
+                    samples[view_name][metric].extend(values)
+
+        report = {}
+        for view_name, metrics in sorted(samples.items()):
+            report[view_name] = {"requests": len(metrics["total"])}
+            for metric in METRICS:
+                values = sorted(metrics[metric])
+                if values:
+                    report[view_name][metric] = {
+                        "p50": percentile(values, 0.50),
+                        "p95": percentile(values, 0.95),
+                        "p99": percentile(values, 0.99),
+                    }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if not report:
+            self.stdout.write("No samples recorded, set PERFORMANCE_INSTRUMENTATION=1")
+            return
+        self.stdout.write(
+            f"{'view':<22}{'requests':>9}" +
+            "".join(f"{metric + ' p50/p95/p99':>30}" for metric in METRICS))
+        for view_name, row in report.items():
+            cells = []
+            for metric in METRICS:
+                values = row.get(metric, {"p50": 0, "p95": 0, "p99": 0})
+                cells.append(
+                    f"{values['p50']:>10.1f}{values['p95']:>10.1f}{values['p99']:>10.1f}")
+            self.stdout.write(f"{view_name:<22}{row['requests']:>9}" + "".join(cells))
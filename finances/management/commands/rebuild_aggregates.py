@@ -0,0 +1,26 @@
+"""
+Rebuild the monthly summaries from the transactions
+"""
+import time
+from django.core.management.base import BaseCommand
+from finances.aggregates import REBUILD_BATCH_SIZE, rebuild_summaries
+
+
+class Command(BaseCommand):
+    """
+    Drop and recompute the monthly summaries with a single GROUP BY,
+    inserting the result in batches
+    """
+    help = "Rebuild the monthly transaction summaries from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="Only rebuild the given user id (repeatable)")
+        parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        written = rebuild_summaries(options["users"], options["batch_size"])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} summary rows in {elapsed:.2f}s"))
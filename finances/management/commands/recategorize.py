@@ -0,0 +1,33 @@
+"""
+Apply the categorization rules to existing transactions
+"""
+import time
+from django.core.management.base import BaseCommand
+from finances.rules import RECATEGORIZE_BATCH_SIZE, recategorize
+
+
+class Command(BaseCommand):
+    """
+    Move the transactions to the category of the first rule of their
+    user that matches them, batch by batch with bulk_update, keeping the
+    summaries in step. Transactions that no rule matches are left alone.
+    """
+    help = "Recategorize the transactions with the rules of their users"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="users",
+                            help="Only recategorize the given user id (repeatable)")
+        parser.add_argument("--category", type=int, action="append", dest="categories",
+                            help="Only read the transactions of the given category id "
+                                 "(repeatable)")
+        parser.add_argument("--batch-size", type=int, default=RECATEGORIZE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        moved = recategorize(
+            options["users"], options["categories"], options["batch_size"],
+            progress=lambda read, moved: self.stdout.write(
+                f"{read} transactions read, {moved} moved"))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} transactions to the category of their rule in {elapsed:.2f}s"))
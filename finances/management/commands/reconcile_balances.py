@@ -0,0 +1,82 @@
+"""
+Verify the stored balance of every user against the ledger
+"""
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from finances.balances import build_checkpoints, reconcile_users
+from finances.models import CustomUser
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def init_worker():
+    # Needed when the pool spawns instead of forking
+    django.setup()
+
+
+def reconcile_batch(user_ids, repair, checkpoints):
+    """
+    Reconcile a batch of users in a worker process
+    """
+    drifts = reconcile_users(user_ids, repair)
+    if checkpoints:
+        for user in CustomUser.objects.filter(id__in=user_ids):
+            build_checkpoints(user)
+    return len(user_ids), drifts
+
+
+class Command(BaseCommand):
+    """
+    Compare total_amount with the sum of the ledger, one aggregate query
+    per batch of users, spreading the batches over a process pool
+    """
+    help = "Reconcile the user balances with their transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Processes to use, 1 runs in this process")
+        parser.add_argument("--repair", action="store_true",
+                            help="Fix the balances that drifted")
+        parser.add_argument("--checkpoints", action="store_true",
+                            help="Also rebuild the monthly balance checkpoints")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        user_ids = CustomUser.objects.order_by("id").values_list("id", flat=True).iterator()
+        batches = iter(lambda: list(itertools.islice(user_ids, options["batch_size"])), [])
+        arguments = (options["repair"], options["checkpoints"])
+
+        if options["workers"] == 1:
+            results = (reconcile_batch(batch, *arguments) for batch in batches)
+            checked, drifts = self.collect(results)
+        else:
+            batches = list(batches)
+            # The workers open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(options["workers"], initializer=init_worker) as pool:
+                checked, drifts = self.collect(pool.map(
+                    reconcile_batch, batches,
+                    itertools.repeat(options["repair"]), itertools.repeat(options["checkpoints"]),
+                ))
+
+        for user_id, stored, expected in drifts:
+            self.stdout.write(
+                f"user {user_id}: stored {stored}, ledger {expected}, drift {expected - stored}")
+        action = "repaired" if options["repair"] else "found"
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} users in {time.perf_counter() - start:.2f}s, "
+            f"{action} {len(drifts)} drifted balances"))
+
+    @staticmethod
+    def collect(results):
+        checked, drifts = 0, []
+        for batch_size, batch_drifts in results:
+            checked += batch_size
+            drifts.extend(batch_drifts)
+        return checked, drifts
@@ -0,0 +1,29 @@
+"""
+Create the transactions of the due recurring rules
+"""
+import datetime
+import time
+from django.core.management.base import BaseCommand
+from finances.recurring import DEFAULT_BATCH_SIZE, run_recurring
+
+
+class Command(BaseCommand):
+    """
+    Materialize every due recurring rule in batches, catching up on the
+    periods missed since the last run. Safe to run again at any time.
+    """
+    help = "Create the transactions of the due recurring rules"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", type=datetime.date.fromisoformat,
+                            help="Create the transactions due up to this date, defaults to today")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rules, created = run_recurring(options["date"], options["batch_size"])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {rules} rules, created {created} transactions "
+            f"in {elapsed:.2f}s ({rules / elapsed if elapsed else 0:.0f} rules/s)"
+        ))
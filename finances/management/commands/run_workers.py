@@ -0,0 +1,62 @@
+"""
+Run the workers of the background job queue
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from finances.jobs import work, worker_name
+
+
+def init_worker():
+    # Needed when the pool spawns instead of forking
+    django.setup()
+
+
+def run_worker(number, burst, max_jobs, poll_interval):
+    """
+    Run jobs in a worker process until it is done or interrupted
+    """
+    try:
+        return work(worker_name(number), burst, max_jobs, poll_interval)
+    except KeyboardInterrupt:
+        # The job that was running is queued again once it is stale
+        return 0
+
+
+class Command(BaseCommand):
+    """
+    Start a pool of worker processes that claim the queued jobs from the
+    database and run them
+    """
+    help = "Run the background job workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.JOB_WORKERS,
+                            help="Processes to use, 1 runs in this process")
+        parser.add_argument("--burst", action="store_true",
+                            help="Stop once the queue is empty")
+        parser.add_argument("--max-jobs", type=int, default=None,
+                            help="Jobs each worker runs before stopping")
+        parser.add_argument("--poll-interval", type=float, default=settings.JOB_POLL_INTERVAL,
+                            help="Seconds to wait when the queue is empty")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        arguments = (options["burst"], options["max_jobs"], options["poll_interval"])
+        if options["workers"] == 1:
+            done = run_worker(0, *arguments)
+        else:
+            # The workers open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(options["workers"], initializer=init_worker) as pool:
+                futures = [
+                    pool.submit(run_worker, number, *arguments)
+                    for number in range(options["workers"])
+                ]
+                done = sum(future.result() for future in futures)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {done} jobs with {options['workers']} workers in {elapsed:.2f}s"))
@@ -0,0 +1,41 @@
+"""
+Change the base currency of a user
+"""
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from finances.currencies import MissingExchangeRate, change_base_currency
+from finances.models import CURRENCY_CODE, CustomUser
+
+
+class Command(BaseCommand):
+    """
+    Convert the ledger and balance of a user to another currency at the
+    rates of each transaction date, and their budgets and recurring
+    transactions at the rates of today
+    """
+    help = (
+        "Change the currency of the balance, reports, budgets and recurring "
+        "transactions of a user"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("currency")
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(username=options["username"])
+        except CustomUser.DoesNotExist as error:
+            raise CommandError(f"User {options['username']} does not exist") from error
+
+        currency = options["currency"].strip().upper()
+        try:
+            CURRENCY_CODE(currency)
+        except ValidationError as error:
+            raise CommandError(f"{currency} is not a currency code") from error
+        try:
+            user = change_base_currency(user, currency)
+        except MissingExchangeRate as error:
+            raise CommandError(str(error)) from error
+        self.stdout.write(self.style.SUCCESS(
+            f"{user.username} now uses {user.currency}, balance {user.total_amount}"))
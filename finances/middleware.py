@@ -0,0 +1,176 @@
+"""
+Opt-in request performance instrumentation
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("total", "sql", "queries", "template")
+
+
+class QueryTimer:
+    """
+    Database execute wrapper that counts and times every query
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+
+class PerformanceStats:
+    """
+    Rolling samples of the request metrics of each view in this process,
+    saved to a JSON file per process so perfstats can merge them
+    """
+    def __init__(self, size):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: {metric: deque(maxlen=size) for metric in METRICS})
+        self.last_flush = time.monotonic()
+
+    def record(self, view_name, values):
+        with self.lock:
+            for metric, value in values.items():
+                self.samples[view_name][metric].append(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                view_name: {metric: list(values) for metric, values in metrics.items()}
+                for view_name, metrics in self.samples.items()
+            }
+
+    def flush(self, directory, force=False):
+        """
+        Write the snapshot of this process, at most once per interval
+        """
+        now = time.monotonic()
+        if not force and now - self.last_flush < settings.PERFORMANCE_FLUSH_INTERVAL:
+            return
+        self.last_flush = now
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{os.getpid()}.json"
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(self.snapshot()))
+        os.replace(temporary, path)
+
+
+stats = None
+
+
+def get_stats():
+    global stats
+    if stats is None:
+        stats = PerformanceStats(settings.PERFORMANCE_SAMPLES)
+    return stats
+
+
+class PerformanceMiddleware:
+    """
+    Measure wall time, SQL count and time, and template render time of
+    every request. Adds a Server-Timing header and warns about probable
+    N+1 query patterns when a view exceeds its query budget.
+
+    Enabled with the PERFORMANCE_INSTRUMENTATION setting.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.stats = get_stats()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.template_duration = 0.0
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        return self.finish(request, response, timer, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        request.template_duration = 0.0
+        timer = QueryTimer()
+        start = time.perf_counter()
+        # Connections belong to threads, and the async ORM runs its queries
+        # in the thread sensitive executor of the request, so install the
+        # wrapper there
+        await sync_to_async(lambda: connection.execute_wrappers.append(timer))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(timer))()
+        return self.finish(request, response, timer, time.perf_counter() - start)
+
+    def finish(self, request, response, timer, total):
+        view_name = self.view_name(request)
+        self.stats.record(view_name, {
+            "total": total * 1000,
+            "sql": timer.duration * 1000,
+            "queries": timer.count,
+            "template": request.template_duration * 1000,
+        })
+        self.stats.flush(settings.PERFORMANCE_STATS_DIR)
+        self.check_budget(view_name, timer)
+
+        response["Server-Timing"] = ", ".join((
+            f"total;dur={total * 1000:.1f}",
+            f'sql;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"',
+            f"template;dur={request.template_duration * 1000:.1f}",
+        ))
+        return response
+
+    def process_template_response(self, request, response):
+        """
+        Render here to time the template, rendering again is a no-op
+        """
+        start = time.perf_counter()
+        response.render()
+        request.template_duration += time.perf_counter() - start
+        return response
+
+    @staticmethod
+    def view_name(request):
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return "unresolved"
+        return match.view_name
+
+    @staticmethod
+    def check_budget(view_name, timer):
+        budget = settings.PERFORMANCE_QUERY_BUDGETS.get(
+            view_name, settings.PERFORMANCE_DEFAULT_QUERY_BUDGET)
+        if timer.count <= budget:
+            return
+        statement, repeats = timer.statements.most_common(1)[0]
+        logger.warning(
+            "Possible N+1 in %s: %d queries for a budget of %d, "
+            "the most repeated statement ran %d times: %s",
+            view_name, timer.count, budget, repeats, statement,
+        )
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:27
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0003_monthlysummary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='date_created',
+            field=models.DateField(default=datetime.date.today, editable=False),
+        ),
+    ]
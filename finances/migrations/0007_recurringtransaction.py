@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:21
+
+import datetime
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0006_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('description', models.TextField(blank=True)),
+                ('transaction_type', models.CharField(choices=[('EX', 'Expense'), ('IN', 'Income')], max_length=15)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=100, validators=[django.core.validators.MinValueValidator(0)])),
+                ('frequency', models.CharField(choices=[('D', 'Daily'), ('W', 'Weekly'), ('M', 'Monthly'), ('Y', 'Yearly')], max_length=1)),
+                ('start_date', models.DateField(default=datetime.date.today)),
+                ('next_due', models.DateField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='finances.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_due'], name='recurring_next_due')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:45
+
+import django.core.validators
+import finances.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0008_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='currency',
+            field=models.CharField(default=finances.models.default_currency, max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter a three letter currency code.')]),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='currency',
+            field=models.CharField(blank=True, max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter a three letter currency code.')]),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='original_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=100, null=True),
+        ),
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('currency', models.CharField(max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter a three letter currency code.')])),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=20)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('currency', 'date'), name='exchange_rate_unique_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0009_currencies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='archived_before',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200)),
+                ('description', models.TextField(blank=True)),
+                ('date_created', models.DateField()),
+                ('transaction_type', models.CharField(choices=[('EX', 'Expense'), ('IN', 'Income')], max_length=15)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=100)),
+                ('currency', models.CharField(blank=True, max_length=3)),
+                ('original_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=100, null=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='finances.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'transaction_type', 'date_created'], name='archived_user_type_date'), models.Index(fields=['user', 'date_created'], name='archived_user_date')],
+            },
+        ),
+    ]
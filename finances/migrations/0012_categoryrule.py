@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0011_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('K', 'Keyword'), ('R', 'Regular expression'), ('A', 'Amount range')], max_length=1)),
+                ('pattern', models.CharField(blank=True, max_length=200)),
+                ('amount_min', models.DecimalField(blank=True, decimal_places=2, max_digits=100, null=True)),
+                ('amount_max', models.DecimalField(blank=True, decimal_places=2, max_digits=100, null=True)),
+                ('transaction_type', models.CharField(blank=True, choices=[('EX', 'Expense'), ('IN', 'Income')], max_length=15)),
+                ('priority', models.PositiveIntegerField(default=100)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='finances.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0012_categoryrule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='data_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='rewrite_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
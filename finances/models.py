@@ -1,6 +1,18 @@
+import datetime
+from decimal import Decimal
+from django.conf import settings
 from django.db import models
-from django.core.validators import MinValueValidator
+from django.db.models import Case, F, Sum, When
+from django.core.validators import MinValueValidator, RegexValidator
 from django.contrib.auth.models import AbstractUser
+from .caching import forget_user, invalidate_on_commit
+
+CENTS = Decimal("0.01")
+CURRENCY_CODE = RegexValidator(r"^[A-Z]{3}$", "Enter a three letter currency code.")
+
+
+def default_currency():
+    return settings.BASE_CURRENCY
 
 # Create your models here.
 
@@ -11,6 +23,30 @@ class CustomUser(AbstractUser):
     """
     total_amount = models.DecimalField(
         max_digits=100, decimal_places=2, default=0)
+    # The balance, reports, budgets and recurring transactions of the user
+    # are in this currency
+    currency = models.CharField(
+        max_length=3, default=default_currency, validators=[CURRENCY_CODE])
+    # Transactions dated before this day may be in the archive table, None
+    # when nothing of the user was archived
+    archived_before = models.DateField(null=True, blank=True, editable=False)
+    # Counts the changes of the data of the user, and the count at the last
+    # change that did not only add transactions, see invalidate_on_commit
+    data_version = models.BigIntegerField(default=0, editable=False)
+    rewrite_version = models.BigIntegerField(default=0, editable=False)
+
+    def apply_balance_change(self, amount, rewrite=False):
+        """
+        Add the amount to the balance with a single UPDATE, so concurrent
+        changes of the same user are never lost. The same UPDATE counts
+        the change in the data version of the user, see
+        invalidate_on_commit.
+
+        The in-memory total_amount is not refreshed. The cached user is
+        dropped at once.
+        """
+        invalidate_on_commit(self.pk, rewrite, total_amount=F("total_amount") + amount)
+        forget_user(self.pk)
 
 
 class Category(models.Model):
@@ -25,6 +61,41 @@ class Category(models.Model):
         return self.title + ""
 
 
+class TransactionQuerySet(models.QuerySet):
+    """
+    Common queries over transactions
+    """
+    LISTING_FIELDS = (
+        "id",
+        "title",
+        "description",
+        "date_created",
+        "transaction_type",
+        "amount",
+        "currency",
+        "original_amount",
+        "category__title",
+    )
+
+    def for_listing(self):
+        """
+        Load only the columns rendered by the transaction listings,
+        joining the category in the same query
+        """
+        return self.select_related("category").only(*self.LISTING_FIELDS)
+
+    def balance_effect(self):
+        """
+        The sum of the signed amounts, with one aggregate query
+        """
+        effect = self.aggregate(effect=Sum(
+            Case(When(transaction_type="EX", then=-F("amount")), default=F("amount")),
+            default=0,
+        ))["effect"]
+        # SQLite sums decimals as floating point numbers
+        return Decimal(effect).quantize(CENTS)
+
+
 class Transaction(models.Model):
     """
     Transaction model
@@ -36,13 +107,336 @@ class Transaction(models.Model):
 
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
-    date_created = models.DateField(auto_now_add=True)
+    # A default instead of auto_now_add so bulk imports keep their dates
+    date_created = models.DateField(default=datetime.date.today, editable=False)
     transaction_type = models.CharField(
         max_length=15, choices=TRANSACTION_TYPES)
     amount = models.DecimalField(
         max_digits=100, decimal_places=2, validators=[MinValueValidator(0)])
+    # amount is always in the currency of the user. Transactions in another
+    # currency keep what was entered here, blank means the user currency.
+    currency = models.CharField(max_length=3, blank=True, validators=[CURRENCY_CODE])
+    original_amount = models.DecimalField(
+        max_digits=100, decimal_places=2, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
 
+    objects = TransactionQuerySet.as_manager()
+
+    @property
+    def signed_amount(self):
+        """
+        The effect of the transaction on the balance of the user
+        """
+        if self.transaction_type == "EX":
+            return -self.amount
+        return self.amount
+
+    class Meta:
+        """
+        Properties
+        """
+        indexes = [
+            # Expenses and incomes listings, newest first
+            models.Index(
+                fields=["user", "transaction_type", "date_created"],
+                name="transaction_user_type_date",
+            ),
+            # General report, newest first
+            models.Index(
+                fields=["user", "date_created"],
+                name="transaction_user_date",
+            ),
+            # Per category lookups and breakdowns
+            models.Index(
+                fields=["user", "category"],
+                name="transaction_user_category",
+            ),
+        ]
+
+    def __str__(self):
+        return self.title + " | " + self.transaction_type
+
+
+class ArchivedTransaction(models.Model):
+    """
+    Transaction moved out of the ledger by archive_transactions. It keeps
+    its id and columns, and the summaries and the balance still count it.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True)
+    date_created = models.DateField()
+    transaction_type = models.CharField(
+        max_length=15, choices=Transaction.TRANSACTION_TYPES)
+    amount = models.DecimalField(max_digits=100, decimal_places=2)
+    currency = models.CharField(max_length=3, blank=True)
+    original_amount = models.DecimalField(
+        max_digits=100, decimal_places=2, null=True, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+
+    objects = TransactionQuerySet.as_manager()
+
+    signed_amount = Transaction.signed_amount
+
+    class Meta:
+        """
+        Properties
+        """
+        indexes = [
+            # Listings and reports over archived date ranges
+            models.Index(
+                fields=["user", "transaction_type", "date_created"],
+                name="archived_user_type_date",
+            ),
+            models.Index(
+                fields=["user", "date_created"],
+                name="archived_user_date",
+            ),
+        ]
+
     def __str__(self):
         return self.title + " | " + self.transaction_type
+
+
+class MonthlySummary(models.Model):
+    """
+    Precomputed totals of the transactions of a user per category,
+    transaction type and month
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    transaction_type = models.CharField(
+        max_length=15, choices=Transaction.TRANSACTION_TYPES)
+    month = models.DateField()
+    total = models.DecimalField(max_digits=100, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        """
+        Properties
+        """
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "month", "category", "transaction_type"],
+                name="monthly_summary_unique_key",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} | {self.category_id} | {self.transaction_type}"
+
+
+class Budget(models.Model):
+    """
+    Monthly spending limit of a user for the expenses of a category
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    amount = models.DecimalField(
+        max_digits=100, decimal_places=2, validators=[MinValueValidator(0)])
+
+    class Meta:
+        """
+        Properties
+        """
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "category"],
+                name="budget_unique_category",
+            ),
+        ]
+
+    # month_spend is annotated by finances.budgets.budget_statuses
+    @property
+    def spent(self):
+        # SQLite sums decimals as floating point numbers
+        return self.month_spend.quantize(CENTS)
+
+    @property
+    def remaining(self):
+        return self.amount - self.spent
+
+    @property
+    def is_over(self):
+        return self.spent > self.amount
+
+    @property
+    def used_percent(self):
+        if not self.amount:
+            return 100
+        return min(100, int(self.spent * 100 / self.amount))
+
+    def __str__(self):
+        return f"{self.category_id} | {self.amount}"
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Balance of a user at the start of a month, before the transactions
+    of the month
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    month = models.DateField()
+    balance = models.DecimalField(max_digits=100, decimal_places=2)
+
+    class Meta:
+        """
+        Properties
+        """
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "month"],
+                name="balance_checkpoint_unique_month",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} | {self.user_id} | {self.balance}"
+
+
+class RecurringTransaction(models.Model):
+    """
+    Rule that creates the same transaction every period, from start_date
+    on. next_due is the date of the next transaction to create.
+    """
+    FREQUENCIES = [
+        ("D", "Daily"),
+        ("W", "Weekly"),
+        ("M", "Monthly"),
+        ("Y", "Yearly"),
+    ]
+
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True)
+    transaction_type = models.CharField(
+        max_length=15, choices=Transaction.TRANSACTION_TYPES)
+    amount = models.DecimalField(
+        max_digits=100, decimal_places=2, validators=[MinValueValidator(0)])
+    frequency = models.CharField(max_length=1, choices=FREQUENCIES)
+    # Monthly and yearly rules keep the day of the start date, clamped to
+    # the length of shorter months
+    start_date = models.DateField(default=datetime.date.today)
+    next_due = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+
+    class Meta:
+        """
+        Properties
+        """
+        indexes = [
+            # Due rules of the scheduler
+            models.Index(fields=["next_due"], name="recurring_next_due"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.next_due is None:
+            self.next_due = self.start_date
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.title} | {self.frequency} | {self.next_due}"
+
+
+class ExchangeRate(models.Model):
+    """
+    Daily rate of a currency, as units of the currency per unit of the
+    EXCHANGE_RATE_PIVOT currency
+    """
+    date = models.DateField()
+    currency = models.CharField(max_length=3, validators=[CURRENCY_CODE])
+    rate = models.DecimalField(max_digits=20, decimal_places=8)
+
+    class Meta:
+        """
+        Properties
+        """
+        constraints = [
+            # Also serves the latest rate on or before a date
+            models.UniqueConstraint(
+                fields=["currency", "date"],
+                name="exchange_rate_unique_day",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} | {self.currency} | {self.rate}"
+
+
+class Job(models.Model):
+    """
+    Background job of the database queue, run by manage.py run_workers.
+    Finished jobs keep their result until they are deleted.
+    """
+    STATUSES = [
+        ("Q", "Queued"),
+        ("R", "Running"),
+        ("D", "Done"),
+        ("F", "Failed"),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=1, choices=STATUSES, default="Q")
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    result = models.BinaryField(null=True)
+    result_name = models.CharField(max_length=100, blank=True)
+    result_type = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        """
+        Properties
+        """
+        indexes = [
+            # Oldest queued job first, and the stale running ones
+            models.Index(fields=["status", "id"], name="job_status_queue"),
+            # Recent jobs of the user
+            models.Index(fields=["user", "kind", "id"], name="job_user_kind"),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in ("D", "F")
+
+    def __str__(self):
+        return f"{self.kind} | {self.user_id} | {self.status}"
+
+
+class CategoryRule(models.Model):
+    """
+    Rule of a user that chooses the category of a transaction from its
+    title or its amount. The rule with the lowest priority that matches
+    wins, ties go to the oldest rule.
+    """
+    KINDS = [
+        ("K", "Keyword"),
+        ("R", "Regular expression"),
+        ("A", "Amount range"),
+    ]
+
+    kind = models.CharField(max_length=1, choices=KINDS)
+    # The keyword or the expression searched in the title, ignoring case.
+    # Amount range rules have none.
+    pattern = models.CharField(max_length=200, blank=True)
+    # Bounds of the amount, also usable with keywords and expressions
+    amount_min = models.DecimalField(
+        max_digits=100, decimal_places=2, null=True, blank=True)
+    amount_max = models.DecimalField(
+        max_digits=100, decimal_places=2, null=True, blank=True)
+    # Blank matches expenses and incomes
+    transaction_type = models.CharField(
+        max_length=15, choices=Transaction.TRANSACTION_TYPES, blank=True)
+    priority = models.PositiveIntegerField(default=100)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} | {self.pattern} | {self.category_id}"
@@ -0,0 +1,225 @@
+"""
+Keyset (cursor) pagination for the transaction listings
+"""
+import base64
+import binascii
+import datetime
+import heapq
+import json
+from django.db.models import Q
+from django.http import Http404
+from django.views.generic.base import ContextMixin
+from .caching import aget_or_compute, get_or_compute
+
+
+class KeysetPage:
+    """
+    A single page of a keyset paginated queryset
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a transaction queryset on (date_created, id), newest first.
+
+    Instead of OFFSET, every page starts right after the key of the last
+    row of the previous page, so the cost of a page does not depend on how
+    deep the user is in the history.
+
+    archived is an optional queryset of archived transactions, paginated
+    together with the queryset. Both are read with the same keys and the
+    rows merged, their ids never collide.
+    """
+    def __init__(self, queryset, per_page, archived=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.archived = archived
+
+    @staticmethod
+    def encode_cursor(transaction, reverse=False):
+        """
+        Build an opaque token pointing at the given transaction
+        """
+        payload = {
+            "d": transaction.date_created.isoformat(),
+            "i": transaction.id,
+            "r": int(reverse),
+        }
+        raw = json.dumps(payload, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Return the (date_created, id, reverse) tuple of a token
+        """
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(cursor + padding))
+            date_created = datetime.date.fromisoformat(payload["d"])
+            return date_created, int(payload["i"]), bool(payload["r"])
+        except (binascii.Error, ValueError, KeyError, TypeError) as error:
+            raise Http404("Invalid page cursor") from error
+
+    def page(self, cursor=None):
+        """
+        Return the page that starts at the given cursor
+        """
+        queryset, reverse, has_previous = self._page_queryset(self.queryset, cursor)
+        rows = list(queryset)
+        if self.archived is not None:
+            archived, _, _ = self._page_queryset(self.archived, cursor)
+            rows = self._merge_rows(rows, list(archived), reverse)
+        return self._page_from_rows(rows, reverse, has_previous)
+
+    async def apage(self, cursor=None):
+        """
+        Async version of page
+        """
+        queryset, reverse, has_previous = self._page_queryset(self.queryset, cursor)
+        rows = [row async for row in queryset.aiterator()]
+        if self.archived is not None:
+            archived, _, _ = self._page_queryset(self.archived, cursor)
+            rows = self._merge_rows(rows, [row async for row in archived.aiterator()], reverse)
+        return self._page_from_rows(rows, reverse, has_previous)
+
+    def _page_queryset(self, queryset, cursor):
+        """
+        Return the sliced queryset of the page, whether it is read
+        backwards, and whether there is a page before it
+        """
+        if not cursor:
+            queryset = queryset.order_by("-date_created", "-id")
+            return queryset[:self.per_page + 1], False, False
+
+        date_created, pk, reverse = self.decode_cursor(cursor)
+        if reverse:
+            queryset = queryset.filter(
+                Q(date_created__gt=date_created) |
+                Q(date_created=date_created, id__gt=pk)
+            ).order_by("date_created", "id")
+            return queryset[:self.per_page + 1], True, False
+
+        queryset = queryset.filter(
+            Q(date_created__lt=date_created) |
+            Q(date_created=date_created, id__lt=pk)
+        ).order_by("-date_created", "-id")
+        return queryset[:self.per_page + 1], False, True
+
+    @staticmethod
+    def row_key(row):
+        return row.date_created, row.id
+
+    def _merge_rows(self, rows, archived, reverse):
+        """
+        Merge the rows of both querysets in page order, keeping the one
+        extra row that tells if there is another page
+        """
+        merged = heapq.merge(rows, archived, key=self.row_key, reverse=not reverse)
+        return list(merged)[:self.per_page + 1]
+
+    def _page_from_rows(self, rows, reverse, has_previous):
+        # One extra row is fetched to know if there is another page
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return self._build_page(rows, bool(rows), has_more)
+        return self._build_page(rows, has_more, has_previous and bool(rows))
+
+    def _build_page(self, rows, has_next, has_previous):
+        next_cursor = None
+        previous_cursor = None
+        if has_next:
+            next_cursor = self.encode_cursor(rows[-1])
+        if has_previous:
+            previous_cursor = self.encode_cursor(rows[0], reverse=True)
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+class KeysetPaginationMixin:
+    """
+    Replace the offset pagination of ListView with keyset pagination.
+
+    When cache_name is set, pages are kept in the per-user report cache.
+    """
+    paginate_by = 25
+    cursor_kwarg = "cursor"
+    cache_name = None
+
+    def get_cache_name(self):
+        return self.cache_name
+
+    def get_archived_queryset(self):
+        """
+        The archived transactions to paginate with the queryset, None to
+        leave the archive out
+        """
+        return None
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.get_archived_queryset())
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        cache_name = self.get_cache_name()
+        if cache_name is None:
+            page = paginator.page(cursor)
+        else:
+            page = get_or_compute(
+                self.request.user,
+                f"{cache_name}:{page_size}:{cursor or ''}",
+                lambda: paginator.page(cursor),
+            )
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """
+        Async version of paginate_queryset
+        """
+        paginator = KeysetPaginator(queryset, page_size, self.get_archived_queryset())
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        cache_name = self.get_cache_name()
+        if cache_name is None:
+            page = await paginator.apage(cursor)
+        else:
+            page = await aget_or_compute(
+                self.request.user,
+                f"{cache_name}:{page_size}:{cursor or ''}",
+                lambda: paginator.apage(cursor),
+            )
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    async def aget_context_data(self, **kwargs):
+        """
+        Async version of get_context_data for the listings
+        """
+        paginator, page, object_list, is_paginated = await self.apaginate_queryset(
+            self.object_list, self.get_paginate_by(self.object_list))
+        context = {
+            "paginator": paginator,
+            "page_obj": page,
+            "is_paginated": is_paginated,
+            "object_list": object_list,
+            self.get_context_object_name(object_list): object_list,
+        }
+        context.update(kwargs)
+        # Skip the synchronous pagination of MultipleObjectMixin
+        return ContextMixin.get_context_data(self, **context)
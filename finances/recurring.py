@@ -0,0 +1,119 @@
+"""
+Materialization of the recurring transaction rules
+"""
+import calendar
+import datetime
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import F
+from .aggregates import balance_effect, shift_summaries, transaction_deltas
+from .caching import forget_user, invalidate_on_commit
+from .models import RecurringTransaction, Transaction
+
+DEFAULT_BATCH_SIZE = 2000
+
+
+def add_months(date, months):
+    """
+    Move the date by whole months, clamping the day to the last day of
+    the target month
+    """
+    year, month = divmod(date.month - 1 + months, 12)
+    year += date.year
+    day = min(date.day, calendar.monthrange(year, month + 1)[1])
+    return datetime.date(year, month + 1, day)
+
+
+def following_due(rule, due):
+    """
+    Return the occurrence of the rule after the due date
+    """
+    if rule.frequency == "D":
+        return due + datetime.timedelta(days=1)
+    if rule.frequency == "W":
+        return due + datetime.timedelta(weeks=1)
+    # Count from the start date, so a rule started on the 31st comes back
+    # to the 31st after a shorter month
+    start = rule.start_date
+    months = (due.year - start.year) * 12 + due.month - start.month
+    if rule.frequency == "M":
+        return add_months(start, months + 1)
+    return add_months(start, (months // 12 + 1) * 12)
+
+
+def occurrences(rule, until):
+    """
+    Yield the unsaved transactions of the rule due up to the date,
+    catching up on missed periods, and advance next_due past it
+    """
+    while rule.next_due <= until:
+        yield Transaction(
+            title=rule.title,
+            description=rule.description,
+            transaction_type=rule.transaction_type,
+            amount=rule.amount,
+            date_created=rule.next_due,
+            category_id=rule.category_id,
+            user_id=rule.user_id,
+        )
+        rule.next_due = following_due(rule, rule.next_due)
+
+
+def due_rules(until, batch_size):
+    """
+    The next batch of due rules, read with the next_due index. Rules
+    locked by a concurrent run are skipped where the database supports
+    it, SQLite runs one writer at a time.
+    """
+    queryset = RecurringTransaction.objects.filter(next_due__lte=until)
+    if connection.features.has_select_for_update_skip_locked:
+        queryset = queryset.select_for_update(skip_locked=True)
+    return list(queryset.order_by("next_due", "id")[:batch_size])
+
+
+@transaction.atomic
+def materialize_batch(until, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Create the due transactions of a batch of rules and advance them in
+    the same database transaction, so a run that stops halfway can be
+    started again without creating any transaction twice.
+
+    Return the number of rules and of transactions processed.
+    """
+    rules = due_rules(until, batch_size)
+    if not rules:
+        return 0, 0
+    transactions = [item for rule in rules for item in occurrences(rule, until)]
+    deltas = transaction_deltas(transactions)
+    # Lock the users before the ids of their transactions are taken, see
+    # save_transaction, in order so that batches never wait on each other
+    for user_id, effect in sorted(balance_effect(deltas).items()):
+        invalidate_on_commit(user_id, total_amount=F("total_amount") + effect)
+        forget_user(user_id)
+    Transaction.objects.bulk_create(transactions, batch_size=batch_size)
+    # The rules of a batch move to a handful of dates, an UPDATE per date
+    # is much cheaper than the CASE of bulk_update
+    advanced = defaultdict(list)
+    for rule in rules:
+        advanced[rule.next_due].append(rule.pk)
+    for next_due, ids in advanced.items():
+        RecurringTransaction.objects.filter(pk__in=ids).update(next_due=next_due)
+
+    shift_summaries(deltas)
+    return len(rules), len(transactions)
+
+
+def run_recurring(until=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Materialize every rule due up to the date, today by default. Every
+    processed rule moves past the date, so the loop ends once no rule is
+    due. Return the number of rules and of transactions processed.
+    """
+    until = until or datetime.date.today()
+    rules = created = 0
+    while True:
+        batch_rules, batch_created = materialize_batch(until, batch_size)
+        if not batch_rules:
+            return rules, created
+        rules += batch_rules
+        created += batch_created
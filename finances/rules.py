@@ -0,0 +1,528 @@
+"""
+Automatic categorization of transactions by the rules of their user.
+
+The rules of a user are compiled once into a matcher that searches a
+title in a single pass whatever the number of rules. The keywords form
+a trie, written as one regular expression whose branches share their
+common prefixes, and the expressions are joined into one alternation
+with a named group each. The rules are cached under the data version of
+the user and the compiled matcher is kept per process for the same rules.
+"""
+import math
+import re
+from collections import namedtuple
+from functools import lru_cache
+from django.db import transaction
+from .aggregates import shift_summaries, transaction_deltas
+from .caching import get_or_compute, invalidate_on_commit
+from .models import ArchivedTransaction, CategoryRule, Transaction
+
+Rule = namedtuple(
+    "Rule",
+    ("id", "kind", "pattern", "amount_min", "amount_max", "transaction_type", "category_id"),
+)
+COMPILED_MATCHERS = 256
+RECATEGORIZE_BATCH_SIZE = 2000
+RECATEGORIZE_FIELDS = ("id", "title", "amount", "transaction_type", "date_created",
+                       "category_id", "user_id")
+# Group references would point to other groups once the patterns are joined
+GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?P[<=]")
+WORD = re.compile(r"\w")
+MAX_EXPRESSION_LENGTH = 100
+# The parts of an expression the backtracking check tells apart
+ESCAPE = re.compile(
+    r"\\(?:x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|N\{[^}]*\}|0[0-7]{0,2}|.)",
+    re.DOTALL)
+CHARACTER_CLASS = re.compile(r"\[\^?\]?(?:\\.|[^\]\\])*\]", re.DOTALL)
+QUANTIFIER = re.compile(r"[*+?]|\{(?=[\d,])(\d*)(,(\d*))?\}")
+INLINE_FLAGS = re.compile(r"\?([aiLmsux]*)(?:-[imsx]+)?([:)])")
+ANCHORS = "bBAZ"
+# Characters compared to tell whether two character classes overlap
+SAMPLE_CHARS = "".join(map(chr, range(32, 127))) + "\t\nßàçéñü€"
+
+
+def rule_expression(kind, pattern):
+    """
+    The regular expression of a keyword or expression rule. Keywords
+    match whole words at their ends that are word characters.
+    """
+    if kind == "R":
+        return pattern
+    expression = re.escape(pattern)
+    if WORD.match(pattern):
+        expression = r"\b" + expression
+    if WORD.match(pattern[-1:]):
+        expression += r"\b"
+    return expression
+
+
+def check_expression(pattern):
+    """
+    Raise re.error when the expression can not be joined with the other
+    patterns of the user, or when it could backtrack for long on a title
+    """
+    if len(pattern) > MAX_EXPRESSION_LENGTH:
+        raise re.error(f"expressions are limited to {MAX_EXPRESSION_LENGTH} characters")
+    if GROUP_REFERENCE.search(pattern):
+        raise re.error("group names and references are not supported")
+    re.compile(f"(?P<p0>{pattern})", re.IGNORECASE)
+    check_backtracking([parse_expression(pattern)])
+
+
+def sample_chars(expression):
+    """
+    The sample characters matched by an expression that matches a single
+    character
+    """
+    regex = re.compile(expression, re.IGNORECASE)
+    return frozenset(char for char in SAMPLE_CHARS if regex.fullmatch(char))
+
+
+def parse_expression(pattern):
+    """
+    Parse an expression that compiles into a tree of tuples: ("char",
+    sample characters), ("anchor",), ("repeat", low, high, item), and
+    ("group", alternatives) or ("look", alternatives) where each
+    alternative is a list of items
+    """
+    return ("group", parse_alternatives(pattern, 0)[0])
+
+
+def parse_alternatives(pattern, pos):
+    """
+    Parse the alternatives from pos to the end of their group. Returns
+    them and the position of the closing parenthesis.
+    """
+    alternatives = [[]]
+    while pos < len(pattern) and pattern[pos] != ")":
+        char = pattern[pos]
+        if char == "|":
+            alternatives.append([])
+            pos += 1
+            continue
+        if char == "(":
+            item, pos = parse_group(pattern, pos + 1)
+            if item is None:
+                continue
+        elif char == "[":
+            end = CHARACTER_CLASS.match(pattern, pos).end()
+            item, pos = ("char", sample_chars(pattern[pos:end])), end
+        elif char == "\\":
+            end = ESCAPE.match(pattern, pos).end()
+            if pattern[pos + 1] in ANCHORS:
+                item = ("anchor",)
+            else:
+                item = ("char", sample_chars(pattern[pos:end]))
+            pos = end
+        elif char in "^$":
+            item, pos = ("anchor",), pos + 1
+        else:
+            item = ("char", sample_chars("." if char == "." else re.escape(char)))
+            pos += 1
+        quantifier = QUANTIFIER.match(pattern, pos)
+        if quantifier:
+            symbol = quantifier[0]
+            if symbol in "*+?":
+                low, high = int(symbol == "+"), 1 if symbol == "?" else math.inf
+            else:
+                low = int(quantifier[1] or 0)
+                high = (int(quantifier[3]) if quantifier[3] else math.inf) if quantifier[2] else low
+            item = ("repeat", low, high, item)
+            pos = quantifier.end()
+            # Lazy and possessive quantifiers
+            if pos < len(pattern) and pattern[pos] in "?+":
+                pos += 1
+        alternatives[-1].append(item)
+    return alternatives, pos
+
+
+def parse_group(pattern, pos):
+    """
+    Parse the group starting at pos, after its opening parenthesis.
+    Returns None for the comments and the flags that match nothing.
+    """
+    kind = "group"
+    if pattern.startswith("?#", pos):
+        return None, pattern.index(")", pos) + 1
+    flags = INLINE_FLAGS.match(pattern, pos)
+    if flags:
+        # The check would take the ignored spaces for characters
+        if "x" in flags[1]:
+            raise re.error("verbose expressions are not supported")
+        if flags[2] == ")":
+            return None, flags.end()
+        pos = flags.end()
+    elif pattern.startswith(("?=", "?!", "?<=", "?<!"), pos):
+        kind = "look"
+        pos += 3 if pattern[pos + 1] == "<" else 2
+    elif pattern.startswith("?>", pos):
+        pos += 2
+    elif pattern.startswith("?(", pos):
+        pos = pattern.index(")", pos) + 1
+    elif pattern.startswith("?", pos):
+        pos = pattern.index(">", pos) + 1
+    alternatives, pos = parse_alternatives(pattern, pos)
+    return (kind, alternatives), pos + 1
+
+
+def first_chars(items):
+    """
+    The sample characters that can start a match of the parsed items,
+    None when unknown
+    """
+    if not items:
+        return None
+    item = items[0]
+    if item[0] == "char":
+        return item[1]
+    if item[0] == "group":
+        chars = frozenset()
+        for alternative in item[1]:
+            first = first_chars(alternative)
+            if first is None:
+                return None
+            chars |= first
+        return chars
+    if item[0] == "repeat" and item[1] > 0:
+        return first_chars([item[3]])
+    return None
+
+
+def check_backtracking(items, repeated=False):
+    """
+    Raise re.error for the parts of a parsed expression that make the
+    search backtrack exponentially: a repeat of variable length inside
+    another repeat, alternatives of a repeat that can start with the same
+    character, and repeats of overlapping characters with only optional
+    items between them. repeated is set inside a repeat.
+    """
+    # Characters of the variable repeats the next repeat follows directly
+    pending = []
+    for item in items:
+        if item[0] == "repeat":
+            _, low, high, body = item
+            variable = low != high
+            if repeated and variable:
+                raise re.error("nested quantifiers are not supported")
+            chars = body[1] if body[0] == "char" else None
+            if variable and chars is not None:
+                if any(chars & other for other in pending):
+                    raise re.error("quantifiers of overlapping characters are not supported")
+                pending = pending + [chars] if low == 0 else [chars]
+            elif low > 0:
+                pending = []
+            check_backtracking([body], repeated or high > 1)
+            continue
+        if item[0] in ("group", "look"):
+            alternatives = item[1]
+            if repeated and len(alternatives) > 1:
+                seen = set()
+                for alternative in alternatives:
+                    chars = first_chars(alternative)
+                    if chars is None or chars & seen:
+                        raise re.error("repeated alternatives must start differently")
+                    seen |= chars
+            for alternative in alternatives:
+                check_backtracking(alternative, repeated)
+        # Anchors and lookarounds match no character
+        if item[0] in ("group", "char"):
+            pending = []
+
+
+def trie_expression(words):
+    """
+    One regular expression matching the longest of the words at a place.
+    Words are tried character by character, so a search costs about the
+    same with ten words or ten thousand.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        # The end of a word, followed by a boundary when it is a word
+        # character
+        node[None] = r"\b" if WORD.match(word[-1]) else ""
+
+    def branch(node):
+        alternatives = [
+            re.escape(char) + branch(child)
+            for char, child in sorted(node.items(), key=lambda item: item[0] or "")
+            if char is not None
+        ]
+        # Longer words first, the end of a shorter one is the fallback
+        if None in node:
+            alternatives.append(node[None])
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    starts = []
+    for char, child in sorted(trie.items()):
+        start = r"\b" if WORD.match(char) else ""
+        starts.append(start + re.escape(char) + branch(child))
+    return "|".join(starts)
+
+
+class RuleMatcher:
+    """
+    The compiled rules of a user
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        # Rules of each keyword and of each distinct expression, as
+        # (position, rule) in priority order
+        self.keywords = {}
+        groups = {}
+        self.amount_rules = []
+        for position, rule in enumerate(rules):
+            if rule.kind == "A":
+                # Bounds in cents, integers compare much faster than decimals
+                self.amount_rules.append((
+                    position,
+                    -math.inf if rule.amount_min is None else math.ceil(rule.amount_min * 100),
+                    math.inf if rule.amount_max is None else math.floor(rule.amount_max * 100),
+                    rule.transaction_type,
+                ))
+            elif rule.kind == "K":
+                self.keywords.setdefault(rule.pattern.lower(), []).append((position, rule))
+            else:
+                groups.setdefault(rule.pattern, []).append((position, rule))
+
+        self.keyword_regex = None
+        if self.keywords:
+            self.keyword_regex = re.compile(trie_expression(self.keywords))
+            self.lengths = sorted({len(keyword) for keyword in self.keywords})
+        self.names = {
+            f"p{number}": candidates
+            for number, candidates in enumerate(groups.values())
+        }
+        self.expressions = [
+            (re.compile(pattern, re.IGNORECASE), candidates)
+            for pattern, candidates in groups.items()
+        ]
+        self.regex = None
+        if groups:
+            self.regex = re.compile(
+                "|".join(
+                    f"(?P<p{number}>{pattern})"
+                    for number, pattern in enumerate(groups)
+                ),
+                re.IGNORECASE,
+            )
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    @staticmethod
+    def accepts(rule, amount, transaction_type):
+        if rule.transaction_type and rule.transaction_type != transaction_type:
+            return False
+        if rule.amount_min is not None and (amount is None or amount < rule.amount_min):
+            return False
+        if rule.amount_max is not None and (amount is None or amount > rule.amount_max):
+            return False
+        return True
+
+    def first_accepted(self, candidates, amount, transaction_type):
+        """
+        Return the position of the first accepted rule of the candidates,
+        and whether any rule before it was rejected
+        """
+        for number, (position, rule) in enumerate(candidates):
+            if self.accepts(rule, amount, transaction_type):
+                return position, number > 0
+        return None, True
+
+    def keyword_position(self, title, amount, transaction_type):
+        """
+        The position of the best keyword rule matching the title
+        """
+        best = None
+        text = title.lower()
+        start = 0
+        while (found := self.keyword_regex.search(text, start)) is not None:
+            # The trie matched the longest keyword at this place, the
+            # shorter ones matching here are its prefixes
+            start = found.start()
+            for length in self.lengths:
+                end = start + length
+                if end > found.end():
+                    break
+                candidates = self.keywords.get(text[start:end])
+                if candidates is None:
+                    continue
+                if WORD.match(text, end - 1) and WORD.match(text, end):
+                    continue
+                position, _ = self.first_accepted(candidates, amount, transaction_type)
+                if position is not None and (best is None or position < best):
+                    best = position
+            start += 1
+        return best
+
+    def expression_position(self, title, amount, transaction_type, best):
+        """
+        The position of the best expression rule matching the title, if
+        it is better than best
+        """
+        # Every start of a match gives the first expression at that place,
+        # the best of all of them is the winner
+        rejected = False
+        start = 0
+        while (found := self.regex.search(title, start)) is not None:
+            position, skipped = self.first_accepted(
+                self.names[found.lastgroup], amount, transaction_type)
+            rejected = rejected or skipped
+            if position is not None and (best is None or position < best):
+                best = position
+            start = found.start() + 1
+        if rejected:
+            # A rejected rule may hide other expressions matching at the
+            # same place, try the ones that could still win alone
+            for regex, candidates in self.expressions:
+                if best is not None and candidates[0][0] >= best:
+                    break
+                if regex.search(title):
+                    position, _ = self.first_accepted(candidates, amount, transaction_type)
+                    if position is not None and (best is None or position < best):
+                        best = position
+        return best
+
+    def match_position(self, title, amount, transaction_type):
+        """
+        Return the position of the rule that categorizes the transaction,
+        None when no rule does
+        """
+        best = None
+        if title and self.keyword_regex is not None:
+            best = self.keyword_position(title, amount, transaction_type)
+        if title and self.regex is not None:
+            best = self.expression_position(title, amount, transaction_type, best)
+        if not self.amount_rules or amount is None:
+            return best
+        low, high = math.floor(amount * 100), math.ceil(amount * 100)
+        for position, amount_min, amount_max, rule_type in self.amount_rules:
+            if best is not None and position > best:
+                break
+            if (low >= amount_min and high <= amount_max
+                    and (not rule_type or rule_type == transaction_type)):
+                return position
+        return best
+
+    def match(self, title, amount=None, transaction_type=""):
+        """
+        Return the category id of the first rule matching the transaction,
+        None when no rule does
+        """
+        position = self.match_position(title, amount, transaction_type)
+        if position is None:
+            return None
+        return self.rules[position].category_id
+
+    def categorize(self, item):
+        """
+        Return the category id for a transaction, None when no rule matches
+        """
+        return self.match(item.title, item.amount, item.transaction_type)
+
+
+@lru_cache(maxsize=COMPILED_MATCHERS)
+def compile_rules(rules):
+    """
+    Compile a tuple of rules, the same rules share their matcher
+    """
+    return RuleMatcher(rules)
+
+
+def load_rules(user):
+    """
+    Return the rules of the user as a tuple in priority order, cached
+    until the data of the user changes. user is the user of the request
+    or a user id, see get_or_compute.
+    """
+    def compute():
+        return tuple(
+            Rule(*row) for row in
+            CategoryRule.objects.filter(user_id=getattr(user, "pk", user))
+            .order_by("priority", "id")
+            .values_list(*Rule._fields)
+        )
+    return get_or_compute(user, "rules", compute)
+
+
+def get_matcher(user):
+    """
+    Return the compiled matcher of the rules of the user
+    """
+    return compile_rules(load_rules(user))
+
+
+def recategorize_batch(queryset, last_id, batch_size, matchers):
+    """
+    Apply the rules to the next batch of transactions of the queryset
+    with an id above last_id. Return the batch and the number of its
+    transactions that changed category.
+    """
+    with transaction.atomic():
+        items = list(
+            queryset.filter(id__gt=last_id)
+            .order_by("id")
+            .only(*RECATEGORIZE_FIELDS)[:batch_size]
+        )
+        changed = []
+        for item in items:
+            if item.user_id not in matchers:
+                matchers[item.user_id] = get_matcher(item.user_id)
+            category_id = matchers[item.user_id].categorize(item)
+            if category_id is not None and category_id != item.category_id:
+                item.new_category_id = category_id
+                changed.append(item)
+        if not changed:
+            return items, 0
+        # Moves between categories leave the balances as they are
+        deltas = transaction_deltas(changed, sign=-1)
+        for item in changed:
+            item.category_id = item.new_category_id
+        for key, (total, count) in transaction_deltas(changed).items():
+            deltas[key][0] += total
+            deltas[key][1] += count
+        shift_summaries(deltas)
+        queryset.model.objects.bulk_update(changed, ["category"])
+        for user_id in {item.user_id for item in changed}:
+            invalidate_on_commit(user_id, rewrite=True)
+    return items, len(changed)
+
+
+def recategorize(users=None, categories=None, batch_size=RECATEGORIZE_BATCH_SIZE,
+                 progress=None):
+    """
+    Move the transactions of the ledger and of the archive to the category
+    of the first rule of their user that matches them, batch by batch.
+    Transactions that no rule matches keep their category. With
+    categories, only the transactions in those categories are read.
+
+    progress is called with the numbers of transactions read and moved so
+    far after every batch. Return the number of transactions moved.
+    """
+    read = 0
+    moved = 0
+    matchers = {}
+    for model in (Transaction, ArchivedTransaction):
+        # Only the users with rules can have a transaction to move
+        queryset = model.objects.filter(
+            user__in=CategoryRule.objects.values("user_id"))
+        if users is not None:
+            queryset = queryset.filter(user__in=users)
+        if categories is not None:
+            queryset = queryset.filter(category__in=categories)
+        last_id = 0
+        while True:
+            items, count = recategorize_batch(queryset, last_id, batch_size, matchers)
+            if not items:
+                break
+            read += len(items)
+            moved += count
+            last_id = items[-1].id
+            if progress is not None:
+                progress(read, moved)
+    return moved
@@ -0,0 +1,141 @@
+"""
+Full-text search over the titles and descriptions of the transactions.
+
+SQLite keeps an external content FTS5 table in sync with triggers, so
+bulk inserts and deletes are indexed too. PostgreSQL uses a GIN index on
+the same search vector the queries compute. Other databases fall back to
+scanning with icontains.
+"""
+import re
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+TRANSACTION_TABLE = "finances_transaction"
+FTS_TABLE = "finances_transaction_fts"
+POSTGRES_INDEX = "transaction_search"
+MIGRATION = ("finances", "0005_transaction_search")
+
+FTS_TRIGGERS = {
+    f"{FTS_TABLE}_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+        AFTER INSERT ON {TRANSACTION_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, title, description)
+            VALUES (new.id, new.title, new.description);
+        END
+    """,
+    f"{FTS_TABLE}_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+        AFTER DELETE ON {TRANSACTION_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, title, description)
+            VALUES ('delete', old.id, old.title, old.description);
+        END
+    """,
+    f"{FTS_TABLE}_update": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+        AFTER UPDATE OF title, description ON {TRANSACTION_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, title, description)
+            VALUES ('delete', old.id, old.title, old.description);
+            INSERT INTO {FTS_TABLE} (rowid, title, description)
+            VALUES (new.id, new.title, new.description);
+        END
+    """,
+}
+
+
+def search_vector():
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector("title", "description", config="simple")
+
+
+def install_search_index(connection):
+    """
+    Create the search index of the database if it is missing.
+
+    Safe to call repeatedly. On SQLite, rebuilding the transaction table
+    in a migration drops its triggers, so they are created again and the
+    index rebuilt from the table.
+    """
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+                [TRANSACTION_TABLE],
+            )
+            if FTS_TRIGGERS.keys() <= {row[0] for row in cursor.fetchall()}:
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, description, content='{TRANSACTION_TABLE}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            for sql in FTS_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == "postgresql":
+        from django.contrib.postgres.indexes import GinIndex
+        from .models import Transaction
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, TRANSACTION_TABLE)
+        if POSTGRES_INDEX not in constraints:
+            with connection.schema_editor() as editor:
+                editor.add_index(Transaction, GinIndex(search_vector(), name=POSTGRES_INDEX))
+
+
+def uninstall_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            for name in FTS_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif connection.vendor == "postgresql":
+            cursor.execute(f"DROP INDEX IF EXISTS {POSTGRES_INDEX}")
+
+
+def repair_search_index(sender, using, **kwargs):
+    """
+    post_migrate receiver that restores the index after later migrations
+    """
+    from django.db import connections
+    connection = connections[using]
+    if MIGRATION in MigrationRecorder(connection).applied_migrations():
+        install_search_index(connection)
+
+
+def search_terms(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def search_filter(text, connection, indexed=True):
+    """
+    Return a Q matching the transactions whose title or description
+    contain words starting with every word of the text. Tables without
+    the index are scanned, set indexed to False for them.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return Q()
+    if not indexed:
+        return scan_filter(terms)
+    if connection.vendor == "sqlite":
+        # Quoted terms can not be read as FTS5 operators
+        query = " ".join(f'"{term}"*' for term in terms)
+        return Q(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query]))
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchVectorExact
+        query = SearchQuery(
+            " & ".join(f"{term}:*" for term in terms), search_type="raw", config="simple")
+        return Q(SearchVectorExact(search_vector(), query))
+    return scan_filter(terms)
+
+
+def scan_filter(terms):
+    """
+    Match every term anywhere in the title or the description, reading
+    every row
+    """
+    condition = Q()
+    for term in terms:
+        condition &= Q(title__icontains=term) | Q(description__icontains=term)
+    return condition
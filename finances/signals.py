@@ -0,0 +1,34 @@
+"""
+Invalidate the cached reports and user row of a user when their data changes
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.db import transaction
+from .caching import forget_user, invalidate_on_commit
+from .models import Category, CategoryRule, CustomUser
+
+
+# Transactions invalidate explicitly with the UPDATE of the balance they
+# change, a receiver would update the user row a second time. A
+# post_delete receiver would also make Django load and signal every row
+# of a bulk delete instead of running a single DELETE
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_reports(sender, instance, signal, **kwargs):
+    # Deleting a category deletes its transactions
+    invalidate_on_commit(instance.user_id, rewrite=signal is post_delete)
+
+
+@receiver(post_save, sender=CategoryRule)
+@receiver(post_delete, sender=CategoryRule)
+def invalidate_rules(sender, instance, **kwargs):
+    # The cached rules of the user are read under the data version
+    invalidate_on_commit(instance.user_id)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def forget_cached_user(sender, instance, **kwargs):
+    # Again on commit, a concurrent request may have cached the old row
+    forget_user(instance.pk)
+    transaction.on_commit(lambda: forget_user(instance.pk))
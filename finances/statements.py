@@ -0,0 +1,161 @@
+"""
+Monthly statements of a user as CSV or PDF, built by the job queue
+"""
+import csv
+import datetime
+import io
+from collections import defaultdict
+from decimal import Decimal
+from .archive import reaches_archive
+from .balances import balance_on, next_month
+from .models import ArchivedTransaction, Transaction
+
+STATEMENT_FIELDS = ("date_created", "title", "category__title", "transaction_type", "amount")
+# A4 in points, with the text in Courier so columns line up
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 40
+FONT_SIZE = 9
+LEADING = 11
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+
+class Statement:
+    """
+    Opening and closing balance, transactions and category totals of a
+    user for a month
+    """
+    def __init__(self, user, month, opening, rows):
+        self.user = user
+        self.month = month
+        self.opening = opening
+        self.rows = rows
+        self.incomes = sum((row[4] for row in rows if row[3] == "IN"), Decimal("0.00"))
+        self.expenses = sum((row[4] for row in rows if row[3] == "EX"), Decimal("0.00"))
+        self.closing = opening + self.incomes - self.expenses
+        categories = defaultdict(Decimal)
+        for _, _, category, transaction_type, amount in rows:
+            categories[category] += -amount if transaction_type == "EX" else amount
+        self.categories = sorted(categories.items())
+
+    @property
+    def title(self):
+        return f"Statement of {self.user.username} for {self.month:%B %Y}"
+
+
+def build_statement(user, month):
+    """
+    Read the statement of the month from the ledger, and from the archive
+    when the month is archived
+    """
+    month = month.replace(day=1)
+    last_day = next_month(month) - datetime.timedelta(days=1)
+    models = [Transaction]
+    if reaches_archive(user, month, last_day):
+        models.insert(0, ArchivedTransaction)
+    rows = []
+    for model in models:
+        rows += model.objects.filter(
+            user=user, date_created__gte=month, date_created__lte=last_day,
+        ).order_by("date_created", "id").values_list(*STATEMENT_FIELDS)
+    rows.sort(key=lambda row: row[0])
+    opening = balance_on(user, month - datetime.timedelta(days=1))
+    return Statement(user, month, opening, rows)
+
+
+def render_csv(statement):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(("date", "title", "category", "transaction_type", "amount"))
+    for date_created, title, category, transaction_type, amount in statement.rows:
+        writer.writerow((date_created.isoformat(), title, category, transaction_type, amount))
+    writer.writerow(())
+    writer.writerow(("opening balance", statement.opening))
+    writer.writerow(("incomes", statement.incomes))
+    writer.writerow(("expenses", statement.expenses))
+    writer.writerow(("closing balance", statement.closing))
+    return output.getvalue().encode()
+
+
+def statement_lines(statement):
+    """
+    The statement as fixed width lines of text
+    """
+    lines = [statement.title, "", f"{'Opening balance':<70}{statement.opening:>15}", ""]
+    for date_created, title, category, transaction_type, amount in statement.rows:
+        signed = -amount if transaction_type == "EX" else amount
+        lines.append(
+            f"{date_created.isoformat():<12}{title[:38]:<40}{category[:18]:<20}{signed:>13}")
+    lines += ["", "By category"]
+    for category, total in statement.categories:
+        lines.append(f"  {category[:66]:<68}{total:>15}")
+    lines += [
+        "",
+        f"{'Incomes':<70}{statement.incomes:>15}",
+        f"{'Expenses':<70}{statement.expenses:>15}",
+        f"{'Closing balance':<70}{statement.closing:>15}",
+    ]
+    return lines
+
+
+def pdf_text(line):
+    line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return line.encode("latin-1", "replace")
+
+
+def render_pdf(statement):
+    """
+    Write the statement lines as a plain text PDF, one Courier page per
+    LINES_PER_PAGE lines. No PDF library is needed for text only pages.
+    """
+    lines = statement_lines(statement)
+    pages = [
+        lines[start:start + LINES_PER_PAGE]
+        for start in range(0, len(lines), LINES_PER_PAGE)
+    ]
+    # 1 catalog, 2 page tree, 3 font, then a page and its content per page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(
+            b"%d 0 R" % (4 + 2 * number) for number in range(len(pages))
+        ) + b"] /Count %d >>" % len(pages),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>",
+    ]
+    for number, page in enumerate(pages):
+        stream = b"BT /F1 %d Tf %d TL %d %d Td\n" % (
+            FONT_SIZE, LEADING, MARGIN, PAGE_HEIGHT - MARGIN)
+        stream += b"".join(b"(" + pdf_text(line) + b") Tj T*\n" for line in page) + b"ET"
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (PAGE_WIDTH, PAGE_HEIGHT, 5 + 2 * number))
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    output.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref))
+    return output.getvalue()
+
+
+STATEMENT_FORMATS = {
+    "csv": (render_csv, "text/csv"),
+    "pdf": (render_pdf, "application/pdf"),
+}
+
+
+def run_statement_job(job):
+    """
+    Job handler of the statements, the payload has the month and the
+    format
+    """
+    month = datetime.date.fromisoformat(job.payload["month"])
+    render, content_type = STATEMENT_FORMATS[job.payload["format"]]
+    statement = build_statement(job.user, month)
+    return f"statement-{month:%Y-%m}.{job.payload['format']}", content_type, render(statement)
@@ -0,0 +1,83 @@
+"""
+Fast rendering of the transaction cards of the listings
+"""
+import hashlib
+from django import template
+from django.conf import settings
+from django.template import Context
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+from finances import caching
+from finances.models import ArchivedTransaction
+
+register = template.Library()
+
+CARD_TEMPLATE = "layouts/transaction_card.html"
+# The fields of a transaction rendered by its card
+CARD_FIELDS = ("title", "description", "date_created", "transaction_type", "amount",
+               "currency", "original_amount")
+
+
+def delete_url_prefix():
+    # Reverse once per render instead of once per card, the id is the
+    # last part of the path
+    return reverse("delete_transaction", args=[0])[:-1]
+
+
+def render_cards(transactions):
+    """
+    Render the card of every transaction with one template context.
+    Archived transactions have no delete page, only the bulk actions
+    reach them.
+    """
+    card = get_template(CARD_TEMPLATE).template
+    prefix = delete_url_prefix()
+    context = Context(autoescape=True)
+    rendered = {}
+    for transaction in transactions:
+        delete_url = None if is_archived(transaction) else f"{prefix}{transaction.id}"
+        with context.push(transaction=transaction, delete_url=delete_url):
+            rendered[transaction.id] = card.render(context)
+    return rendered
+
+
+def is_archived(transaction):
+    return isinstance(transaction, ArchivedTransaction)
+
+
+def card_key(transaction):
+    """
+    The cache key of the card of a transaction, which changes with the
+    fields the card renders
+    """
+    fields = [getattr(transaction, field) for field in CARD_FIELDS]
+    fields += [transaction.category.title, is_archived(transaction)]
+    digest = hashlib.blake2b(repr(fields).encode(), digest_size=16).hexdigest()
+    return f"{caching.KEY_PREFIX}:card:{transaction.id}:{digest}"
+
+
+@register.simple_tag
+def transaction_cards(transactions):
+    """
+    Render the cards of the transactions, reusing the cards cached for
+    their current fields with a single cache read
+    """
+    transactions = list(transactions)
+    if not settings.REPORT_CACHE_ENABLED or not transactions:
+        cards = render_cards(transactions)
+        return mark_safe("".join(cards[transaction.id] for transaction in transactions))
+
+    cache = caching.get_cache()
+    keys = {transaction.id: card_key(transaction) for transaction in transactions}
+    cards = {
+        int(key.split(":")[2]): card
+        for key, card in cache.get_many(keys.values()).items()
+    }
+    missing = [transaction for transaction in transactions if transaction.id not in cards]
+    if missing:
+        fresh = render_cards(missing)
+        cache.set_many(
+            {keys[pk]: card for pk, card in fresh.items()}, settings.CARD_CACHE_TIMEOUT)
+        cards.update(fresh)
+    return mark_safe("".join(cards[transaction.id] for transaction in transactions))
@@ -1,3 +1,2171 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.http import Http404
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import engines
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import resolve, reverse
+from . import views
+from .benchmarks import views as benchmark_views
+from .benchmarks.data import create_user, create_users, populate, replicate
+from .benchmarks.driver import run_flow
+from .benchmarks.results import compare
+from . import aggregates, analytics, balances, caching, middleware, recurring, search
+from .aggregates import check_summaries, rebuild_summaries, report_totals
+from .api import encode_sync_cursor
+from .archive import archive_transactions
+from .budgets import budget_statuses
+from .bulk import delete_category, delete_transactions, move_transactions
+from .checks import check_cached_user_backend
+from .currencies import MissingExchangeRate, change_base_currency, convert_transactions, load_rates, rate_on
+from .importers import import_transactions
+from .jobs import claim_job, enqueue, requeue_stale, run_job, work
+from .models import (
+    ArchivedTransaction, BalanceCheckpoint, Budget, Category, CategoryRule, CustomUser,
+    ExchangeRate, Job, MonthlySummary, RecurringTransaction, Transaction)
+from .pagination import KeysetPaginator
+from .recurring import add_months
+from .rules import check_expression, get_matcher, load_rules
+from .statements import build_statement, render_pdf
+from .templatetags import transactions as transaction_cards
+from .urls import urlpatterns
 
-# Create your tests here.
+
+def seed_transactions(user, category, size, transaction_type="EX"):
+    """
+    Insert a batch of transactions for the user in bulk
+    """
+    Transaction.objects.bulk_create(
+        (
+            Transaction(
+                title=f"Transaction {number}",
+                description="Seeded transaction",
+                transaction_type=transaction_type,
+                amount=Decimal("10.00"),
+                category=category,
+                user=user,
+            )
+            for number in range(size)
+        ),
+        batch_size=5000,
+    )
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Cursor pagination of the transaction listings
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("paginated", password="secret")
+        cls.category = Category.objects.create(title="Food", user=cls.user)
+        seed_transactions(cls.user, cls.category, 60)
+
+    def test_pages_walk_the_whole_history_without_gaps(self):
+        paginator = KeysetPaginator(
+            Transaction.objects.filter(user=self.user), per_page=25)
+        seen = []
+        page = paginator.page()
+        self.assertFalse(page.has_previous())
+        while True:
+            seen.extend(transaction.id for transaction in page)
+            if not page.has_next():
+                break
+            page = paginator.page(page.next_cursor)
+        self.assertEqual(len(seen), 60)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_previous_cursor_returns_the_same_page(self):
+        paginator = KeysetPaginator(
+            Transaction.objects.filter(user=self.user), per_page=25)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        back = paginator.page(second.previous_cursor)
+        self.assertEqual(
+            [transaction.id for transaction in back],
+            [transaction.id for transaction in first],
+        )
+        self.assertFalse(back.has_previous())
+
+    def test_invalid_cursor_is_not_found(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("report"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ListingQueryCountTests(TestCase):
+    """
+    The listing pages cost a fixed number of queries
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("heavy", password="secret")
+        cls.category = Category.objects.create(title="Rent", user=cls.user)
+        seed_transactions(cls.user, cls.category, 25000, "EX")
+        seed_transactions(cls.user, cls.category, 25000, "IN")
+
+    def setUp(self):
+        caches["default"].clear()
+        self.client.force_login(self.user)
+
+    def test_listings_have_a_constant_query_count(self):
+        # session, user, the page itself and the filter categories, plus
+        # the totals of the report on the first load
+        budgets = {"report": 5, "expenses": 4, "incomes": 4}
+        for name, budget in budgets.items():
+            caches["default"].clear()
+            with self.subTest(view=name):
+                with self.assertNumQueries(budget):
+                    response = self.client.get(reverse(name))
+                page = response.context["page_obj"]
+                self.assertEqual(len(page), 25)
+                # The session now comes from the cache, the user and the
+                # page do not
+                with self.assertNumQueries(2):
+                    self.client.get(reverse(name), {"cursor": page.next_cursor})
+
+
+class MonthlySummaryTests(TestCase):
+    """
+    The monthly summaries follow the ledger
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("summary", password="secret")
+        cls.category = Category.objects.create(title="Salary", user=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_transaction(self, amount, transaction_type):
+        self.client.post(reverse("create_transaction"), {
+            "title": "Movement",
+            "description": "",
+            "transaction_type": transaction_type,
+            "amount": amount,
+            "category": self.category.id,
+        })
+
+    def test_views_keep_the_summaries_in_sync(self):
+        self.create_transaction("100.00", "IN")
+        self.create_transaction("40.50", "IN")
+        self.create_transaction("30.00", "EX")
+        income = MonthlySummary.objects.get(user=self.user, transaction_type="IN")
+        self.assertEqual((income.total, income.count), (Decimal("140.50"), 2))
+
+        expense = Transaction.objects.get(user=self.user, transaction_type="EX")
+        self.client.post(reverse("delete_transaction", args=[expense.id]))
+        self.assertEqual(
+            MonthlySummary.objects.get(user=self.user, transaction_type="EX").count, 0)
+        self.assertEqual(check_summaries(), [])
+
+    def test_rebuild_fixes_drift(self):
+        seed_transactions(self.user, self.category, 30)
+        self.assertEqual(len(check_summaries()), 1)
+        self.assertEqual(rebuild_summaries(), 1)
+        self.assertEqual(check_summaries(), [])
+        call_command("check_aggregates", stdout=StringIO())
+
+
+class ConcurrentBalanceTests(TransactionTestCase):
+    """
+    Concurrent requests of the same user never lose balance updates
+    """
+    def setUp(self):
+        self.user = CustomUser.objects.create_user("mobile", password="secret")
+        self.category = Category.objects.create(title="Batch", user=self.user)
+        self.factory = RequestFactory()
+
+    def send(self, view, request):
+        """
+        Run the view in the current thread with its own copy of the user
+        """
+        try:
+            while True:
+                try:
+                    request.user = CustomUser.objects.get(pk=self.user.pk)
+                    return view(request, **request.resolver_match.kwargs)
+                except Http404:
+                    # Another thread deleted the transaction first
+                    return None
+                except OperationalError:
+                    # SQLite rejects concurrent writers instead of waiting,
+                    # retry like the mobile client does
+                    time.sleep(0.001)
+        finally:
+            connection.close()
+
+    def create(self, number):
+        request = self.factory.post(reverse("create_transaction"), {
+            "title": f"Upload {number}",
+            "description": "",
+            "transaction_type": "IN" if number % 3 else "EX",
+            "amount": f"{number}.25",
+            "category": self.category.id,
+        })
+        request.resolver_match = resolve(request.path)
+        return self.send(views.CreateTransactionView.as_view(), request)
+
+    def delete(self, pk):
+        request = self.factory.post(reverse("delete_transaction", args=[pk]))
+        request.resolver_match = resolve(request.path)
+        return self.send(views.DeleteTransactionView.as_view(), request)
+
+    def test_balance_matches_the_ledger(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(self.create, range(200)))
+            victims = list(Transaction.objects.filter(
+                user=self.user).values_list("id", flat=True)[:100])
+            # Delete every victim twice to race the deletions as well
+            list(pool.map(self.delete, victims * 2))
+
+        ledger = Transaction.objects.filter(user=self.user)
+        self.assertEqual(ledger.count(), 100)
+        incomes = ledger.filter(transaction_type="IN").aggregate(total=Sum("amount"))["total"]
+        expenses = ledger.filter(transaction_type="EX").aggregate(total=Sum("amount"))["total"]
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, incomes - expenses)
+        self.assertEqual(check_summaries(), [])
+
+
+class ImportTransactionsTests(TestCase):
+    """
+    Bulk import of bank statements
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("importer", password="secret")
+        cls.category = Category.objects.create(title="Food", user=cls.user)
+
+    def test_csv_upload(self):
+        content = (
+            "title,description,transaction_type,amount,category,date\n"
+            "Salary,,Income,1000.00,Work,2024-01-31\n"
+            "Lunch,Tacos,EX,12.50,food,2024-02-01\n"
+            "Refund,,,-20.00,Food,\n"
+            "Broken,,EX,abc,Food,\n"
+        )
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("import_transactions"), {
+            "file": SimpleUploadedFile("statement.csv", content.encode()),
+            "file_format": "csv",
+        })
+        result = response.context["result"]
+        self.assertEqual((result.created, result.failed), (3, 1))
+        self.assertEqual(result.errors[0][0], 5)
+
+        lunch = Transaction.objects.get(title="Lunch")
+        self.assertEqual(lunch.category, self.category)
+        self.assertEqual(lunch.date_created.isoformat(), "2024-02-01")
+        self.assertTrue(Category.objects.filter(user=self.user, title="Work").exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, Decimal("967.50"))
+        self.assertEqual(check_summaries(), [])
+
+    def test_upload_in_another_encoding(self):
+        content = (
+            "title,description,transaction_type,amount,category,date\n"
+            "Caf\xe9,,EX,3.50,Food,2024-02-01\n"
+        )
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("import_transactions"), {
+            "file": SimpleUploadedFile("statement.csv", content.encode("latin-1")),
+            "file_format": "csv",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["error"], views.ERROR_MESSAGE_RESPONSE)
+        self.assertContains(response, "The file is not UTF-8 text.")
+        self.assertFalse(Transaction.objects.filter(user=self.user).exists())
+
+    def test_ofx_statement(self):
+        content = (
+            "OFXHEADER:100\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n"
+            "<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105120000<TRNAMT>-45.10\n"
+            "<FITID>1<NAME>Grocery store<MEMO>Weekly</STMTTRN>\n"
+            "<STMTTRN>\n<TRNTYPE>CREDIT\n<DTPOSTED>20240110\n<TRNAMT>300.00\n"
+            "<FITID>2\n<NAME>Transfer\n</STMTTRN>\n"
+            "</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n"
+        )
+        result = import_transactions(self.user, content.splitlines(True), "ofx")
+        self.assertEqual((result.created, result.failed), (2, 0))
+        grocery = Transaction.objects.get(title="Grocery store")
+        self.assertEqual(
+            (grocery.transaction_type, grocery.amount, grocery.description),
+            ("EX", Decimal("45.10"), "Weekly"),
+        )
+        self.assertEqual(grocery.category.title, "Imported")
+
+    def test_batches_cost_a_fixed_number_of_queries(self):
+        lines = ["title,description,transaction_type,amount,category,date\n"]
+        lines += [f"Row {number},,EX,1.00,Food,\n" for number in range(1000)]
+        with CaptureQueriesContext(connection) as queries:
+            result = import_transactions(self.user, lines, "csv", batch_size=500)
+        self.assertEqual(result.created, 1000)
+        self.assertLess(len(queries), 30)
+        balance_updates = [
+            query for query in queries
+            if query["sql"].startswith('UPDATE "finances_customuser"')
+        ]
+        self.assertEqual(len(balance_updates), 2)
+
+
+class ExportTransactionsTests(TestCase):
+    """
+    Streaming export of the ledger
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("exporter", password="secret")
+        cls.category = Category.objects.create(title="Rent", user=cls.user)
+        seed_transactions(cls.user, cls.category, 3)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_csv_can_be_imported_back(self):
+        response = self.client.get(reverse("export_transactions"))
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = [line.decode() for line in response.streaming_content]
+        self.assertEqual(len(lines), 4)
+        other = CustomUser.objects.create_user("copy", password="secret")
+        result = import_transactions(other, lines, "csv")
+        self.assertEqual((result.created, result.failed), (3, 0))
+
+    def test_ndjson(self):
+        response = self.client.get(reverse("export_transactions"), {"format": "ndjson"})
+        rows = [json.loads(line) for line in response.streaming_content]
+        self.assertEqual(rows[0]["category"], "Rent")
+        self.assertEqual(rows[0]["amount"], "10.00")
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse("export_transactions"), {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+
+class LargeExportMemoryTests(TestCase):
+    """
+    Memory stays flat while exporting a large ledger
+    """
+    ROWS = 500_000
+    PEAK_MEMORY_BOUND = 10 * 1024 * 1024
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("large-export")
+        populate(cls.user, 1000)
+        replicate(cls.user, cls.ROWS)
+
+    def test_peak_memory_is_bounded(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("export_transactions"))
+        tracemalloc.start()
+        try:
+            lines = sum(1 for _ in response.streaming_content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(lines, self.ROWS + 1)
+        self.assertLess(peak, self.PEAK_MEMORY_BOUND)
+
+
+class ReportCacheTests(TestCase):
+    """
+    Report pages and totals are cached until the user changes data
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("cached", password="secret")
+        cls.category = Category.objects.create(title="Rent", user=cls.user)
+        seed_transactions(cls.user, cls.category, 5)
+
+    def setUp(self):
+        caches["default"].clear()
+        caching.stats.reset()
+        self.client.force_login(self.user)
+
+    def test_repeated_loads_hit_the_cache(self):
+        self.client.get(reverse("report"))
+        # Only the user is read, the session is cached too
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("report"))
+        self.assertEqual(len(response.context["transactions"]), 5)
+        # page, totals and filter categories
+        self.assertEqual(caching.stats.as_dict()["hits"], 3)
+        self.assertEqual(caching.stats.as_dict()["misses"], 3)
+
+    def test_changes_invalidate_the_cache(self):
+        self.client.get(reverse("expenses"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("create_transaction"), {
+                "title": "New",
+                "description": "",
+                "transaction_type": "EX",
+                "amount": "5.00",
+                "category": self.category.id,
+            })
+        response = self.client.get(reverse("expenses"))
+        self.assertEqual(response.context["expenses"][0].title, "New")
+        self.assertEqual(caching.stats.invalidations, 1)
+
+    def test_changes_of_other_processes_invalidate_the_cache(self):
+        for name in ("expenses", "report", "async_report"):
+            self.client.get(reverse(name))
+        balance = Decimal(self.client.get(reverse("balance")).json()["balance"])
+        # Another process commits a transaction, this cache is never bumped
+        new = Transaction.objects.create(
+            title="New", transaction_type="EX", amount=Decimal("5.00"),
+            category=self.category, user=self.user)
+        self.user.apply_balance_change(new.signed_amount)
+        for name in ("expenses", "report", "async_report"):
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(response.context["object_list"][0].title, "New")
+        response = self.client.get(reverse("balance"))
+        self.assertEqual(Decimal(response.json()["balance"]), balance - 5)
+
+    @override_settings(REPORT_CACHE_ENABLED=False)
+    def test_cache_can_be_disabled(self):
+        self.client.get(reverse("report"))
+        # user, page, totals and filter categories
+        with self.assertNumQueries(4):
+            self.client.get(reverse("report"))
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Pin the number of queries of every view in finances/urls.py
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("budget", password="Secret-pass-123")
+        cls.category = Category.objects.create(title="Food", user=cls.user)
+        cls.other = Category.objects.create(title="Other", user=cls.user)
+        seed_transactions(cls.user, cls.category, 5)
+        seed_transactions(cls.user, cls.other, 5)
+        rebuild_summaries()
+        cls.transaction = Transaction.objects.filter(category=cls.category).first()
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def login(self):
+        self.client.force_login(self.user)
+
+    def test_anonymous_pages(self):
+        for name in ("home", "login", "register"):
+            with self.subTest(view=name), self.assertNumQueries(0):
+                self.client.get(reverse(name))
+
+    def test_simple_pages(self):
+        self.login()
+        # The session is cached by the login, the user is read by every page
+        for name, budget in (("home", 1), ("import_transactions", 1)):
+            with self.subTest(view=name), self.assertNumQueries(budget):
+                self.client.get(reverse(name))
+
+    def test_listings(self):
+        self.login()
+        # session, user, categories or page, the filter categories of the
+        # listings and the totals of the report
+        budgets = {
+            "create_transaction": 3,
+            "create_category": 3,
+            "expenses": 4,
+            "incomes": 4,
+            "report": 5,
+        }
+        for name, budget in budgets.items():
+            caches["default"].clear()
+            with self.subTest(view=name), self.assertNumQueries(budget):
+                self.client.get(reverse(name))
+
+    def test_export(self):
+        self.login()
+        with self.assertNumQueries(2):
+            b"".join(self.client.get(reverse("export_transactions")).streaming_content)
+
+    def test_analytics(self):
+        self.login()
+        with self.assertNumQueries(2):
+            self.client.get(reverse("analytics"), {"granularity": "day"})
+
+    def test_balance(self):
+        self.login()
+        balances.build_checkpoints(self.user)
+        # user, checkpoint and the transactions since
+        with self.assertNumQueries(3):
+            self.client.get(reverse("balance"))
+
+    def test_create_transaction(self):
+        self.login()
+        # user, category, savepoint, balance and data version, insert,
+        # summary, budget and release
+        with self.assertNumQueries(8):
+            self.client.post(reverse("create_transaction"), {
+                "title": "Lunch",
+                "description": "",
+                "transaction_type": "EX",
+                "amount": "12.00",
+                "category": self.category.id,
+            })
+
+    def test_create_category(self):
+        self.login()
+        # user, insert and data version
+        with self.assertNumQueries(3):
+            self.client.post(reverse("create_category"), {
+                "title": "Travel",
+                "description": "Trips",
+            })
+
+    def test_delete_transaction(self):
+        self.login()
+        url = reverse("delete_transaction", args=[self.transaction.id])
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        # user, savepoint, select, delete, balance, summary and release
+        with self.assertNumQueries(7):
+            self.client.post(url)
+
+    def test_delete_category(self):
+        self.login()
+        url = reverse("delete_category", args=[self.other.id])
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        # user, category, savepoint, balance effect, rules, six deletes,
+        # data version, balance and release
+        with self.assertNumQueries(14):
+            self.client.post(url)
+
+    def test_budgets(self):
+        self.login()
+        Budget.objects.create(user=self.user, category=self.category, amount=Decimal("10.00"))
+        # user, budget statuses and categories
+        with self.assertNumQueries(3):
+            self.client.get(reverse("budgets"))
+
+    def test_rules(self):
+        self.login()
+        CategoryRule.objects.create(
+            user=self.user, category=self.category, kind="K", pattern="lunch")
+        # user, rules with their categories and categories
+        with self.assertNumQueries(3):
+            self.client.get(reverse("rules"))
+
+    def test_bulk_transactions(self):
+        self.login()
+        ids = list(Transaction.objects.filter(category=self.other).values_list("id", flat=True))
+        # user, savepoint, grouped deltas, summaries, summary delete and
+        # insert, delete, balance and release
+        with self.assertNumQueries(9):
+            self.client.post(reverse("bulk_transactions"), {"action": "delete", "ids": ids})
+
+    def test_login_and_logout(self):
+        with self.assertNumQueries(9):
+            self.client.post(reverse("login"), {
+                "username": "budget",
+                "password": "Secret-pass-123",
+            })
+        # The last login saved the user, so it is loaded again
+        with self.assertNumQueries(3):
+            self.client.get(reverse("logout"))
+
+    def test_register(self):
+        with self.assertNumQueries(11):
+            self.client.post(reverse("register"), {
+                "username": "newbie",
+                "password1": "Very-secret-77",
+                "password2": "Very-secret-77",
+            })
+
+
+class AnalyticsTests(TestCase):
+    """
+    Time series of the ledger
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("analyst", password="secret")
+        food = Category.objects.create(title="Food", user=cls.user)
+        work = Category.objects.create(title="Work", user=cls.user)
+        rows = [
+            ("2024-01-05", "IN", "1000.00", work),
+            ("2024-01-20", "EX", "200.00", food),
+            ("2024-01-21", "EX", "100.00", food),
+            ("2024-03-02", "IN", "1000.00", work),
+            ("2024-03-03", "EX", "400.00", food),
+        ]
+        Transaction.objects.bulk_create(
+            Transaction(
+                title="Row",
+                date_created=datetime.date.fromisoformat(date_created),
+                transaction_type=transaction_type,
+                amount=Decimal(amount),
+                category=category,
+                user=cls.user,
+            )
+            for date_created, transaction_type, amount, category in rows
+        )
+        rebuild_summaries()
+
+    def setUp(self):
+        caches["default"].clear()
+        self.client.force_login(self.user)
+
+    def get(self, **params):
+        return self.client.get(reverse("analytics"), params).json()
+
+    def test_monthly_series_by_type(self):
+        data = self.get(window=2)
+        self.assertEqual(data["periods"], ["2024-01-01", "2024-02-01", "2024-03-01"])
+        self.assertEqual(data["series"]["EX"]["totals"], [300.0, 0.0, 400.0])
+        self.assertEqual(data["series"]["EX"]["moving_average"], [300.0, 150.0, 200.0])
+        self.assertEqual(data["series"]["EX"]["delta"], [300.0, -300.0, 400.0])
+        self.assertEqual(data["net"]["running_balance"], [700.0, 700.0, 1300.0])
+
+    def test_daily_series_by_category(self):
+        data = self.get(granularity="day", group_by="category", to="2024-01-31")
+        self.assertEqual(data["periods"][0], "2024-01-05")
+        self.assertEqual(len(data["periods"]), 17)
+        food = Category.objects.get(user=self.user, title="Food")
+        self.assertEqual(data["series"][str(food.pk)]["label"], "Food")
+        self.assertEqual(sum(data["series"][str(food.pk)]["totals"]), 300.0)
+        self.assertEqual(data["net"], {})
+
+    def test_totals_are_rounded_to_cents(self):
+        day = datetime.date(2024, 1, 5)
+        for total in (0.29, 1.15, Decimal("0.29")):
+            with self.subTest(total=total):
+                matrix = analytics.totals_matrix([(day, "EX", total)], ["EX"], [day])
+                self.assertEqual(matrix, [[round(total * 100)]])
+
+    def test_categories_of_the_same_title_are_separate_series(self):
+        food = Category.objects.get(user=self.user, title="Food")
+        other = Category.objects.create(title="Food", user=self.user)
+        Transaction.objects.create(
+            title="Row", date_created=datetime.date(2024, 1, 20), transaction_type="EX",
+            amount=Decimal("50.00"), category=other, user=self.user)
+        data = analytics.time_series(
+            self.user, "day", "category", date_to=datetime.date(2024, 1, 31))
+        self.assertEqual(sum(data["series"][food.pk]["totals"]), 300.0)
+        self.assertEqual(sum(data["series"][other.pk]["totals"]), 50.0)
+        self.assertEqual(data["series"][other.pk]["label"], "Food")
+
+    def test_daily_series_by_type(self):
+        data = analytics.time_series(
+            self.user, "day", "type", window=2, date_to=datetime.date(2024, 1, 21))
+        self.assertEqual(data["series"]["EX"]["totals"][-2:], [200.0, 100.0])
+        self.assertEqual(data["series"]["EX"]["moving_average"][-2:], [100.0, 150.0])
+        self.assertEqual(data["series"]["EX"]["delta"][-2:], [200.0, -100.0])
+        self.assertEqual(data["net"]["running_balance"][-2:], [800.0, 700.0])
+
+    def test_invalid_parameters(self):
+        for params in ({"granularity": "year"}, {"window": "0"}, {"from": "yesterday"}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse("analytics"), params)
+                self.assertEqual(response.status_code, 400)
+
+
+class PerformanceMiddlewareTests(TestCase):
+    """
+    Opt-in request instrumentation
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("profiled", password="secret")
+        cls.category = Category.objects.create(title="Food", user=cls.user)
+        seed_transactions(cls.user, cls.category, 5)
+
+    def setUp(self):
+        caches["default"].clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings = override_settings(
+            PERFORMANCE_INSTRUMENTATION=True,
+            PERFORMANCE_STATS_DIR=self.directory,
+            PERFORMANCE_FLUSH_INTERVAL=0,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        middleware.stats = None
+        self.addCleanup(setattr, middleware, "stats", None)
+        # The middleware chain is built on the first request of a client
+        self.client = self.client_class()
+        self.client.force_login(self.user)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("expenses"))
+        timing = response["Server-Timing"]
+        self.assertIn("total;dur=", timing)
+        self.assertIn('desc="3 queries"', timing)
+        self.assertIn("template;dur=", timing)
+
+    def test_disabled_by_default(self):
+        with override_settings(PERFORMANCE_INSTRUMENTATION=False):
+            response = self.client_class().get(reverse("home"))
+        self.assertNotIn("Server-Timing", response)
+
+    def test_samples_are_flushed_and_reported(self):
+        for _ in range(3):
+            self.client.get(reverse("report"))
+        samples = json.loads((self.directory / f"{os.getpid()}.json").read_text())
+        # The next loads are served from the report cache, but the user
+        self.assertEqual(samples["report"]["queries"], [4, 1, 1])
+
+        output = StringIO()
+        call_command("perfstats", "--json", stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(report["report"]["requests"], 3)
+        self.assertEqual(report["report"]["queries"]["p99"], 4)
+
+        call_command("perfstats", "--reset", stdout=StringIO())
+        self.assertFalse(self.directory.exists())
+
+    async def test_async_requests(self):
+        client = self.async_client_class()
+        await client.aforce_login(self.user)
+        response = await client.get(reverse("async_expenses"))
+        self.assertIn('desc="3 queries"', response["Server-Timing"])
+
+    def test_query_budget_warning(self):
+        with override_settings(PERFORMANCE_QUERY_BUDGETS={"expenses": 1}):
+            with self.assertLogs("finances.middleware", "WARNING") as logs:
+                self.client.get(reverse("expenses"))
+        self.assertIn("Possible N+1 in expenses: 3 queries for a budget of 1", logs.output[0])
+
+
+class AsyncViewsTests(TestCase):
+    """
+    The async variants must render the same pages as the sync views
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("asynchronous", password="secret")
+        cls.category = Category.objects.create(title="Food", user=cls.user)
+        seed_transactions(cls.user, cls.category, 30)
+        seed_transactions(cls.user, cls.category, 30, transaction_type="IN")
+        rebuild_summaries()
+
+    def setUp(self):
+        caches["default"].clear()
+        self.client.force_login(self.user)
+
+    def test_same_pages_as_sync_views(self):
+        for name in ("report", "expenses", "incomes"):
+            with self.subTest(view=name):
+                sync = self.client.get(reverse(name)).context
+                caches["default"].clear()
+                page = self.client.get(reverse(f"async_{name}")).context
+                self.assertEqual(list(page["object_list"]), list(sync["object_list"]))
+                self.assertEqual(page["page_obj"].next_cursor, sync["page_obj"].next_cursor)
+                next_page = self.client.get(
+                    reverse(f"async_{name}"), {"cursor": sync["page_obj"].next_cursor})
+                self.assertEqual(next_page.status_code, 200)
+
+    def test_report_context_and_queries(self):
+        # user, page, filter categories and the totals of the report
+        with self.assertNumQueries(4):
+            context = self.client.get(reverse("async_report")).context
+        self.assertEqual(context["totals"]["count"], 60)
+        self.assertEqual(len(context["expenses"]) + len(context["incomes"]), 25)
+
+    def test_login_required(self):
+        self.client.logout()
+        sync = self.client.get(reverse("report"))
+        response = self.client.get(reverse("async_report"))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, sync.url.replace("report", "async/report"))
+
+    def test_create_transaction(self):
+        response = self.client.get(reverse("async_create_transaction"))
+        self.assertEqual(response.context["categories_size"], 1)
+        response = self.client.post(reverse("async_create_transaction"), {
+            "title": "Salary",
+            "description": "",
+            "transaction_type": "IN",
+            "amount": "100.00",
+            "category": self.category.id,
+        })
+        self.assertRedirects(response, "/report/incomes/", fetch_redirect_response=False)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, Decimal("100.00"))
+        self.assertEqual(check_summaries([self.user]), [])
+
+    def test_invalid_transaction(self):
+        response = self.client.post(reverse("async_create_transaction"), {"title": "Nothing"})
+        self.assertEqual(response.context["error"], views.ERROR_MESSAGE_RESPONSE)
+
+    async def test_async_client(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("async_expenses"))
+        self.assertEqual(len(response.context["expenses"]), 25)
+
+
+class DatabaseProfileTests(TestCase):
+    """
+    Connection setup of the SQLite profile
+    """
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_on_connect(self):
+        self.assertEqual(self.pragma("busy_timeout"), 5000)
+        # NORMAL
+        self.assertEqual(self.pragma("synchronous"), 1)
+
+
+class TransactionFilterTests(TestCase):
+    """
+    Filters and full-text search of the listings
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("searcher", password="secret")
+        cls.food = Category.objects.create(title="Food", user=cls.user)
+        cls.travel = Category.objects.create(title="Travel", user=cls.user)
+        rows = [
+            ("Coffee beans", "Roasted in Lisbon", "2024-01-10", "12.50", cls.food),
+            ("Groceries", "Weekly market", "2024-02-03", "80.00", cls.food),
+            ("Train ticket", "Lisbon to Porto", "2024-02-20", "35.00", cls.travel),
+            ("Hotel", "Two nights, café included", "2024-03-01", "240.00", cls.travel),
+        ]
+        Transaction.objects.bulk_create(
+            Transaction(
+                title=title,
+                description=description,
+                date_created=datetime.date.fromisoformat(date_created),
+                transaction_type="EX",
+                amount=Decimal(amount),
+                category=category,
+                user=cls.user,
+            )
+            for title, description, date_created, amount, category in rows
+        )
+
+    def setUp(self):
+        caches["default"].clear()
+        self.client.force_login(self.user)
+
+    def titles(self, name="expenses", **params):
+        response = self.client.get(reverse(name), params)
+        return sorted(transaction.title for transaction in response.context["object_list"])
+
+    def test_full_text_search(self):
+        self.assertEqual(self.titles(q="lisbon"), ["Coffee beans", "Train ticket"])
+        # Prefixes, several words and accents
+        self.assertEqual(self.titles(q="coff"), ["Coffee beans"])
+        self.assertEqual(self.titles(q="lisbon porto"), ["Train ticket"])
+        self.assertEqual(self.titles(q="cafe"), ["Hotel"])
+        # Operators of the FTS5 syntax are plain words
+        self.assertEqual(self.titles(q='hotel OR "'), [])
+
+    def test_search_matches_category_titles(self):
+        self.assertEqual(self.titles(q="travel"), ["Hotel", "Train ticket"])
+
+    def test_index_follows_updates_and_deletes(self):
+        Transaction.objects.filter(title="Groceries").update(title="Supermarket")
+        Transaction.objects.filter(title="Hotel").delete()
+        self.assertEqual(self.titles(q="supermarket"), ["Supermarket"])
+        self.assertEqual(self.titles(q="groceries"), [])
+        self.assertEqual(self.titles(q="nights"), [])
+
+    def test_index_is_repaired_after_a_table_rebuild(self):
+        # Rebuilding the table in a migration drops its triggers
+        with connection.cursor() as cursor:
+            for name in search.FTS_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER {name}")
+        Transaction.objects.filter(title="Groceries").update(title="Supermarket")
+        search.repair_search_index(sender=None, using="default")
+        self.assertEqual(self.titles(q="supermarket"), ["Supermarket"])
+
+    def test_scan_fallback_matches_the_index(self):
+        queryset = Transaction.objects.filter(user=self.user)
+        for text in ("lisbon", "train lisbon", "hotel"):
+            with self.subTest(text=text):
+                self.assertQuerySetEqual(
+                    queryset.filter(search.search_filter(text, connection)),
+                    queryset.filter(search.scan_filter(search.search_terms(text))),
+                    ordered=False,
+                )
+
+    def test_field_filters(self):
+        self.assertEqual(
+            self.titles(date_from="2024-02-01", date_to="2024-02-28"),
+            ["Groceries", "Train ticket"])
+        self.assertEqual(self.titles(category=self.travel.id), ["Hotel", "Train ticket"])
+        self.assertEqual(self.titles(amount_min="30", amount_max="100"), ["Groceries", "Train ticket"])
+        self.assertEqual(self.titles("report", q="lisbon", amount_max="20"), ["Coffee beans"])
+
+    def test_invalid_filters_match_nothing(self):
+        self.assertEqual(self.titles(amount_min="a lot"), [])
+
+    def test_invalid_filters_are_not_cached(self):
+        everything = ["Coffee beans", "Groceries", "Hotel", "Train ticket"]
+        for name in ("expenses", "report", "async_report"):
+            with self.subTest(name=name):
+                self.assertEqual(self.titles(name, amount_min="abc"), [])
+                self.assertEqual(self.titles(name), everything)
+
+    def test_filtered_pages_keep_filters_and_skip_the_cache(self):
+        response = self.client.get(reverse("report"), {"q": "lisbon", "cursor": ""})
+        self.assertEqual(response.context["filter_query"], "q=lisbon")
+        self.assertEqual(
+            [choice[1] for choice in response.context["filter_categories"]], ["Food", "Travel"])
+        caching.stats.reset()
+        self.client.get(reverse("report"), {"q": "lisbon"})
+        # Only the report totals and the categories come from the cache
+        self.assertEqual(caching.stats.as_dict()["hits"], 2)
+
+    def test_categories_of_other_processes_are_listed(self):
+        self.client.get(reverse("report"))
+        # Created and committed by another process, this cache is never bumped
+        Category.objects.create(title="Health", user=self.user)
+        for name in ("report", "async_report"):
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(
+                    [choice[1] for choice in response.context["filter_categories"]],
+                    ["Food", "Travel", "Health"])
+
+    def test_async_views_filter(self):
+        self.assertEqual(self.titles("async_expenses", q="lisbon"), ["Coffee beans", "Train ticket"])
+
+
+class BulkOperationsTests(TestCase):
+    """
+    Bulk delete and move keep the balance and the summaries right
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("bulky", password="secret")
+        cls.food = Category.objects.create(title="Food", user=cls.user)
+        cls.rent = Category.objects.create(title="Rent", user=cls.user)
+        cls.stranger = CustomUser.objects.create_user("stranger", password="secret")
+        cls.foreign = Category.objects.create(title="Food", user=cls.stranger)
+        seed_transactions(cls.user, cls.food, 10)
+        seed_transactions(cls.user, cls.rent, 5, transaction_type="IN")
+        seed_transactions(cls.stranger, cls.foreign, 3)
+        rebuild_summaries()
+        for user in (cls.user, cls.stranger):
+            user.total_amount = Transaction.objects.filter(user=user).balance_effect()
+            user.save()
+
+    def setUp(self):
+        caches["default"].clear()
+        caching.stats.reset()
+        self.client.force_login(self.user)
+
+    def post(self, **data):
+        return self.client.post(reverse("bulk_transactions"), data)
+
+    def assertConsistent(self):
+        for user in (self.user, self.stranger):
+            user.refresh_from_db()
+            self.assertEqual(
+                user.total_amount, Transaction.objects.filter(user=user).balance_effect())
+        self.assertEqual(check_summaries(), [])
+
+    def test_delete_selected(self):
+        ids = list(Transaction.objects.filter(category=self.food).values_list("id", flat=True)[:4])
+        foreign = Transaction.objects.filter(user=self.stranger).first().id
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(action="delete", ids=ids + [foreign], next="/report/expenses/")
+        self.assertRedirects(response, "/report/expenses/", fetch_redirect_response=False)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 11)
+        self.assertTrue(Transaction.objects.filter(id=foreign).exists())
+        self.assertEqual(caching.stats.invalidations, 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, Decimal("-10.00"))
+        self.assertConsistent()
+
+    def test_delete_matching_filters(self):
+        self.post(action="delete", select_all="on", category=self.rent.id)
+        self.assertFalse(Transaction.objects.filter(category=self.rent).exists())
+        self.assertEqual(Transaction.objects.filter(category=self.food).count(), 10)
+        self.assertConsistent()
+
+    def test_move_selected(self):
+        ids = list(Transaction.objects.filter(category=self.food).values_list("id", flat=True)[:3])
+        self.post(action="move", ids=ids, target_category=self.rent.id)
+        self.assertEqual(Transaction.objects.filter(category=self.rent).count(), 8)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, Decimal("-50.00"))
+        self.assertConsistent()
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post(action="delete").status_code, 400)
+        self.assertEqual(self.post(action="move", select_all="on").status_code, 400)
+        response = self.post(action="move", select_all="on", target_category=self.foreign.id)
+        self.assertEqual(response.status_code, 400)
+        # Open redirects are not followed
+        response = self.post(action="delete", select_all="on", q="nothing", next="https://evil.test/")
+        self.assertRedirects(response, "/report/", fetch_redirect_response=False)
+        self.assertConsistent()
+
+    def test_delete_category_reverts_its_transactions(self):
+        self.client.post(reverse("delete_category", args=[self.food.id]))
+        self.assertFalse(Category.objects.filter(id=self.food.id).exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, Decimal("50.00"))
+        self.assertConsistent()
+
+
+class BulkOperationsTimingTests(TestCase):
+    """
+    Bulk operations on 100k transactions run as a few statements
+    """
+    ROWS = 100_000
+    TIME_BOUND = 5
+    STATEMENT_BOUND = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("bulk-timing")
+        populate(cls.user, cls.ROWS)
+        rebuild_summaries([cls.user])
+        cls.user.total_amount = Transaction.objects.filter(user=cls.user).balance_effect()
+        cls.user.save()
+
+    def assertFastAndConsistent(self, operation):
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            operation()
+        self.assertLess(time.perf_counter() - start, self.TIME_BOUND)
+        self.assertLess(len(queries), self.STATEMENT_BOUND)
+        self.user.refresh_from_db()
+        self.assertEqual(
+            self.user.total_amount, Transaction.objects.filter(user=self.user).balance_effect())
+        self.assertEqual(check_summaries([self.user]), [])
+
+    def test_delete_everything(self):
+        queryset = Transaction.objects.all()
+        self.assertFastAndConsistent(lambda: delete_transactions(self.user, queryset))
+        self.assertFalse(Transaction.objects.filter(user=self.user).exists())
+        self.assertEqual(self.user.total_amount, 0)
+
+    def test_move_everything(self):
+        target = Category.objects.create(title="Everything", user=self.user)
+        queryset = Transaction.objects.all()
+        self.assertFastAndConsistent(lambda: move_transactions(self.user, queryset, target))
+        self.assertEqual(Transaction.objects.filter(category=target).count(), self.ROWS)
+
+    def test_delete_category(self):
+        category = Category.objects.filter(user=self.user).first()
+        self.assertFastAndConsistent(lambda: delete_category(self.user, category))
+
+
+class BalanceCheckpointTests(TestCase):
+    """
+    Historical balances and reconciliation
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("historian", categories=3)
+        populate(cls.user, 3000, days=400)
+        rebuild_summaries([cls.user])
+        cls.user.total_amount = Transaction.objects.filter(user=cls.user).balance_effect()
+        cls.user.save()
+        cls.today = datetime.date.today()
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def expected(self, date):
+        return Transaction.objects.filter(user=self.user, date_created__lte=date).balance_effect()
+
+    def test_balance_on_matches_the_ledger(self):
+        self.assertFalse(BalanceCheckpoint.objects.filter(user=self.user).exists())
+        for days in (500, 399, 200, 31, 0):
+            date = self.today - datetime.timedelta(days=days)
+            with self.subTest(date=date):
+                self.assertEqual(balances.balance_on(self.user, date), self.expected(date))
+        self.assertEqual(balances.balance_on(self.user, self.today), self.user.total_amount)
+
+    def test_balance_costs_a_lookup_and_a_range_sum(self):
+        balances.build_checkpoints(self.user)
+        date = self.today - datetime.timedelta(days=200)
+        with CaptureQueriesContext(connection) as queries:
+            balances.balance_on(self.user, date)
+        self.assertEqual(len(queries), 2)
+        # The sum never reads more than the month of the date
+        self.assertIn(f"'{date.replace(day=1)}'", queries[1]["sql"])
+
+    def test_backdated_changes_invalidate_later_checkpoints(self):
+        balances.build_checkpoints(self.user)
+        past = self.today - datetime.timedelta(days=300)
+        category = Category.objects.filter(user=self.user).first()
+        self.client.force_login(self.user)
+        self.client.post(reverse("bulk_transactions"), {
+            "action": "delete", "select_all": "on", "date_to": past.isoformat(),
+        })
+        self.assertFalse(BalanceCheckpoint.objects.filter(month__gt=past).exists())
+        self.assertTrue(BalanceCheckpoint.objects.filter(month__lte=past).exists())
+        response = self.client.get(reverse("balance"), {"date": self.today.isoformat()})
+        self.user.refresh_from_db()
+        self.assertEqual(Decimal(response.json()["balance"]), self.user.total_amount)
+        # Current month changes keep every checkpoint
+        checkpoints = BalanceCheckpoint.objects.count()
+        recent = Transaction.objects.create(
+            title="Today", transaction_type="IN", amount=Decimal("5.00"),
+            category=category, user=self.user)
+        aggregates.apply_to_summaries([recent])
+        self.assertEqual(BalanceCheckpoint.objects.count(), checkpoints)
+
+    def test_reconcile_balances(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(total_amount=12)
+        output = StringIO()
+        call_command("reconcile_balances", "--workers", "1", "--batch-size", "1", stdout=output)
+        self.assertIn("found 1 drifted balances", output.getvalue())
+        call_command("reconcile_balances", "--workers", "1", "--repair", stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, self.expected(self.today))
+
+    def test_reconcile_locks_the_users_before_reading_the_ledger(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(balances.reconcile_users([self.user.pk], repair=True), [])
+        statements = [query["sql"] for query in queries]
+        users = next(i for i, sql in enumerate(statements) if "finances_customuser" in sql)
+        ledger = next(i for i, sql in enumerate(statements) if "finances_transaction" in sql)
+        self.assertLess(users, ledger)
+
+
+class TransactionCardTests(TestCase):
+    """
+    Rendering and caching of the transaction cards
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("renderer", categories=2)
+        populate(cls.user, 30)
+
+    def setUp(self):
+        caches["default"].clear()
+        self.request = RequestFactory().get("/report/")
+        self.request.user = self.user
+        self.template = engines["django"].from_string(
+            "{% load transactions %}{% transaction_cards transactions %}")
+
+    def render(self):
+        transactions = list(Transaction.objects.filter(user=self.user).for_listing())
+        return self.template.render({"transactions": transactions}, self.request)
+
+    def test_cards_link_to_the_delete_page(self):
+        html = self.render()
+        for pk in Transaction.objects.filter(user=self.user).values_list("id", flat=True):
+            self.assertIn(f'href="{reverse("delete_transaction", args=[pk])}"', html)
+        self.assertNotIn("csrfmiddlewaretoken", html)
+
+    def test_cards_are_cached_until_their_transaction_changes(self):
+        first = self.render()
+        with mock.patch("finances.templatetags.transactions.render_cards") as render_cards:
+            self.assertEqual(self.render(), first)
+        render_cards.assert_not_called()
+
+        # Changed without a new data version, like another process would
+        transaction = Transaction.objects.filter(user=self.user).first()
+        Transaction.objects.filter(pk=transaction.pk).update(title="Renamed")
+        with mock.patch(
+                "finances.templatetags.transactions.render_cards",
+                wraps=transaction_cards.render_cards) as render_cards:
+            self.assertIn("Renamed", self.render())
+        self.assertEqual([row.pk for row in render_cards.call_args.args[0]], [transaction.pk])
+
+    def test_listings_render_the_cards(self):
+        self.client.force_login(self.user)
+        transaction = Transaction.objects.filter(
+            user=self.user, transaction_type="EX").order_by("-date_created", "-id").first()
+        for name in ("expenses", "report"):
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name))
+                self.assertContains(response, reverse("delete_transaction", args=[transaction.pk]))
+
+
+class RecurringTransactionTests(TestCase):
+    """
+    Materialization of the recurring rules
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("subscriber", categories=2)
+        cls.category = Category.objects.filter(user=cls.user).first()
+
+    def add_rule(self, frequency, start_date, amount="10.00", transaction_type="EX"):
+        return RecurringTransaction.objects.create(
+            title=f"Rule {frequency}", transaction_type=transaction_type,
+            amount=Decimal(amount), frequency=frequency, start_date=start_date,
+            category=self.category, user=self.user)
+
+    def test_following_due_keeps_the_day_of_the_start(self):
+        rule = self.add_rule("M", datetime.date(2024, 1, 31))
+        dates = [rule.next_due]
+        for _ in range(3):
+            dates.append(recurring.following_due(rule, dates[-1]))
+        self.assertEqual(dates, [
+            datetime.date(2024, 1, 31), datetime.date(2024, 2, 29),
+            datetime.date(2024, 3, 31), datetime.date(2024, 4, 30),
+        ])
+        rule = self.add_rule("Y", datetime.date(2024, 2, 29))
+        self.assertEqual(recurring.following_due(rule, rule.next_due), datetime.date(2025, 2, 28))
+        self.assertEqual(
+            recurring.following_due(rule, datetime.date(2027, 2, 28)), datetime.date(2028, 2, 29))
+
+    def test_run_catches_up_and_is_idempotent(self):
+        today = datetime.date.today()
+        monthly = self.add_rule("M", add_months(today, -5), amount="1000.00", transaction_type="IN")
+        weekly = self.add_rule("W", today - datetime.timedelta(weeks=3))
+        self.add_rule("D", today + datetime.timedelta(days=1))
+
+        self.assertEqual(recurring.run_recurring(batch_size=1), (2, 10))
+        self.assertEqual(recurring.run_recurring(), (0, 0))
+        self.assertEqual(Transaction.objects.filter(user=self.user, title=monthly.title).count(), 6)
+        self.assertEqual(Transaction.objects.filter(user=self.user, title=weekly.title).count(), 4)
+        monthly.refresh_from_db()
+        self.assertEqual(monthly.next_due, add_months(today, 1))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, Decimal("5960.00"))
+        self.assertEqual(check_summaries([self.user]), [])
+
+    def test_batches_cost_a_fixed_number_of_queries(self):
+        today = datetime.date.today()
+        for _ in range(50):
+            self.add_rule("W", today - datetime.timedelta(weeks=2))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(recurring.materialize_batch(today), (50, 150))
+        # Rules, insert, rule update, summaries read and write, balance
+        self.assertLessEqual(len(queries), 10)
+
+    def test_command(self):
+        self.add_rule("D", datetime.date.today() - datetime.timedelta(days=1))
+        output = StringIO()
+        call_command("run_recurring", stdout=output)
+        self.assertIn("Processed 1 rules, created 2 transactions", output.getvalue())
+
+
+class BenchmarkSuiteTests(TestCase):
+    """
+    The view microbenchmarks and the comparison of their results
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_users("suite", 1, categories=2)[0]
+        populate(cls.user, 200)
+        rebuild_summaries([cls.user])
+
+    def test_every_url_has_a_scenario(self):
+        names = {scenario.split()[1] for scenario in benchmark_views.SCENARIOS}
+        for pattern in urlpatterns:
+            with self.subTest(name=pattern.name):
+                self.assertIn(pattern.name, names)
+
+    def test_run_views(self):
+        results = benchmark_views.run_views(self.user, 2)
+        self.assertEqual(results.keys(), benchmark_views.SCENARIOS.keys())
+        for name, result in results.items():
+            with self.subTest(name=name):
+                self.assertTrue(all(status < 400 for status in result["status"]))
+                self.assertGreater(result["peak_kb"], 0)
+        self.assertEqual(results["GET report"]["queries"], 1)
+        self.assertEqual(check_summaries([self.user]), [])
+
+    def test_compare(self):
+        baseline = {
+            "views": {"GET report": {"p50_ms": 10.0, "queries": 2}},
+            "load": {"create": {"requests_per_second": 100.0}},
+        }
+        current = {
+            "views": {"GET report": {"p50_ms": 12.0, "queries": 2}},
+            "load": {"create": {"requests_per_second": 80.0}},
+        }
+        self.assertEqual(compare(baseline, current), [])
+        current["views"]["GET report"] = {"p50_ms": 13.0, "queries": 3}
+        current["load"]["create"]["requests_per_second"] = 70.0
+        self.assertEqual(len(compare(baseline, current)), 3)
+
+
+class LoadDriverTests(TransactionTestCase):
+    """
+    The threaded create and delete flows keep the ledger consistent
+    """
+    def test_create_and_delete_flows(self):
+        users = create_users("driver", 2, categories=1)
+        # The in-memory test database fails concurrent writers at once
+        # instead of waiting, so a single worker thread
+        created = run_flow("create", users, 20, 1)
+        self.assertEqual((created.requests, created.errors), (20, 0))
+        ledger = Transaction.objects.filter(user__in=users)
+        self.assertEqual(ledger.count(), 20)
+
+        deleted = run_flow("delete", users, 20, 1)
+        self.assertEqual((deleted.requests, deleted.errors), (20, 0))
+        self.assertFalse(ledger.exists())
+        for user in users:
+            user.refresh_from_db()
+            self.assertEqual(user.total_amount, ledger.filter(user=user).balance_effect())
+        self.assertEqual(check_summaries(users), [])
+
+
+class BudgetTests(TestCase):
+    """
+    Monthly budgets and the overspend warning
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("saver", password="secret")
+        cls.food = Category.objects.create(title="Food", user=cls.user)
+        cls.rent = Category.objects.create(title="Rent", user=cls.user)
+        last_month = add_months(datetime.date.today(), -1)
+        seed_transactions(cls.user, cls.food, 3)
+        Transaction.objects.filter(user=cls.user).update(date_created=last_month)
+        rebuild_summaries([cls.user])
+        cls.budget = Budget.objects.create(user=cls.user, category=cls.food, amount=Decimal("30.00"))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def spend(self, amount, category=None, view="create_transaction"):
+        return self.client.post(reverse(view), {
+            "title": "Groceries",
+            "description": "",
+            "transaction_type": "EX",
+            "amount": amount,
+            "category": (category or self.food).id,
+        }, follow=True)
+
+    def warnings(self, response):
+        return [str(message) for message in response.context["messages"]]
+
+    def test_statuses_count_the_current_month(self):
+        self.spend("12.50")
+        self.spend("4.00", self.rent)
+        Budget.objects.create(user=self.user, category=self.rent, amount=Decimal("100.00"))
+        with self.assertNumQueries(1):
+            statuses = list(budget_statuses(self.user))
+        self.assertEqual(
+            [(budget.category.title, budget.spent, budget.remaining) for budget in statuses],
+            [("Food", Decimal("12.50"), Decimal("17.50")), ("Rent", Decimal("4.00"), Decimal("96.00"))],
+        )
+
+    def test_warns_when_an_expense_goes_over(self):
+        self.assertEqual(self.warnings(self.spend("20.00")), [])
+        response = self.spend("15.00")
+        self.assertEqual(
+            self.warnings(response),
+            ["You are over the Food budget: $35.00 spent of $30.00 this month"])
+        response = self.spend("1.00", view="async_create_transaction")
+        self.assertEqual(len(self.warnings(response)), 1)
+
+    def test_deletes_free_the_budget(self):
+        self.spend("35.00")
+        expense = Transaction.objects.get(user=self.user, title="Groceries")
+        self.client.post(reverse("delete_transaction", args=[expense.id]))
+        self.assertEqual(budget_statuses(self.user).get().spent, Decimal("0.00"))
+
+    def test_dashboard(self):
+        response = self.client.post(reverse("budgets"), {"category": self.food.id, "amount": "50"})
+        self.assertRedirects(response, reverse("budgets"))
+        self.assertEqual(Budget.objects.get(user=self.user).amount, Decimal("50.00"))
+        self.spend("60.00")
+        response = self.client.get(reverse("budgets"))
+        [budget] = response.context["budgets"]
+        self.assertTrue(budget.is_over)
+        self.assertEqual(budget.used_percent, 100)
+        self.client.post(reverse("delete_budget", args=[budget.id]))
+        self.assertFalse(Budget.objects.exists())
+
+
+class CurrencyTests(TestCase):
+    """
+    Transactions in other currencies and changes of the base currency
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("traveler", password="secret")
+        cls.category = Category.objects.create(title="Travel", user=cls.user)
+        cls.today = datetime.date.today()
+        cls.friday = cls.today - datetime.timedelta(days=3)
+
+    def setUp(self):
+        # Rates per euro, with a gap as on weekends
+        load_rates([
+            "Date,USD,GBP,JPY\n",
+            f"{self.today},1.2000,0.9000,N/A\n",
+            f"{self.friday},1.1000,0.8500,160.00\n",
+        ])
+        self.client.force_login(self.user)
+
+    def create(self, amount, currency, transaction_type="EX"):
+        return self.client.post(reverse("create_transaction"), {
+            "title": "Hotel",
+            "description": "",
+            "transaction_type": transaction_type,
+            "amount": amount,
+            "currency": currency,
+            "category": self.category.id,
+        })
+
+    def test_rates(self):
+        self.assertEqual(ExchangeRate.objects.count(), 5)
+        self.assertEqual(rate_on("USD", self.today), Decimal("1.2"))
+        self.assertEqual(rate_on("JPY", self.today), Decimal("160"))
+        self.assertEqual(rate_on("EUR", self.friday), 1)
+        with self.assertRaises(MissingExchangeRate):
+            rate_on("USD", self.friday - datetime.timedelta(days=1))
+        load_rates(["Date,USD\n", f"{self.today},1.3000\n"])
+        self.assertEqual(rate_on("USD", self.today), Decimal("1.3"))
+
+    def test_rates_loaded_by_other_processes(self):
+        # The weekend falls back to friday until a rate of today is loaded
+        self.assertEqual(rate_on("JPY", self.today), Decimal("160"))
+        ExchangeRate.objects.create(date=self.today, currency="JPY", rate=Decimal("170"))
+        self.assertEqual(rate_on("JPY", self.today), Decimal("170"))
+        # Days up to the latest rate are settled and kept
+        rate_on("JPY", self.today)
+        rate_on("USD", self.friday)
+        with self.assertNumQueries(0):
+            self.assertEqual(rate_on("JPY", self.today), Decimal("170"))
+            self.assertEqual(rate_on("USD", self.friday), Decimal("1.1"))
+
+    def test_create_in_another_currency(self):
+        self.create("90.00", "gbp")
+        self.create("10.00", "USD", "IN")
+        foreign, local = Transaction.objects.filter(user=self.user).order_by("id")
+        self.assertEqual(
+            (foreign.amount, foreign.original_amount, foreign.currency),
+            (Decimal("120.00"), Decimal("90.00"), "GBP"))
+        self.assertEqual((local.amount, local.currency), (Decimal("10.00"), ""))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_amount, Decimal("-110.00"))
+
+        response = self.create("5.00", "CHF")
+        self.assertContains(response, "No exchange rate for CHF")
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+
+    def test_import_converts_each_batch_with_one_query(self):
+        lines = [
+            "title,description,transaction_type,amount,category,date,currency\n",
+            f"Hotel,,EX,85.00,Travel,{self.friday},GBP\n",
+            f"Hotel,,EX,16000,Travel,{self.today},jpy\n",
+            f"Refund,,IN,5.00,Travel,{self.today},usd\n",
+            f"Train,,EX,10.00,Travel,{self.today},CHF\n",
+        ]
+        result = import_transactions(self.user, lines, "csv")
+        self.assertEqual((result.created, result.failed), (3, 1))
+        self.assertEqual(result.errors[0][0], 5)
+        self.assertEqual(
+            list(Transaction.objects.filter(user=self.user).order_by("id")
+                 .values_list("amount", "original_amount", "currency")),
+            [
+                (Decimal("110.00"), Decimal("85.00"), "GBP"),
+                (Decimal("120.00"), Decimal("16000.00"), "JPY"),
+                (Decimal("5.00"), None, ""),
+            ],
+        )
+
+        batch = [
+            Transaction(amount=Decimal("85.00"), currency="GBP", date_created=self.friday)
+            for _ in range(100)
+        ]
+        with self.assertNumQueries(1):
+            self.assertEqual(convert_transactions(batch, "USD"), [])
+        self.assertEqual({item.amount for item in batch}, {Decimal("110.00")})
+
+    def test_change_base_currency(self):
+        self.create("120.00", "USD")
+        self.create("90.00", "GBP", "IN")
+        self.create("100.00", "EUR")
+        Budget.objects.create(user=self.user, category=self.category, amount=Decimal("240.00"))
+        RecurringTransaction.objects.create(
+            title="Rent", transaction_type="EX", amount=Decimal("120.00"), frequency="M",
+            next_due=datetime.date.today(), category=self.category, user=self.user)
+
+        user = change_base_currency(self.user, "EUR")
+        self.assertEqual((user.currency, user.total_amount), ("EUR", Decimal("-100.00")))
+        self.assertEqual(
+            list(Transaction.objects.filter(user=user).order_by("id")
+                 .values_list("amount", "original_amount", "currency")),
+            [
+                (Decimal("100.00"), Decimal("120.00"), "USD"),
+                (Decimal("100.00"), Decimal("90.00"), "GBP"),
+                (Decimal("100.00"), None, ""),
+            ],
+        )
+        self.assertEqual(Budget.objects.get(user=user).amount, Decimal("200.00"))
+        self.assertEqual(RecurringTransaction.objects.get(user=user).amount, Decimal("100.00"))
+        self.assertEqual(check_summaries([user]), [])
+
+        Transaction.objects.filter(user=user, currency="GBP").update(
+            date_created=self.friday - datetime.timedelta(days=1))
+        with self.assertRaises(MissingExchangeRate):
+            change_base_currency(user, "USD")
+        user.refresh_from_db()
+        self.assertEqual(user.currency, "EUR")
+        self.assertEqual(RecurringTransaction.objects.get(user=user).amount, Decimal("100.00"))
+
+    def test_set_currency_command(self):
+        # 100.00 USD at the rates of today
+        self.create("120.00", "EUR")
+        out = StringIO()
+        call_command("set_currency", "traveler", "gbp", stdout=out)
+        self.assertIn("traveler now uses GBP, balance -108.00", out.getvalue())
+
+
+class ApiTests(TestCase):
+    """
+    The read-only JSON API, its conditional GETs and delta syncs
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("mobile", password="secret")
+        cls.category = Category.objects.create(title="Food", user=cls.user)
+        seed_transactions(cls.user, cls.category, 150)
+        seed_transactions(cls.user, cls.category, 5, transaction_type="IN")
+
+    def setUp(self):
+        caches["default"].clear()
+        self.client.force_login(self.user)
+        self.url = reverse("api_transactions")
+
+    def add(self, size):
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(size):
+                self.user.apply_balance_change(Decimal("-1.00"))
+                Transaction.objects.create(
+                    title=f"New {number}", transaction_type="EX", amount=Decimal("1.00"),
+                    category=self.category, user=self.user)
+
+    def test_pages(self):
+        # user, page and last id
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "application/json")
+        data = response.json()
+        self.assertEqual(len(data["results"]), 100)
+        self.assertEqual(set(data["results"][0]), {
+            "id", "title", "description", "amount", "currency", "original_amount",
+            "category_id", "date", "type"})
+        self.assertEqual(data["results"][0]["amount"], "10.00")
+        self.assertIsNone(data["previous"])
+
+        data = self.client.get(self.url, {"cursor": data["next"]}).json()
+        self.assertEqual(len(data["results"]), 55)
+        self.assertIsNone(data["next"])
+        self.assertNotIn("sync", data)
+
+        data = self.client.get(self.url, {"type": "IN"}).json()
+        self.assertEqual(len(data["results"]), 5)
+        self.assertEqual(self.client.get(self.url, {"type": "XX"}).status_code, 400)
+
+    def test_unchanged_polls_are_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        # Only the user is read
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        self.assertNotEqual(self.client.get(self.url, {"type": "EX"})["ETag"], etag)
+        self.add(1)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_changes_of_other_processes_are_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        # Another process commits a change, this cache is never bumped
+        caching.invalidate_on_commit(self.user.pk)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_errors_skip_the_etag(self):
+        response = self.client.get(self.url, {"type": "XX"}, HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("ETag", response)
+
+        self.client.logout()
+        for name in ("api_transactions", "api_categories", "api_balance"):
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH="*")
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response.json(), {"error": "Authentication required"})
+
+    def test_delta_sync(self):
+        sync = self.client.get(self.url).json()["sync"]
+        data = self.client.get(self.url, {"since": sync}).json()
+        self.assertEqual((data["results"], data["has_more"]), ([], False))
+
+        self.add(3)
+        data = self.client.get(self.url, {"since": data["sync"]}).json()
+        self.assertEqual([row["title"] for row in data["results"]], ["New 0", "New 1", "New 2"])
+        sync = data["sync"]
+        self.assertEqual(self.client.get(self.url, {"since": sync}).json()["results"], [])
+
+        expense = Transaction.objects.filter(user=self.user).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("delete_transaction", args=[expense.id]))
+        self.assertEqual(self.client.get(self.url, {"since": sync}).json(), {"reset": True})
+        self.assertEqual(self.client.get(self.url, {"since": "invalid"}).status_code, 404)
+        # Versions ahead of the user were never issued by its row
+        ahead = encode_sync_cursor(time.time_ns(), 0)
+        self.assertEqual(self.client.get(self.url, {"since": ahead}).json(), {"reset": True})
+
+    def test_additions_lock_the_user_before_taking_ids(self):
+        # Delta syncs page by id, which needs the ids of a user to be
+        # taken in commit order
+        RecurringTransaction.objects.create(
+            title="Rent", transaction_type="EX", amount=Decimal("500.00"), frequency="M",
+            start_date=datetime.date.today(), category=self.category, user=self.user)
+        lines = ["title,description,transaction_type,amount,category,date\n",
+                 "Row,,EX,1.00,Food,\n"]
+        for name, operation in (
+                ("create", lambda: self.client.post(reverse("create_transaction"), {
+                    "title": "Lunch", "description": "", "transaction_type": "EX",
+                    "amount": "12.00", "category": self.category.id})),
+                ("import", lambda: import_transactions(self.user, lines, "csv")),
+                ("recurring", recurring.run_recurring)):
+            with self.subTest(name=name), CaptureQueriesContext(connection) as queries:
+                operation()
+                statements = [query["sql"] for query in queries]
+                lock = next(i for i, sql in enumerate(statements)
+                            if sql.startswith('UPDATE "finances_customuser"'))
+                insert = next(i for i, sql in enumerate(statements)
+                              if sql.startswith('INSERT INTO "finances_transaction"'))
+                self.assertLess(lock, insert)
+
+    def test_categories_and_balance(self):
+        data = self.client.get(reverse("api_categories")).json()
+        self.assertEqual(data, {"results": [
+            {"id": self.category.id, "title": "Food", "description": ""}]})
+        self.user.apply_balance_change(Decimal("-12.50"))
+        data = self.client.get(reverse("api_balance")).json()
+        self.assertEqual(data, {"balance": "-12.50", "currency": "USD"})
+
+
+class AuthenticationTests(TestCase):
+    """
+    The login hashes the password once and, with a cache shared by every
+    process, the user of each request is served from the cache until it
+    changes
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user("regular", password="Secret-pass-123")
+        cls.category = Category.objects.create(title="Food", user=cls.user)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            CACHES={"default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": directory.name,
+            }},
+            AUTHENTICATION_BACKENDS=["finances.auth.CachedModelBackend"],
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_login_checks_the_password_once(self):
+        with mock.patch.object(
+                CustomUser, "check_password", autospec=True,
+                side_effect=CustomUser.check_password) as check:
+            response = self.client.post(
+                reverse("login"), {"username": "regular", "password": "Secret-pass-123"})
+        self.assertRedirects(response, "/report/", fetch_redirect_response=False)
+        self.assertEqual(check.call_count, 1)
+
+        response = self.client_class().post(
+            reverse("login"), {"username": "regular", "password": "wrong"})
+        self.assertContains(response, "Invalid user or password")
+
+    def test_cached_user_follows_the_balance(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse("home"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["user"].total_amount, 0)
+
+        self.client.post(reverse("create_transaction"), {
+            "title": "Lunch",
+            "description": "",
+            "transaction_type": "EX",
+            "amount": "12.00",
+            "category": self.category.id,
+        })
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["user"].total_amount, Decimal("-12.00"))
+
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.user.refresh_from_db()
+        self.user.save()
+        self.assertFalse(self.client.get(reverse("home")).context["user"].is_authenticated)
+
+    @override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies")
+    def test_signed_cookie_sessions(self):
+        self.client.post(reverse("login"), {"username": "regular", "password": "Secret-pass-123"})
+        self.client.get(reverse("home"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["user"], self.user)
+
+    def test_cached_user_needs_a_shared_cache(self):
+        self.assertEqual(check_cached_user_backend(None), [])
+        local = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with override_settings(CACHES=local):
+            errors = check_cached_user_backend(None)
+            self.assertEqual([error.id for error in errors], ["finances.E001"])
+
+            # A misconfigured backend still reads the user of every request
+            self.client.force_login(self.user)
+            self.client.get(reverse("home"))
+            with self.assertNumQueries(1):
+                self.client.get(reverse("home"))
+        with override_settings(
+                CACHES=local,
+                AUTHENTICATION_BACKENDS=["django.contrib.auth.backends.ModelBackend"]):
+            self.assertEqual(check_cached_user_backend(None), [])
+
+
+class ArchiveTests(TestCase):
+    """
+    Archived transactions leave the ledger but still count in the
+    totals, and listings read them only for old date ranges
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("archivist", categories=3)
+        populate(cls.user, 1500, days=800)
+        rebuild_summaries([cls.user])
+        cls.user.total_amount = Transaction.objects.filter(user=cls.user).balance_effect()
+        cls.user.save()
+        cls.today = datetime.date.today()
+        cls.before = cls.today - datetime.timedelta(days=365)
+        cls.old_ids = set(Transaction.objects.filter(
+            user=cls.user, date_created__lt=cls.before).values_list("id", flat=True))
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def archive(self):
+        archive_transactions(self.before, [self.user], batch_size=300)
+        self.user.refresh_from_db()
+
+    def test_archive_keeps_the_totals(self):
+        totals = report_totals(self.user)
+        old_balance = Transaction.objects.filter(
+            user=self.user, date_created__lte=self.before).balance_effect()
+        out = StringIO()
+        call_command("archive_transactions", "--before", self.before.isoformat(),
+                     "--batch-size", "300", stdout=out)
+        self.assertIn(f"Archived {len(self.old_ids)} transactions", out.getvalue())
+        self.user.refresh_from_db()
+
+        self.assertEqual(self.user.archived_before, self.before)
+        self.assertFalse(Transaction.objects.filter(date_created__lt=self.before).exists())
+        self.assertEqual(
+            set(ArchivedTransaction.objects.values_list("id", flat=True)), self.old_ids)
+        self.assertEqual(report_totals(self.user), totals)
+        self.assertEqual(check_summaries([self.user]), [])
+        self.assertEqual(
+            balances.ledger_balances([self.user.pk])[self.user.pk], self.user.total_amount)
+        self.assertEqual(balances.balance_on(self.user, self.before), old_balance)
+        rebuild_summaries([self.user])
+        self.assertEqual(report_totals(self.user), totals)
+
+        with self.assertRaises(CommandError):
+            call_command("archive_transactions", "--before", "last year")
+
+    def test_listings_read_the_archive_for_old_ranges(self):
+        self.archive()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("report"))
+        self.assertNotIn("archivedtransaction", " ".join(query["sql"] for query in queries))
+
+        date_from = self.before - datetime.timedelta(days=60)
+        expected = [
+            item.id for item in sorted(
+                [
+                    *Transaction.objects.filter(user=self.user, date_created__gte=date_from),
+                    *ArchivedTransaction.objects.filter(
+                        user=self.user, date_created__gte=date_from),
+                ],
+                key=lambda item: (item.date_created, item.id), reverse=True,
+            )
+        ]
+        listed, cursor = [], None
+        while True:
+            params = {"date_from": date_from.isoformat()}
+            if cursor:
+                params["cursor"] = cursor
+            page = self.client.get(reverse("report"), params).context["page_obj"]
+            listed += [item.id for item in page]
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(listed, expected)
+
+        # The archive has no search index, it is scanned
+        response = self.client.get(
+            reverse("expenses"), {"date_to": self.before.isoformat(), "q": "coffee"})
+        expenses = list(response.context["expenses"])
+        self.assertTrue(expenses)
+        for item in expenses:
+            self.assertIn(item.id, self.old_ids)
+            self.assertIn("coffee", f"{item.title} {item.description}".lower())
+
+    def test_reports_and_changes_include_the_archive(self):
+        self.client.force_login(self.user)
+        date_from = self.before - datetime.timedelta(days=30)
+        series = analytics.time_series(self.user, "day", date_from=date_from)
+        export = self.client.get(reverse("export_transactions")).streaming_content
+        export = list(export)
+        self.archive()
+        self.assertEqual(analytics.time_series(self.user, "day", date_from=date_from), series)
+        response = self.client.get(reverse("export_transactions"))
+        self.assertEqual(list(response.streaming_content), export)
+
+        category = Category.objects.filter(user=self.user).first()
+        delete_category(self.user, category)
+        self.user.refresh_from_db()
+        self.assertEqual(
+            balances.ledger_balances([self.user.pk])[self.user.pk], self.user.total_amount)
+        self.assertEqual(check_summaries([self.user]), [])
+
+    def test_bulk_actions_include_the_archive(self):
+        self.archive()
+        self.client.force_login(self.user)
+        date_to = self.before - datetime.timedelta(days=30)
+        response = self.client.get(reverse("report"), {"date_to": date_to.isoformat()})
+        archived = response.context["transactions"][0]
+        self.assertIsInstance(archived, ArchivedTransaction)
+        # Archived transactions have no delete page
+        self.assertNotContains(response, reverse("delete_transaction", args=[archived.id]))
+        self.assertContains(response, f'name="ids" value="{archived.id}"')
+
+        category = Category.objects.filter(user=self.user).exclude(
+            pk=archived.category_id).first()
+        self.client.post(reverse("bulk_transactions"), {
+            "action": "move", "ids": [archived.id], "target_category": category.pk})
+        self.assertEqual(ArchivedTransaction.objects.get(pk=archived.id).category, category)
+
+        self.client.post(reverse("bulk_transactions"), {
+            "action": "delete", "select_all": "on", "date_to": date_to.isoformat()})
+        self.assertFalse(ArchivedTransaction.objects.filter(date_created__lte=date_to).exists())
+        self.assertTrue(ArchivedTransaction.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(
+            balances.ledger_balances([self.user.pk])[self.user.pk], self.user.total_amount)
+        self.assertEqual(check_summaries([self.user]), [])
+
+
+class JobQueueTests(TestCase):
+    """
+    Statements requested from a view, generated by the database job
+    queue and polled until they can be downloaded
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("accountant", categories=3)
+        populate(cls.user, 600, days=120)
+        rebuild_summaries([cls.user])
+        cls.user.total_amount = Transaction.objects.filter(user=cls.user).balance_effect()
+        cls.user.save()
+        last_month = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+        cls.month = last_month.replace(day=1)
+
+    def setUp(self):
+        caches["default"].clear()
+        self.client.force_login(self.user)
+
+    def test_statement_is_queued_polled_and_downloaded(self):
+        data = {"month": f"{self.month:%Y-%m}", "format": "csv"}
+        self.client.get(reverse("statements"))
+        # user, savepoint, pending job lookup, insert and release
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse("statements"), data)
+        self.assertRedirects(response, reverse("statements"))
+        # The same pending request is not queued twice
+        self.client.post(reverse("statements"), data)
+        job = Job.objects.get()
+        status_url = reverse("statement_status", args=[job.pk])
+        self.assertEqual(self.client.get(status_url).json()["status"], "queued")
+        self.assertContains(self.client.get(reverse("statements")), "data-status-url")
+
+        self.assertEqual(work("test", burst=True), 1)
+        status = self.client.get(status_url).json()
+        self.assertEqual(status["status"], "done")
+        response = self.client.get(status["download"])
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn(f"statement-{self.month:%Y-%m}.csv", response["Content-Disposition"])
+        lines = response.content.decode().splitlines()
+        last_day = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+        self.assertEqual(lines[-1], f"closing balance,{balances.balance_on(self.user, last_day)}")
+        self.assertEqual(
+            len(lines) - 6,
+            Transaction.objects.filter(
+                user=self.user, date_created__gte=self.month, date_created__lte=last_day,
+            ).count(),
+        )
+
+        other = CustomUser.objects.create_user("snoop", password="secret")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+        self.assertEqual(self.client.get(status["download"]).status_code, 404)
+
+    def test_pdf_statement(self):
+        content = render_pdf(build_statement(self.user, self.month))
+        self.assertTrue(content.startswith(b"%PDF-1.4"))
+        self.assertTrue(content.endswith(b"%%EOF\n"))
+        # Every object sits at the offset of the cross-reference table
+        xref = int(content.rsplit(b"startxref\n", 1)[1].split()[0])
+        offsets = content[xref:].split(b"\n")[3:]
+        for number, entry in enumerate(offsets, start=1):
+            if not entry.endswith(b" n "):
+                break
+            self.assertTrue(content[int(entry[:10]):].startswith(b"%d 0 obj" % number))
+        self.assertIn(b"/Count 3", content)
+
+    def test_claims_and_failures(self):
+        first = enqueue(self.user, "statement", month=self.month.isoformat(), format="csv")
+        second = enqueue(self.user, "statement", month=self.month.isoformat(), format="xml")
+        self.assertEqual(claim_job("one").pk, first.pk)
+        claimed = claim_job("two")
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (second.pk, "R", 1))
+        self.assertIsNone(claim_job("three"))
+
+        with self.assertLogs("finances.jobs", "ERROR"):
+            run_job(claimed)
+        second.refresh_from_db()
+        self.assertEqual(second.status, "F")
+        self.assertIn("KeyError", second.error)
+
+        # The worker of the first job died
+        Job.objects.filter(pk=first.pk).update(
+            started_at=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(Job.objects.get(pk=first.pk).status, "Q")
+        Job.objects.filter(pk=first.pk).update(
+            status="R", attempts=3,
+            started_at=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(requeue_stale(), 0)
+        self.assertEqual(Job.objects.get(pk=first.pk).status, "F")
+
+    def test_run_workers_command(self):
+        enqueue(self.user, "statement", month=self.month.isoformat(), format="pdf")
+        out = StringIO()
+        call_command("run_workers", "--workers", "1", "--burst", stdout=out)
+        self.assertIn("Ran 1 jobs with 1 workers", out.getvalue())
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.result_type), ("D", "application/pdf"))
+
+
+class CategoryRuleTests(TestCase):
+    """
+    Rules that categorize new, imported and existing transactions
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("categorized", categories=0)
+        cls.food = Category.objects.create(title="Food", user=cls.user)
+        cls.travel = Category.objects.create(title="Travel", user=cls.user)
+        cls.salary = Category.objects.create(title="Salary", user=cls.user)
+        cls.small = Category.objects.create(title="Small", user=cls.user)
+        cls.other = Category.objects.create(title="Other", user=cls.user)
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def rule(self, kind, pattern="", category=None, **fields):
+        return CategoryRule.objects.create(
+            user=self.user, kind=kind, pattern=pattern, category=category or self.food,
+            **fields)
+
+    def test_matcher(self):
+        self.rule("K", "train", self.travel, priority=10)
+        self.rule("K", "coffee", priority=20)
+        self.rule("R", r"^pay(roll)?\b", self.salary, transaction_type="IN")
+        self.rule("K", "uber", self.travel)
+        self.rule("A", category=self.small, amount_max=Decimal("5.00"), priority=500)
+        matcher = get_matcher(self.user.pk)
+        # The best rule wins wherever it matches in the title
+        self.assertEqual(matcher.match("Coffee at the TRAIN station", Decimal("9")), self.travel.pk)
+        self.assertEqual(matcher.match("coffee", Decimal("9")), self.food.pk)
+        self.assertEqual(matcher.match("Payroll March", Decimal("900"), "IN"), self.salary.pk)
+        self.assertIsNone(matcher.match("Payroll March", Decimal("900"), "EX"))
+        # Keywords match whole words
+        self.assertEqual(matcher.match("Uber ride", Decimal("20")), self.travel.pk)
+        self.assertIsNone(matcher.match("Cucumber", Decimal("20")))
+        self.assertEqual(matcher.match("Cucumber", Decimal("2")), self.small.pk)
+        self.assertEqual(matcher.match("Coffee", Decimal("2")), self.food.pk)
+
+    def test_keywords_sharing_a_prefix(self):
+        self.rule("K", "coffee", priority=2)
+        self.rule("K", "coffee shop", self.travel, priority=3)
+        self.rule("K", "coffee shop card", self.salary, priority=1)
+        self.rule("K", "amzn*", self.other)
+        matcher = get_matcher(self.user.pk)
+        self.assertEqual(matcher.match("COFFEE SHOP downtown"), self.food.pk)
+        self.assertEqual(matcher.match("Coffee shop card 42"), self.salary.pk)
+        self.assertIsNone(matcher.match("Coffeeshop"))
+        self.assertEqual(matcher.match("AMZN*Mktp"), self.other.pk)
+
+    def test_rejected_rules_do_not_hide_other_patterns(self):
+        self.rule("K", "coffee", self.salary, transaction_type="IN", priority=1)
+        self.rule("K", "coffee", self.small, amount_max=Decimal("3.00"), priority=2)
+        self.rule("R", r"cof+ee shop", self.travel, priority=3)
+        self.rule("K", "coffee", priority=4)
+        matcher = get_matcher(self.user.pk)
+        self.assertEqual(matcher.match("Coffee", Decimal("2"), "EX"), self.small.pk)
+        self.assertEqual(matcher.match("Coffee shop", Decimal("8"), "EX"), self.travel.pk)
+        self.assertEqual(matcher.match("Coffee", Decimal("8"), "EX"), self.food.pk)
+        self.assertEqual(matcher.match("Coffee shop", Decimal("8"), "IN"), self.salary.pk)
+
+    def test_rules_are_cached_until_they_change(self):
+        self.rule("K", "coffee")
+        # data version and rules
+        with self.assertNumQueries(2):
+            load_rules(self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_matcher(self.user.pk).match("coffee"), self.food.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rule("K", "coffee", self.travel, priority=1)
+        self.assertEqual(get_matcher(self.user.pk).match("coffee"), self.travel.pk)
+
+    def test_rule_form(self):
+        self.client.force_login(self.user)
+        url = reverse("rules")
+        invalid = (
+            {"kind": "K", "pattern": " "},
+            {"kind": "R", "pattern": "(unclosed"},
+            {"kind": "R", "pattern": r"(a)\1"},
+            {"kind": "R", "pattern": "(a+)+$"},
+            {"kind": "A"},
+            {"kind": "A", "amount_min": "10", "amount_max": "5"},
+        )
+        for data in invalid:
+            with self.subTest(data=data):
+                response = self.client.post(
+                    url, {**data, "priority": "100", "category": self.food.pk})
+                self.assertEqual(response.status_code, 200)
+        self.assertFalse(CategoryRule.objects.exists())
+        response = self.client.post(url, {
+            "kind": "A", "pattern": "ignored", "amount_min": "10", "priority": "100",
+            "category": self.food.pk,
+        })
+        self.assertRedirects(response, url)
+        rule = CategoryRule.objects.get()
+        self.assertEqual((rule.user, rule.pattern), (self.user, ""))
+        self.assertContains(self.client.get(url), "from $10.00")
+
+    def test_expressions_that_backtrack_are_rejected(self):
+        for pattern in (
+                "(a+)+$", r"(\w+\s?)+$", "(a|a)*", "(a|ab)+", r"\d+\d+", r"\w+\s*\w+",
+                "[ab]+a*", "a{2,}a+", "(?=(a+)+)x", "(?x:a+ a+)", "a" * 101):
+            with self.subTest(pattern=pattern):
+                with self.assertRaises(re.error):
+                    check_expression(pattern)
+        for pattern in (r"^pay(roll)?\b", r"(?:\d{2})+", "(?:foo|bar)+", r"\w+ \w+",
+                        "amazon.*prime", r"[]a]+b", r"\x41+b", "(?#note)a+b", "a{,3}b"):
+            with self.subTest(pattern=pattern):
+                check_expression(pattern)
+
+    def test_new_transactions_without_a_category(self):
+        self.rule("K", "coffee")
+        self.client.force_login(self.user)
+        data = {"title": "Morning coffee", "description": "", "transaction_type": "EX",
+                "amount": "3.50"}
+        response = self.client.post(reverse("create_transaction"), data)
+        self.assertRedirects(response, "/report/expenses/", fetch_redirect_response=False)
+        self.assertEqual(Transaction.objects.get().category, self.food)
+        response = self.client.post(reverse("create_transaction"), {**data, "title": "Rent"})
+        self.assertContains(response, "no rule matches this transaction")
+        # A chosen category wins over the rules
+        self.client.post(
+            reverse("create_transaction"), {**data, "category": self.other.pk})
+        self.assertEqual(Transaction.objects.filter(category=self.other).count(), 1)
+        self.assertEqual(check_summaries([self.user]), [])
+
+    def test_rules_of_other_processes_apply(self):
+        self.rule("K", "coffee")
+        self.client.force_login(self.user)
+        data = {"title": "Coffee", "description": "", "transaction_type": "EX",
+                "amount": "3.50"}
+        self.client.post(reverse("create_transaction"), data)
+        # Created and committed by another process, this cache is never bumped
+        self.rule("K", "coffee", self.travel, priority=1)
+        self.client.post(reverse("create_transaction"), data)
+        self.assertEqual(
+            list(Transaction.objects.order_by("id").values_list("category", flat=True)),
+            [self.food.pk, self.travel.pk])
+
+    def test_import_without_categories(self):
+        self.rule("K", "train", self.travel)
+        lines = [
+            "title,description,transaction_type,amount,category,date\n",
+            "Train ticket,,EX,20.00,,2024-01-05\n",
+            "Groceries,,EX,30.00,,2024-01-06\n",
+            "Train ticket,,EX,20.00,Other,2024-01-07\n",
+        ]
+        result = import_transactions(self.user, lines, "csv")
+        self.assertEqual((result.created, result.failed), (2, 1))
+        self.assertEqual(result.errors[0], (3, ["category: This field is required."]))
+        self.assertEqual(
+            list(Transaction.objects.order_by("date_created").values_list("category", flat=True)),
+            [self.travel.pk, self.other.pk])
+
+        ofx = [
+            "<STMTTRN><TRNAMT>-12.00<DTPOSTED>20240108<NAME>Train</STMTTRN>\n",
+            "<STMTTRN><TRNAMT>-8.00<DTPOSTED>20240109<NAME>Bakery</STMTTRN>\n",
+        ]
+        result = import_transactions(self.user, ofx, "ofx")
+        self.assertEqual(result.created, 2)
+        self.assertEqual(
+            list(Transaction.objects.filter(date_created__gte=datetime.date(2024, 1, 8))
+                 .order_by("date_created").values_list("category__title", flat=True)),
+            ["Travel", "Imported"])
+        self.assertEqual(check_summaries([self.user]), [])
+
+    def test_recategorize_command(self):
+        populate(self.user, 3000, days=365)
+        rebuild_summaries([self.user])
+        archive_transactions(datetime.date.today() - datetime.timedelta(days=180), [self.user])
+        self.rule("K", "coffee", priority=1)
+        self.rule("R", r"^(train|taxi|flight)\b", self.travel, priority=2)
+        self.rule("K", "salary", self.salary, transaction_type="IN", priority=3)
+        self.rule("A", category=self.small, amount_max=Decimal("20.00"), priority=4)
+        totals = report_totals(self.user)
+
+        output = StringIO()
+        call_command("recategorize", user=[self.user.pk], batch_size=500, stdout=output)
+        self.assertIn("transactions read", output.getvalue())
+        matcher = get_matcher(self.user.pk)
+        for model in (Transaction, ArchivedTransaction):
+            for item in model.objects.filter(user=self.user):
+                category_id = matcher.categorize(item)
+                if category_id is not None:
+                    self.assertEqual(item.category_id, category_id)
+        self.assertTrue(ArchivedTransaction.objects.filter(category=self.travel).exists())
+        self.assertEqual(check_summaries([self.user]), [])
+        self.assertEqual(report_totals(self.user), totals)
+
+        output = StringIO()
+        call_command("recategorize", stdout=output)
+        self.assertIn("Moved 0 transactions", output.getvalue())
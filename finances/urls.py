@@ -6,12 +6,31 @@ from . import views
 urlpatterns = [
     path('', views.HomeView.as_view(), name="home"),
     path('create_transaction/', views.CreateTransactionView.as_view(), name="create_transaction"),
+    path('import_transactions/', views.ImportTransactionsView.as_view(), name="import_transactions"),
     path('create_category/', views.CreateCategoryView.as_view(), name="create_category"),
     path('transaction/delete/<int:pk>', views.DeleteTransactionView.as_view(), name="delete_transaction"),
+    path('transactions/bulk/', views.BulkTransactionsView.as_view(), name="bulk_transactions"),
     path('category/delete/<int:pk>', views.DeleteCategoryView.as_view(), name="delete_category"),
     path('report/expenses/', views.ExpensesView.as_view(), name="expenses"),
     path('report/incomes/', views.IncomesView.as_view(), name="incomes"),
+    path('report/export/', views.ExportTransactionsView.as_view(), name="export_transactions"),
+    path('report/analytics/', views.AnalyticsView.as_view(), name="analytics"),
+    path('report/balance/', views.BalanceView.as_view(), name="balance"),
+    path('budgets/', views.BudgetsView.as_view(), name="budgets"),
+    path('budgets/delete/<int:pk>', views.DeleteBudgetView.as_view(), name="delete_budget"),
+    path('rules/', views.RulesView.as_view(), name="rules"),
+    path('rules/delete/<int:pk>', views.DeleteRuleView.as_view(), name="delete_rule"),
     path('report/', views.ReportView.as_view(), name="report"),
+    path('statements/', views.StatementsView.as_view(), name="statements"),
+    path('statements/<int:pk>/', views.StatementStatusView.as_view(), name="statement_status"),
+    path('statements/<int:pk>/download', views.StatementDownloadView.as_view(), name="statement_download"),
+    path('async/create_transaction/', views.AsyncCreateTransactionView.as_view(), name="async_create_transaction"),
+    path('async/report/expenses/', views.AsyncExpensesView.as_view(), name="async_expenses"),
+    path('async/report/incomes/', views.AsyncIncomesView.as_view(), name="async_incomes"),
+    path('async/report/', views.AsyncReportView.as_view(), name="async_report"),
+    path('api/v1/transactions/', views.ApiTransactionsView.as_view(), name="api_transactions"),
+    path('api/v1/categories/', views.ApiCategoriesView.as_view(), name="api_categories"),
+    path('api/v1/balance/', views.ApiBalanceView.as_view(), name="api_balance"),
     path('login/', views.LoginUserView.as_view(), name="login"),
     path('logout/', views.LogoutUserView.as_view(), name="logout"),
     path('register/', views.RegisterUserView.as_view(), name="register")
@@ -1,23 +1,85 @@
 """
 Defines all the user views for financial control
 """
-from decimal import Decimal
+import asyncio
+import codecs
+import datetime
+from asgiref.sync import sync_to_async
+from django.db.transaction import atomic
 from django.db.models.base import Model as Model
 from django.db.models.query import QuerySet
-from django.http import HttpRequest, HttpResponse
-from django.urls import reverse_lazy
+from django.http import (
+    Http404, HttpRequest, HttpResponse, HttpResponseBadRequest, JsonResponse,
+    StreamingHttpResponse
+)
+from django.urls import reverse, reverse_lazy
 from django.shortcuts import redirect
-from django.contrib.auth import login, logout, authenticate
+from django.contrib import messages
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.forms import AuthenticationForm
 from django.utils.decorators import method_decorator
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import etag
 from django.views.generic import TemplateView, ListView, FormView, View, DeleteView
-from .models import Transaction, Category
-from .forms import CustomUserForm, TransactionForm, CategoryForm
+from .aggregates import apply_to_summaries, areport_totals, report_totals
+from .api import (
+    category_rows, data_etag, json_response, transactions_page, transactions_since
+)
+from .analytics import DEFAULT_WINDOW, GRANULARITIES, GROUPINGS, time_series
+from .archive import reaches_archive
+from .balances import balance_on
+from .budgets import budget_statuses, exceeded_budget
+from .bulk import delete_category, delete_transactions, move_transactions
+from .caching import aget_or_compute, get_or_compute
+from .exporters import EXPORT_FORMATS, export_rows
+from .filters import TransactionFilterMixin, category_choices, filter_transactions
+from .importers import import_transactions
+from .jobs import enqueue
+from .models import ArchivedTransaction, Budget, CategoryRule, Job, Transaction, Category
+from .pagination import KeysetPaginationMixin
+from .forms import (
+    CustomUserForm, TransactionForm, CategoryForm, ImportForm, BulkActionForm, BudgetForm,
+    StatementForm, RuleForm
+)
 
 REPORT_TEMPLATE_URL = "/report/"
 ERROR_MESSAGE_RESPONSE = "Something is wrong"
 
+@atomic
+def save_transaction(form, user):
+    """
+    Save the transaction of a valid form and apply it to the summaries
+    and to the balance of the user, then check its budget
+    """
+    # Define the transaction information
+    transaction = form.save(commit=False)
+    transaction.user = user
+    # update the user balance first: its UPDATE locks the user row, so
+    # the transactions of a user get their ids in commit order
+    user.apply_balance_change(transaction.signed_amount)
+    transaction.save()
+    apply_to_summaries([transaction])
+    # Read under the write lock of the transaction, with the summary that
+    # was just updated
+    transaction.exceeded_budget = exceeded_budget(transaction)
+    return transaction
+
+
+def warn_exceeded_budget(request, transaction):
+    """
+    Warn the user when a new expense left its category over budget
+    """
+    budget = transaction.exceeded_budget
+    if budget is not None:
+        messages.warning(
+            request,
+            f"You are over the {budget.category.title} budget: "
+            f"${budget.spent} spent of ${budget.amount} this month",
+        )
+
+
 # Create your views here.
 class HomeView(TemplateView):
     """
@@ -37,23 +99,22 @@ class CreateTransactionView(FormView):
     success_url = ""
 
     def form_valid(self, form):
-        # Define the transaction information
-        transaction = form.save(commit=False)
-        transaction.user = self.request.user
-        transaction.save()
+        transaction = save_transaction(form, self.request.user)
+        warn_exceeded_budget(self.request, transaction)
+        return redirect(self.get_transaction_url(transaction))
 
-        # Save the transaction amount
-        amount = Decimal(self.request.POST['amount'])
+    def get_transaction_url(self, transaction):
         # Check if there is a expense or income
-        if self.request.POST['transaction_type'] == "EX":
-            self.request.user.total_amount -= amount
+        if transaction.transaction_type == "EX":
             self.success_url = "/report/expenses/"
         else:
-            self.request.user.total_amount += amount
             self.success_url = "/report/incomes/"
-        # update the user information
-        self.request.user.save()
-        return redirect(self.success_url)
+        return self.success_url
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["user"] = self.request.user
+        return kwargs
 
     def form_invalid(self, form):
         return self.render_to_response(
@@ -62,13 +123,41 @@ class CreateTransactionView(FormView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        categories = Category.objects.filter(user=self.request.user)
-        categories_size = len(categories)
+        # Evaluate once, the template iterates the same list
+        categories = list(
+            Category.objects.filter(user=self.request.user).only("id", "title"))
         context["categories"] = categories
-        context["categories_size"] = categories_size
+        context["categories_size"] = len(categories)
         return context
 
 
+@method_decorator(login_required, name="dispatch")
+class ImportTransactionsView(FormView):
+    """
+    Import the transactions of a bank statement file
+    """
+    template_name = "import_transactions.html"
+    form_class = ImportForm
+
+    def form_valid(self, form):
+        # Decode the upload line by line instead of reading it whole
+        lines = codecs.iterdecode(form.cleaned_data["file"], "utf-8-sig")
+        try:
+            result = import_transactions(
+                self.request.user, lines, form.cleaned_data["file_format"])
+        except UnicodeDecodeError:
+            form.add_error("file", "The file is not UTF-8 text.")
+            return self.form_invalid(form)
+        return self.render_to_response(
+            self.get_context_data(form=form, result=result)
+        )
+
+    def form_invalid(self, form):
+        return self.render_to_response(
+            self.get_context_data(form=form, error=ERROR_MESSAGE_RESPONSE)
+        )
+
+
 @method_decorator(login_required, name="dispatch")
 class CreateCategoryView(FormView):
     """
@@ -106,15 +195,18 @@ class DeleteTransactionView(DeleteView):
     template_name = "delete_transaction.html"
     success_url = reverse_lazy('report')
 
+    def get_queryset(self):
+        return Transaction.objects.filter(user=self.request.user)
+
+    @atomic
     def post(self, request, *args, **kwargs):
-        user_info = self.request.user
-        transaction = self.get_object()
-        if transaction.transaction_type == "EX":
-            user_info.total_amount += transaction.amount
-        else:
-            user_info.total_amount -= transaction.amount
-        user_info.save()
-        return super().post(request, *args, **kwargs)
+        transaction = self.object = self.get_object()
+        # Only the request that really deletes the row reverts its amount
+        deleted, _ = transaction.delete()
+        if deleted:
+            self.request.user.apply_balance_change(-transaction.signed_amount, rewrite=True)
+            apply_to_summaries([transaction], sign=-1)
+        return redirect(self.get_success_url())
 
 
 @method_decorator(login_required, name="dispatch")
@@ -126,68 +218,499 @@ class DeleteCategoryView(DeleteView):
     template_name = "delete_category.html"
     success_url = reverse_lazy('create_category')
 
+    def get_queryset(self):
+        return Category.objects.filter(user=self.request.user)
+
+    def form_valid(self, form):
+        # Also reverts the transactions of the category from the balance
+        delete_category(self.request.user, self.object)
+        return redirect(self.get_success_url())
+
 
 @method_decorator(login_required, name="dispatch")
-class ExpensesView(ListView):
+class BudgetsView(FormView):
     """
-    List of expenses of the user
+    Set the monthly budgets and show how much of each one is spent
     """
-    model = Transaction
-    template_name = "expenses.html"
-    context_object_name = "expenses"
+    template_name = "budgets.html"
+    form_class = BudgetForm
+    success_url = reverse_lazy('budgets')
 
-    def get_queryset(self):
-        user_info = self.request.user
-        return Transaction.objects.filter(user=user_info, transaction_type="EX")
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["user"] = self.request.user
+        return kwargs
+
+    def form_valid(self, form):
+        # Setting the budget of a category again replaces it
+        Budget.objects.update_or_create(
+            user=self.request.user,
+            category=form.cleaned_data["category"],
+            defaults={"amount": form.cleaned_data["amount"]},
+        )
+        return redirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        return self.render_to_response(
+            self.get_context_data(form=form, error=ERROR_MESSAGE_RESPONSE)
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["expense_count"] = self.get_queryset().count()
+        context["budgets"] = budget_statuses(self.request.user)
+        context["categories"] = Category.objects.filter(
+            user=self.request.user).only("id", "title")
         return context
 
 
 @method_decorator(login_required, name="dispatch")
-class IncomesView(ListView):
+class DeleteBudgetView(DeleteView):
     """
-    List of incomes of the user
+    Delete a budget in system
     """
-    model = Transaction
-    template_name = "incomes.html"
-    context_object_name = "incomes"
+    model = Budget
+    template_name = "delete_budget.html"
+    success_url = reverse_lazy('budgets')
 
     def get_queryset(self):
-        user_info = self.request.user
-        return Transaction.objects.filter(user=user_info, transaction_type="IN")
+        return Budget.objects.filter(user=self.request.user)
+
+
+@method_decorator(login_required, name="dispatch")
+class RulesView(FormView):
+    """
+    Create the rules that categorize new transactions and list them in
+    the order they are tried
+    """
+    template_name = "rules.html"
+    form_class = RuleForm
+    success_url = reverse_lazy('rules')
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["user"] = self.request.user
+        return kwargs
+
+    def form_valid(self, form):
+        rule = form.save(commit=False)
+        rule.user = self.request.user
+        rule.save()
+        return redirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        return self.render_to_response(
+            self.get_context_data(form=form, error=ERROR_MESSAGE_RESPONSE)
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["incomes_count"] = self.get_queryset().count()
+        context["rules"] = (
+            CategoryRule.objects.filter(user=self.request.user)
+            .select_related("category").order_by("priority", "id")
+        )
+        context["categories"] = Category.objects.filter(
+            user=self.request.user).only("id", "title")
         return context
 
 
 @method_decorator(login_required, name="dispatch")
-class ReportView(ListView):
+class DeleteRuleView(DeleteView):
+    """
+    Delete a categorization rule in system
+    """
+    model = CategoryRule
+    template_name = "delete_rule.html"
+    success_url = reverse_lazy('rules')
+
+    def get_queryset(self):
+        return CategoryRule.objects.filter(user=self.request.user)
+
+
+@method_decorator(login_required, name="dispatch")
+class BulkTransactionsView(View):
+    """
+    Delete or move the selected transactions, or every transaction that
+    matches the filters of a listing
+    """
+    def post(self, request):
+        form = BulkActionForm(request.POST)
+        if not form.is_valid():
+            return HttpResponseBadRequest(ERROR_MESSAGE_RESPONSE)
+
+        queryset = Transaction.objects.filter(user=request.user)
+        # The listings also show the archived transactions of their range
+        archived = None
+        if request.user.archived_before is not None:
+            archived = ArchivedTransaction.objects.filter(user=request.user)
+        if form.cleaned_data["select_all"]:
+            categories = category_choices(request.user)
+            filters = form.active_filters()
+            queryset = filter_transactions(queryset, categories, **filters)
+            if reaches_archive(request.user, filters.get("date_from"), filters.get("date_to")):
+                archived = filter_transactions(archived, categories, **filters)
+            else:
+                archived = None
+        else:
+            queryset = queryset.filter(id__in=form.cleaned_data["ids"])
+            if archived is not None:
+                archived = archived.filter(id__in=form.cleaned_data["ids"])
+
+        if form.cleaned_data["action"] == "delete":
+            delete_transactions(request.user, queryset, archived)
+        else:
+            try:
+                category = Category.objects.get(
+                    user=request.user, id=form.cleaned_data["target_category"])
+            except Category.DoesNotExist:
+                return HttpResponseBadRequest(ERROR_MESSAGE_RESPONSE)
+            move_transactions(request.user, queryset, category, archived)
+
+        next_url = request.POST.get("next", "")
+        if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+            next_url = REPORT_TEMPLATE_URL
+        return redirect(next_url)
+
+
+@method_decorator(login_required, name="dispatch")
+class ExpensesView(TransactionFilterMixin, KeysetPaginationMixin, ListView):
+    """
+    List of expenses of the user
+    """
+    model = Transaction
+    template_name = "expenses.html"
+    context_object_name = "expenses"
+    cache_name = "expenses"
+    transaction_type = "EX"
+
+
+@method_decorator(login_required, name="dispatch")
+class IncomesView(TransactionFilterMixin, KeysetPaginationMixin, ListView):
+    """
+    List of incomes of the user
+    """
+    model = Transaction
+    template_name = "incomes.html"
+    context_object_name = "incomes"
+    cache_name = "incomes"
+    transaction_type = "IN"
+
+
+@method_decorator(login_required, name="dispatch")
+class ReportView(TransactionFilterMixin, KeysetPaginationMixin, ListView):
     """
     General report of expenses and incomes
     """
     model = Transaction
     template_name = "report.html"
     context_object_name = "transactions"
-
-    def get_queryset(self):
-        user_info = self.request.user
-        return Transaction.objects.filter(user=user_info)
+    cache_name = "report"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_info = self.request.user
+        transactions = context["transactions"]
         context["total_amount"] = self.request.user.total_amount
-        context["transactions_count"] = self.get_queryset().count()
-        context["expenses"] = Transaction.objects.filter(user=user_info, transaction_type="EX")
-        context["incomes"] = Transaction.objects.filter(user=user_info, transaction_type="IN")
+        context["totals"] = get_or_compute(
+            self.request.user, "report-totals",
+            lambda: report_totals(self.request.user))
+        # Split the current page instead of querying each type again
+        context["expenses"] = [
+            transaction for transaction in transactions
+            if transaction.transaction_type == "EX"
+        ]
+        context["incomes"] = [
+            transaction for transaction in transactions
+            if transaction.transaction_type == "IN"
+        ]
         return context
 
 
+@method_decorator(login_required, name="dispatch")
+class ExportTransactionsView(View):
+    """
+    Download the whole ledger of the user as CSV or NDJSON
+    """
+    def get(self, request):
+        """
+        Stream the transactions without loading them all in memory
+        """
+        file_format = request.GET.get("format", "csv")
+        if file_format not in EXPORT_FORMATS:
+            return HttpResponseBadRequest(ERROR_MESSAGE_RESPONSE)
+        encode, content_type = EXPORT_FORMATS[file_format]
+        response = StreamingHttpResponse(
+            encode(export_rows(request.user)), content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="transactions.{file_format}"')
+        return response
+
+
+@method_decorator(login_required, name="dispatch")
+class AnalyticsView(View):
+    """
+    Income and expense trends of the user as JSON
+    """
+    def get(self, request):
+        """
+        Return the series for the granularity and grouping of the query
+        """
+        granularity = request.GET.get("granularity", "month")
+        group_by = request.GET.get("group_by", "type")
+        if granularity not in GRANULARITIES or group_by not in GROUPINGS:
+            return JsonResponse({"error": ERROR_MESSAGE_RESPONSE}, status=400)
+        try:
+            window = int(request.GET.get("window", DEFAULT_WINDOW))
+            date_from = self.parse_date(request.GET.get("from"))
+            date_to = self.parse_date(request.GET.get("to"))
+        except ValueError:
+            return JsonResponse({"error": ERROR_MESSAGE_RESPONSE}, status=400)
+        if window < 1:
+            return JsonResponse({"error": ERROR_MESSAGE_RESPONSE}, status=400)
+
+        key = f"analytics:{granularity}:{group_by}:{window}:{date_from}:{date_to}"
+        data = get_or_compute(request.user, key, lambda: time_series(
+            request.user, granularity, group_by, window, date_from, date_to))
+        return JsonResponse(data)
+
+    @staticmethod
+    def parse_date(value):
+        if not value:
+            return None
+        return datetime.date.fromisoformat(value)
+
+
+# async views, served without a thread per request under ASGI
+class AsyncLoginRequiredMixin:
+    """
+    Load the user of the session without blocking the event loop, then
+    let the login_required of the synchronous view check it
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncKeysetListMixin(AsyncLoginRequiredMixin):
+    """
+    Async get for the keyset paginated listings
+    """
+    async def get(self, request, *args, **kwargs):
+        # The search reads the categories of the user
+        await self.aget_filter_categories()
+        self.object_list = self.get_queryset()
+        context = await self.aget_context_data()
+        return self.render_to_response(context)
+
+
+class AsyncExpensesView(AsyncKeysetListMixin, ExpensesView):
+    """
+    Async version of ExpensesView
+    """
+
+
+class AsyncIncomesView(AsyncKeysetListMixin, IncomesView):
+    """
+    Async version of IncomesView
+    """
+
+
+class AsyncReportView(AsyncKeysetListMixin, ReportView):
+    """
+    Async version of ReportView, the page and the totals are fetched
+    concurrently
+    """
+    async def aget_context_data(self, **kwargs):
+        user = self.request.user
+        context, totals = await asyncio.gather(
+            super().aget_context_data(**kwargs),
+            aget_or_compute(user, "report-totals", lambda: areport_totals(user)),
+        )
+        transactions = context["transactions"]
+        context["total_amount"] = user.total_amount
+        context["totals"] = totals
+        context["expenses"] = [
+            transaction for transaction in transactions
+            if transaction.transaction_type == "EX"
+        ]
+        context["incomes"] = [
+            transaction for transaction in transactions
+            if transaction.transaction_type == "IN"
+        ]
+        return context
+
+
+class AsyncCreateTransactionView(AsyncLoginRequiredMixin, CreateTransactionView):
+    """
+    Async version of CreateTransactionView
+    """
+    http_method_names = ["get", "post", "options"]
+
+    async def get(self, request, *args, **kwargs):
+        return self.render_to_response(await self.aget_context_data())
+
+    async def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        # Validation fetches the category and saving needs a database
+        # transaction, neither has an async API
+        if not await sync_to_async(form.is_valid)():
+            return self.render_to_response(
+                await self.aget_context_data(form=form, error=ERROR_MESSAGE_RESPONSE)
+            )
+        transaction = await sync_to_async(save_transaction)(form, request.user)
+        warn_exceeded_budget(request, transaction)
+        return redirect(self.get_transaction_url(transaction))
+
+    async def aget_context_data(self, **kwargs):
+        # Skip the synchronous categories query of CreateTransactionView
+        context = super(CreateTransactionView, self).get_context_data(**kwargs)
+        categories = [
+            category async for category in
+            Category.objects.filter(user=self.request.user).only("id", "title")
+        ]
+        context["categories"] = categories
+        context["categories_size"] = len(categories)
+        return context
+
+
+@method_decorator(login_required, name="dispatch")
+class BalanceView(View):
+    """
+    Balance of the user at the end of a date as JSON
+    """
+    def get(self, request):
+        """
+        Return the balance on the date of the query, today by default
+        """
+        try:
+            date = AnalyticsView.parse_date(request.GET.get("date")) or datetime.date.today()
+        except ValueError:
+            return JsonResponse({"error": ERROR_MESSAGE_RESPONSE}, status=400)
+        balance = get_or_compute(
+            request.user, f"balance:{date}", lambda: balance_on(request.user, date))
+        return JsonResponse({"date": date.isoformat(), "balance": str(balance)})
+
+
+@method_decorator(login_required, name="dispatch")
+class StatementsView(FormView):
+    """
+    Request monthly statements, generated in the background by the job
+    queue, and list the recent ones
+    """
+    template_name = "statements.html"
+    form_class = StatementForm
+    success_url = reverse_lazy('statements')
+    recent = 10
+
+    def form_valid(self, form):
+        enqueue(
+            self.request.user, "statement",
+            month=form.cleaned_data["month"].isoformat(), format=form.cleaned_data["format"])
+        return redirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        return self.render_to_response(
+            self.get_context_data(form=form, error=ERROR_MESSAGE_RESPONSE)
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["jobs"] = list(
+            Job.objects.filter(user=self.request.user, kind="statement")
+            .defer("result").order_by("-id")[:self.recent]
+        )
+        context["pending"] = any(not job.is_finished for job in context["jobs"])
+        return context
+
+
+def job_status(job):
+    data = {"id": job.pk, "status": job.get_status_display().lower()}
+    if job.status == "D":
+        data["download"] = reverse("statement_download", args=[job.pk])
+    elif job.status == "F":
+        data["error"] = ERROR_MESSAGE_RESPONSE
+    return data
+
+
+@method_decorator(login_required, name="dispatch")
+class StatementStatusView(View):
+    """
+    Status of a statement job as JSON, polled until it is finished
+    """
+    def get(self, request, pk):
+        job = Job.objects.filter(
+            user=request.user, kind="statement", pk=pk).defer("result").first()
+        if job is None:
+            raise Http404("No such statement")
+        return JsonResponse(job_status(job))
+
+
+@method_decorator(login_required, name="dispatch")
+class StatementDownloadView(View):
+    """
+    Download a generated statement
+    """
+    def get(self, request, pk):
+        job = Job.objects.filter(
+            user=request.user, kind="statement", pk=pk, status="D").first()
+        if job is None:
+            raise Http404("No such statement")
+        response = HttpResponse(bytes(job.result), content_type=job.result_type)
+        response["Content-Disposition"] = f'attachment; filename="{job.result_name}"'
+        return response
+
+
+class ApiLoginRequiredMixin:
+    """
+    Answer the API calls without a logged in user with a JSON error
+    instead of a redirect to the login page
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({"error": "Authentication required"}, status=401)
+        return super().dispatch(request, *args, **kwargs)
+
+
+# The read-only JSON API. Responses carry a weak ETag of the data version
+# of the user, so an unchanged poll gets a 304 without reading any row.
+class ApiTransactionsView(ApiLoginRequiredMixin, View):
+    """
+    The transactions of the user, by keyset pages or as a delta sync
+    """
+    def get(self, request):
+        transaction_type = request.GET.get("type") or None
+        if transaction_type not in (None, "EX", "IN"):
+            return JsonResponse({"error": ERROR_MESSAGE_RESPONSE}, status=400)
+        return self.get_transactions(request, transaction_type)
+
+    @method_decorator(etag(data_etag))
+    def get_transactions(self, request, transaction_type):
+        since = request.GET.get("since")
+        if since:
+            return json_response(transactions_since(request.user, since, transaction_type))
+        return json_response(
+            transactions_page(request.user, request.GET.get("cursor"), transaction_type))
+
+
+class ApiCategoriesView(ApiLoginRequiredMixin, View):
+    """
+    The categories of the user
+    """
+    @method_decorator(etag(data_etag))
+    def get(self, request):
+        return json_response({"results": category_rows(request.user)})
+
+
+class ApiBalanceView(ApiLoginRequiredMixin, View):
+    """
+    The current balance of the user
+    """
+    @method_decorator(etag(data_etag))
+    def get(self, request):
+        return json_response(
+            {"balance": request.user.total_amount, "currency": request.user.currency})
+
+
 # user views
 class RegisterUserView(FormView):
     """
@@ -224,16 +747,11 @@ class LoginUserView(FormView):
 
     def form_valid(self, form):
         """
-        Authenticate if there is a user with the username and password
+        Log in the user the form authenticated, checking the password
+        only once
         """
-        username = self.request.POST['username']
-        password = self.request.POST['password']
-        user = authenticate(self.request, username=username, password=password)
-        if user is not None:
-            login(self.request, user)
-            return redirect(self.success_url)
-        else:
-            return self.form_invalid(form)
+        login(self.request, form.get_user())
+        return redirect(self.success_url)
 
     def form_invalid(self, form):
         """
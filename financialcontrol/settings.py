@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'finances.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,13 +75,147 @@ WSGI_APPLICATION = 'financialcontrol.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_ENGINE selects sqlite (default) or postgresql, the other
+# DATABASE_* variables describe the server
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+# Seconds a connection is kept open between requests, 0 closes it at the
+# end of every request
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', '60'))
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'financialcontrol'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': DATABASE_CONN_MAX_AGE > 0,
+        }
+    }
+    if os.environ.get('DATABASE_POOL') == '1':
+        # psycopg 3 connection pool, it replaces persistent connections
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = False
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', '10')),
+            },
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Take the write lock when the transaction begins, so
+                # writers wait for busy_timeout instead of failing with
+                # "database is locked" when a read turns into a write
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# PRAGMAs set on every new SQLite connection by finances.db
+SQLITE_PRAGMAS = {
+    # Readers do not block the writer and the writer does not block readers
+    'journal_mode': 'wal',
+    # Safe with WAL, only the last commits can be lost on a power failure
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# The default cache lives in each process. Set CACHE_BACKEND and
+# CACHE_LOCATION to a backend shared by every process (Redis, memcached,
+# the database or the file system) to also cache the user of each request.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+# Backends whose entries are only seen by the process that wrote them
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'financialcontrol'),
+        # Room for the rendered transaction cards next to the report pages
+        'OPTIONS': {'MAX_ENTRIES': 20000},
     }
 }
 
+# Per-user cache of report pages and totals
+REPORT_CACHE_ENABLED = True
+REPORT_CACHE_ALIAS = 'default'
+REPORT_CACHE_TIMEOUT = 300
+# Rendered transaction cards, keyed by id and the data version of the user
+CARD_CACHE_TIMEOUT = 3600
+
+# Currency of new users, and the currency the exchange rate files are
+# quoted against (the ECB reference rates are per euro)
+BASE_CURRENCY = 'USD'
+EXCHANGE_RATE_PIVOT = 'EUR'
+
+
+# Background jobs of the database queue, see manage.py run_workers.
+# Running jobs older than JOB_TIMEOUT seconds are taken as abandoned by
+# a dead worker and queued again, at most JOB_MAX_ATTEMPTS times.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_POLL_INTERVAL = 1.0
+JOB_TIMEOUT = 600
+JOB_MAX_ATTEMPTS = 3
+
+
+# Request instrumentation: Server-Timing headers, rolling per-view
+# histograms (see manage.py perfstats) and N+1 warnings
+PERFORMANCE_INSTRUMENTATION = os.environ.get('PERFORMANCE_INSTRUMENTATION') == '1'
+PERFORMANCE_STATS_DIR = BASE_DIR / 'perfstats'
+PERFORMANCE_FLUSH_INTERVAL = 10
+PERFORMANCE_SAMPLES = 1000
+PERFORMANCE_DEFAULT_QUERY_BUDGET = 10
+PERFORMANCE_QUERY_BUDGETS = {
+    'home': 2,
+    'import_transactions': 2,
+    'create_transaction': 9,
+    'create_category': 4,
+    'delete_transaction': 8,
+    'delete_category': 15,
+    'bulk_transactions': 10,
+    'expenses': 4,
+    'incomes': 4,
+    'report': 5,
+    'async_create_transaction': 9,
+    'async_expenses': 4,
+    'async_incomes': 4,
+    'async_report': 5,
+    'export_transactions': 3,
+    'analytics': 3,
+    'balance': 4,
+    'budgets': 4,
+    'rules': 4,
+    'statements': 5,
+    'statement_status': 2,
+    'statement_download': 2,
+    'api_transactions': 4,
+    'api_categories': 3,
+    'api_balance': 2,
+    'delete_budget': 5,
+    'delete_rule': 5,
+    'login': 10,
+    'logout': 4,
+    'register': 11,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -116,6 +251,21 @@ LOGIN_URL = '/login'
 
 AUTH_USER_MODEL = "finances.CustomUser"
 
+# The user of each request is read from the cache when the cache is
+# shared, see finances.caching.get_cached_user. A cache of each process
+# would keep serving users changed by the other processes.
+if CACHE_BACKEND in LOCAL_CACHE_BACKENDS:
+    AUTHENTICATION_BACKENDS = ['django.contrib.auth.backends.ModelBackend']
+else:
+    AUTHENTICATION_BACKENDS = ['finances.auth.CachedModelBackend']
+USER_CACHE_TIMEOUT = 3600
+
+# SESSION_STORE selects where sessions live: db, cached_db (default,
+# reads from the cache and writes through to the database), cache, or
+# signed_cookies (no server storage, the cookie is signed with SECRET_KEY)
+SESSION_STORE = os.environ.get('SESSION_STORE', 'cached_db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_STORE}'
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')